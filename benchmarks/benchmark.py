@@ -0,0 +1,135 @@
+"""
+Copyright 2016, SolidBuilds.com. All rights reserved.
+Author: Ling Thio, ling.thio@gmail.com
+
+Benchmarks SigningHubAPI against the in-process FakeSigningHub server.
+
+Runs the show_iframe-style provisioning chain and the package listing at several concurrency levels,
+and reports throughput and p50/p95/p99 latencies. Run from the repository root:
+
+    python benchmarks/benchmark.py
+    python benchmarks/benchmark.py --latency 0.02 --throttle-rate 0.01 --concurrency 1 8 32
+"""
+
+from __future__ import print_function
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from signinghub_api import SigningHubAPI, RetryPolicy, HistogramCollector, provision_package  # noqa: E402
+from signinghub_api.fake_server import FakeSigningHub                                         # noqa: E402
+
+LIBRARY_DOCUMENT_ID = 1234
+TEMPLATE_NAME = 'ExampleContractTemplate'
+FIELD_NAME = 'SH_FF_TEXT_314'
+
+
+# Returns the p-th percentile (0-100) of sorted_values, using the nearest-rank method
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return 0.0
+    rank = max(1, int(round(p / 100.0 * len(sorted_values) + 0.5)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+# Calls operation(i) for i in range(count) on concurrency threads.
+# Returns (elapsed seconds, sorted list of per-operation latencies, number of failed operations).
+def run(operation, count, concurrency):
+    def timed(i):
+        started_at = time.perf_counter()
+        try:
+            ok = operation(i)
+        except Exception:
+            ok = False
+        return time.perf_counter() - started_at, ok
+
+    started_at = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        outcomes = list(executor.map(timed, range(count)))
+    elapsed = time.perf_counter() - started_at
+    latencies = sorted(latency for latency, ok in outcomes)
+    failures = sum(1 for latency, ok in outcomes if not ok)
+    return elapsed, latencies, failures
+
+
+def report(name, concurrency, count, elapsed, latencies, failures):
+    print('%-12s %6d %7d %9.1f %9.1f %9.1f %9.1f %7d' % (
+        name, concurrency, count, count / elapsed if elapsed else 0.0,
+        percentile(latencies, 50) * 1000, percentile(latencies, 95) * 1000, percentile(latencies, 99) * 1000,
+        failures))
+
+
+def create_api(server, concurrency, retries, collector):
+    return server.configure(SigningHubAPI('client', 'secret', 'user', 'password', pool_maxsize=concurrency,
+                                          retry_policy=RetryPolicy(max_attempts=retries, backoff_base=0.01),
+                                          verbose=False, instrumentation=collector))
+
+
+def benchmark_provisioning(server, concurrency, count, retries, collector):
+    api = create_api(server, concurrency, retries, collector)
+
+    def provision(i):
+        recipient = {'user_email': 'user%d@example.com' % i, 'user_name': 'User %d' % i,
+                     'fields': {FIELD_NAME: 'Value %d' % i}}
+        provision_package(api, recipient, LIBRARY_DOCUMENT_ID, TEMPLATE_NAME)
+        return True
+
+    api.get_access_token()
+    try:
+        return run(provision, count, concurrency)
+    finally:
+        api.close()
+
+
+def benchmark_listing(server, concurrency, count, retries, page_size, collector):
+    api = create_api(server, concurrency, retries, collector)
+
+    def list_packages(i):
+        return api.get_packages(None, page_no=1, page_size=page_size) is not None
+
+    api.get_access_token()
+    try:
+        return run(list_packages, count, concurrency)
+    finally:
+        api.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark SigningHubAPI against a local fake SigningHub server.')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 4, 16, 64])
+    parser.add_argument('--count', type=int, default=200, help='operations per concurrency level')
+    parser.add_argument('--latency', type=float, default=0.005, help='server latency per request, in seconds')
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--throttle-rate', type=float, default=0.0)
+    parser.add_argument('--retries', type=int, default=3, help='max attempts per call')
+    parser.add_argument('--page-size', type=int, default=100)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--per-endpoint', action='store_true', help='also report latencies per API endpoint')
+    args = parser.parse_args(argv)
+    collector = HistogramCollector() if args.per_endpoint else None
+
+    server = FakeSigningHub(latency=args.latency, error_rate=args.error_rate, throttle_rate=args.throttle_rate,
+                            seed=args.seed).start()
+    try:
+        print('%-12s %6s %7s %9s %9s %9s %9s %7s' % ('benchmark', 'conc', 'ops', 'ops/s', 'p50 ms', 'p95 ms',
+                                                      'p99 ms', 'failed'))
+        for concurrency in args.concurrency:
+            results = benchmark_provisioning(server, concurrency, args.count, args.retries, collector)
+            report('provision', concurrency, args.count, *results)
+        for concurrency in args.concurrency:
+            results = benchmark_listing(server, concurrency, args.count, args.retries, args.page_size, collector)
+            report('get_packages', concurrency, args.count, *results)
+        print('server requests: %d, status codes: %s' % (server.request_count, sorted(server.status_counts.items())))
+        if collector is not None:
+            print()
+            print(collector.report())
+    finally:
+        server.stop()
+
+
+if __name__ == '__main__':
+    main()
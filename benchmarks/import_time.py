@@ -0,0 +1,83 @@
+"""
+Copyright 2016, SolidBuilds.com. All rights reserved.
+Author: Ling Thio, ling.thio@gmail.com
+
+Checks the cold-start import budget of signinghub_api.
+
+Measures, in fresh interpreter processes, how long it takes to import signinghub_api and create a
+SigningHubAPI with the standard-library HTTPClientTransport, and checks that this stays within the budget
+without importing requests, aiohttp, asyncio or sqlite3. Exits with status 1 if the check fails.
+Run from the repository root:
+
+    python benchmarks/import_time.py
+    python benchmarks/import_time.py --budget 40 --runs 11
+"""
+
+from __future__ import print_function
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+DEFAULT_BUDGET_MS = 50.0                 # Budget for the lightweight core, on top of interpreter startup
+HEAVY_MODULES = ('requests', 'aiohttp', 'asyncio', 'sqlite3')
+
+# Runs in a fresh interpreter: times the imports and reports which heavy modules were loaded
+MEASURE = '''
+import json, sys, time
+started_at = time.perf_counter()
+%s
+elapsed = time.perf_counter() - started_at
+print(json.dumps({'ms': elapsed * 1000, 'loaded': [name for name in %r if name in sys.modules]}))
+'''
+
+SCENARIOS = [
+    ('import signinghub_api', 'import signinghub_api'),
+    ('stdlib client', 'from signinghub_api import SigningHubAPI, HTTPClientTransport\n'
+                      'SigningHubAPI(transport=HTTPClientTransport())'),
+    ('requests client', 'from signinghub_api import SigningHubAPI\n'
+                        'SigningHubAPI()'),
+]
+BUDGETED = ('import signinghub_api', 'stdlib client')
+
+
+# Returns (median milliseconds, modules loaded) of code over runs fresh processes
+def measure(code, runs):
+    timings = []
+    loaded = []
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    for i in range(runs):
+        output = subprocess.check_output([sys.executable, '-c', MEASURE % (code, HEAVY_MODULES)], env=env, cwd=ROOT)
+        result = json.loads(output.decode('utf-8').strip().splitlines()[-1])
+        timings.append(result['ms'])
+        loaded = result['loaded']
+    timings.sort()
+    return timings[len(timings) // 2], loaded
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Check the import-time budget of signinghub_api.')
+    parser.add_argument('--budget', type=float, default=DEFAULT_BUDGET_MS, help='milliseconds')
+    parser.add_argument('--runs', type=int, default=7, help='processes per scenario (the median is used)')
+    args = parser.parse_args(argv)
+
+    failures = []
+    print('%-22s %9s  %s' % ('scenario', 'median ms', 'heavy modules loaded'))
+    for name, code in SCENARIOS:
+        median, loaded = measure(code, args.runs)
+        print('%-22s %9.1f  %s' % (name, median, ', '.join(loaded) or '-'))
+        if name in BUDGETED:
+            if median > args.budget:
+                failures.append('%s took %.1f ms (budget %.1f ms)' % (name, median, args.budget))
+            if loaded:
+                failures.append('%s imported %s' % (name, ', '.join(loaded)))
+    for failure in failures:
+        print('FAILED: ' + failure)
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
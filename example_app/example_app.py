@@ -1,6 +1,7 @@
 import json
+import threading
 from flask import Flask, request, current_app, render_template, redirect, url_for
-from signinghub_api import SigningHubAPI
+from signinghub_api import SigningHubAPI, CallbackQueue
 
 # Create a web application with Flask
 app = Flask(__name__)
@@ -26,6 +27,28 @@ recipient_user_email = app.config.get('RECIPIENT_USER_EMAIL')
 recipient_field_name = app.config.get('RECIPIENT_FIELD_NAME')
 recipient_field_value = app.config.get('RECIPIENT_FIELD_VALUE')
 
+
+# Process SigningHub callbacks in the background, so that the callback can be answered right away.
+# Add follow-up work here, such as retrieving the signed document or updating your records.
+def process_callbacks(events):
+    for event in events:
+        print('Package', event.package_id, 'was processed by', event.user_email)
+
+callback_queue = None
+callback_queue_lock = threading.Lock()
+
+# Start the callback queue on the first request, in the process that serves the requests.
+# With debug=True, the reloader imports this module in a second (watcher) process as well,
+# and that process must not start workers on the same database.
+@app.before_request
+def start_callback_queue():
+    global callback_queue
+    if callback_queue is None:
+        with callback_queue_lock:
+            if callback_queue is None:
+                callback_queue = CallbackQueue(process_callbacks,
+                                               path=app.config.get('SIGNINGHUB_CALLBACK_DB', 'callbacks.db')).start()
+
 # Display the home page
 @app.route('/')
 def home_page():
@@ -58,9 +81,9 @@ def show_packages():
 
     # signinghub_api.delete_package(access_token, 201080)
 
-    # Use SigningHubAPI to retrieve a list of library documents
+    # Use SigningHubAPI to retrieve all packages, page after page
     if access_token:
-        packages = signinghub_api.get_packages(access_token)
+        packages = list(signinghub_api.iter_packages(access_token))
     else:
         packages = []
 
@@ -144,6 +167,9 @@ def signinghub_callback():
     language_code = request.args.get('language')
     user_email = request.args.get('user_email')
 
+    # Queue the callback for processing. Duplicate callbacks are ignored.
+    callback_queue.put(request.args.to_dict())
+
     # Render a finished message
     return render_template('finished.html',
                            access_token=access_token,
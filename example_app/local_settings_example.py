@@ -9,6 +9,9 @@ SIGNINGHUB_SCOPE = SIGNINGHUB_USERNAME                  # Authorization scope
 SIGNINGHUB_LIBRARY_DOCUMENT_ID = 1234                   # Must match the ID of a SigningHub Library Document
 SIGNINGHUB_TEMPLATE_NAME = 'ExampleContractTemplate'    # Must match the name of a SigningHub Template
 
+# Callback processing
+SIGNINGHUB_CALLBACK_DB = 'callbacks.db'                 # SQLite file that queues SigningHub callbacks
+
 # Information about the Recipient that signs the document
 RECIPIENT_USER_NAME = 'Your Name'
 RECIPIENT_USER_EMAIL = 'yourname@example.com'
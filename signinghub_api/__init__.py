@@ -1 +1,66 @@
-from .signinghub_api import SigningHubAPI
+# The public names are imported on first use (PEP 562), so that 'import signinghub_api' stays fast:
+# 'from signinghub_api import SigningHubAPI' does not import aiohttp, sqlite3 or the bulk helpers,
+# and with an HTTPClientTransport it does not import requests either.
+import importlib
+
+# deadline.py only uses the standard library. It is imported right away because the deadline() function
+# shares its name with the module: a lazily imported module would replace the function.
+from .deadline import deadline
+
+# Public name -> submodule that defines it
+_EXPORTS = {
+    'SigningHubAPI': 'signinghub_api',
+    'AsyncSigningHubAPI': 'async_api',
+    'provision_packages': 'provisioning',
+    'iter_provision_packages': 'provisioning',
+    'provision_package': 'provisioning',
+    'ProvisioningResult': 'provisioning',
+    'ProvisioningError': 'provisioning',
+    'PackageBuilder': 'builder',
+    'BuildResult': 'builder',
+    'SigningHubClientPool': 'client_pool',
+    'CallbackQueue': 'callback_queue',
+    'CallbackEvent': 'callback_queue',
+    'PackageCatalog': 'catalog',
+    'sweep_packages': 'sweeper',
+    'iter_sweep_packages': 'sweeper',
+    'find_stale_packages': 'sweeper',
+    'SweepResult': 'sweeper',
+    'PackageMirror': 'mirror',
+    'SyncResult': 'mirror',
+    'FieldIndex': 'fields',
+    'FieldFillResult': 'fields',
+    'FieldLayoutCache': 'layout_cache',
+    'RetryPolicy': 'retry',
+    'RateLimiter': 'retry',
+    'CircuitBreaker': 'circuit_breaker',
+    'CircuitBreakers': 'circuit_breaker',
+    'RequestsTransport': 'transport',
+    'HTTPClientTransport': 'transport',
+    'CallResult': 'results',
+    'SigningHubError': 'results',
+    'AuthenticationError': 'results',
+    'NotFoundError': 'results',
+    'RateLimitError': 'results',
+    'ServerError': 'results',
+    'CircuitOpenError': 'results',
+    'DeadlineExceededError': 'results',
+    'Instrumentation': 'instrumentation',
+    'HistogramCollector': 'instrumentation',
+    'CallEvent': 'instrumentation',
+}
+
+__all__ = sorted(list(_EXPORTS) + ['deadline'])
+
+
+def __getattr__(name):
+    module_name = _EXPORTS.get(name)
+    if module_name is None:
+        raise AttributeError('module %r has no attribute %r' % (__name__, name))
+    value = getattr(importlib.import_module('.' + module_name, __name__), name)
+    globals()[name] = value             # Later lookups do not call __getattr__
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_EXPORTS))
@@ -0,0 +1,11 @@
+"""
+Copyright 2016, SolidBuilds.com. All rights reserved.
+Author: Ling Thio, ling.thio@gmail.com
+"""
+
+import sys
+
+from .cli import main
+
+if __name__ == '__main__':
+    sys.exit(main())
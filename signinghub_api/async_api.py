@@ -0,0 +1,417 @@
+"""
+Copyright 2016, SolidBuilds.com. All rights reserved.
+Author: Ling Thio, ling.thio@gmail.com
+"""
+
+import asyncio
+import time
+
+try:
+    import aiohttp
+except ImportError:                      # aiohttp is only needed for AsyncSigningHubAPI
+    aiohttp = None
+
+# Errors that are retried like 5xx responses
+TRANSIENT_ERRORS = (aiohttp.ClientConnectionError, asyncio.TimeoutError) if aiohttp else (asyncio.TimeoutError,)
+
+from .deadline import clip_timeout
+from .fields import FieldIndex
+from .results import SigningHubError, DeadlineExceededError
+from .signinghub_api import SigningHubAPIBase, parse_body, encode_body, _collect_fill, _failed_fill, \
+    OCTET_CONTENT, DEADLINE_EXCEEDED, DEFAULT_FILL_WORKERS, DEFAULT_PAGE_SIZE, DEFAULT_POOL_MAXSIZE, DEFAULT_TIMEOUT
+from .token_manager import AsyncTokenManager, DEFAULT_REFRESH_MARGIN
+from .transfer import UploadStream, DownloadSink, STREAM_CHUNK_SIZE
+
+DEFAULT_POOL_LIMIT = 100                 # Max number of simultaneous connections over all hosts
+
+
+# Creates an aiohttp.ClientSession with a keep-alive connection pool.
+def create_client_session(pool_limit=DEFAULT_POOL_LIMIT, pool_maxsize=DEFAULT_POOL_MAXSIZE, timeout=DEFAULT_TIMEOUT):
+    if aiohttp is None:
+        raise ImportError('AsyncSigningHubAPI requires aiohttp. Install it with: pip install aiohttp')
+    connector = aiohttp.TCPConnector(limit=pool_limit, limit_per_host=pool_maxsize)
+    return aiohttp.ClientSession(connector=connector, timeout=_client_timeout(timeout))
+
+
+# Converts a (connect, read) timeout, or a single number for both, to an aiohttp.ClientTimeout.
+# total optionally limits the whole request, such as to the time left before a deadline.
+def _client_timeout(timeout, total=None):
+    if isinstance(timeout, (tuple, list)):
+        return aiohttp.ClientTimeout(total=total, connect=timeout[0], sock_read=timeout[1])
+    return aiohttp.ClientTimeout(total=total, connect=timeout, sock_read=timeout)
+
+
+# The AsyncSigningHubAPI class offers the SigningHubAPI methods as coroutines.
+# Requests are built and responses are processed by SigningHubAPIBase, exactly like SigningHubAPI does.
+#
+#     async with AsyncSigningHubAPI(client_id, client_secret, username, password) as api:
+#         package_id = await api.add_package(None, 'My Package')
+class AsyncSigningHubAPI(SigningHubAPIBase):
+
+    # Creates an instance of the AsyncSigningHubAPI class.
+    # - session:      Optional aiohttp.ClientSession to use. Created on first use otherwise.
+    # - pool_limit:   Max number of simultaneous connections (ignored if session is given)
+    # - pool_maxsize: Max number of simultaneous connections per host (ignored if session is given)
+    # - timeout:      (connect, read) timeout in seconds, or a single number for both
+    # - field_layout_cache: Optional FieldLayoutCache for get_field_layout()
+    # - retry_policy, retry_policies, rate_limiter, raise_errors, verbose, instrumentation, circuit_breakers:
+    #                 See SigningHubAPI
+    #
+    # All methods that take an access_token argument use the cached access token when access_token is None.
+    def __init__(self, client_id='', client_secret='', username='', password='', scope='',
+                 session=None, pool_limit=DEFAULT_POOL_LIMIT, pool_maxsize=DEFAULT_POOL_MAXSIZE,
+                 timeout=DEFAULT_TIMEOUT, refresh_margin=DEFAULT_REFRESH_MARGIN, field_layout_cache=None,
+                 retry_policy=None, retry_policies=None, rate_limiter=None, raise_errors=False, verbose=True,
+                 instrumentation=None, circuit_breakers=None):
+        super(AsyncSigningHubAPI, self).__init__(client_id, client_secret, username, password, scope, timeout,
+                                                 raise_errors)
+        self.verbose = verbose
+        self.instrumentation = instrumentation
+        self.circuit_breakers = circuit_breakers
+        self.field_layout_cache = field_layout_cache
+        if retry_policy is not None:
+            self.retry_policy = retry_policy
+        self.retry_policies = dict(retry_policies or {})
+        self.rate_limiter = rate_limiter
+        if aiohttp is None and session is None:
+            raise ImportError('AsyncSigningHubAPI requires aiohttp. Install it with: pip install aiohttp')
+        self.pool_limit = pool_limit
+        self.pool_maxsize = pool_maxsize
+
+        # Only close sessions that we created ourselves.
+        # aiohttp sessions must be created inside a running event loop, so ours is created lazily.
+        self._owns_session = session is None
+        self.session = session
+        self.token_manager = AsyncTokenManager(self._authenticate, refresh_margin=refresh_margin)
+
+
+    # Releases the pooled connections (only if the session was created by this instance)
+    async def close(self):
+        if self._owns_session and self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+
+    # Returns a cached access_token on success, authenticating only when the cached token
+    # is missing or about to expire. Use force=True to always obtain a new token.
+    # Returns '' otherwise.
+    async def get_access_token(self, force=False):
+        self.last_function_name = 'SigningHubAPI.get_access_token'
+        return await self.token_manager.get_token(force=force)
+
+
+    async def _authenticate(self, refresh_token=None):
+        return await self._execute(self._build_authenticate(refresh_token))
+
+
+    async def _resolve_token(self, access_token):
+        if access_token is None:
+            access_token = await self.token_manager.get_token()
+        return access_token
+
+
+    async def add_package(self, access_token, package_name):
+        access_token = await self._resolve_token(access_token)
+        package_id = await self._execute(self._build_add_package(access_token, package_name))
+        if package_id:
+            self._notify_package_added(package_id, package_name)
+        return package_id
+
+
+    async def upload_document_from_library(self, access_token, package_id, library_document_id):
+        access_token = await self._resolve_token(access_token)
+        return await self._execute(self._build_upload_document_from_library(access_token, package_id,
+                                                                            library_document_id))
+
+
+    # See SigningHubAPI.upload_document()
+    async def upload_document(self, access_token, package_id, source, file_name=None, convert_document=True,
+                              progress=None, chunk_size=STREAM_CHUNK_SIZE):
+        access_token = await self._resolve_token(access_token)
+        stream = UploadStream(source, progress, chunk_size)
+        try:
+            return await self._execute(self._build_upload_document(access_token, package_id, stream,
+                                                                   file_name or stream.name or 'document.pdf',
+                                                                   convert_document))
+        finally:
+            stream.close()
+
+
+    # See SigningHubAPI.download_document()
+    async def download_document(self, access_token, package_id, document_id, dest, progress=None,
+                                chunk_size=STREAM_CHUNK_SIZE):
+        access_token = await self._resolve_token(access_token)
+        sink = DownloadSink(dest, progress, chunk_size)
+        return await self._execute(self._build_download_document(access_token, package_id, document_id, sink))
+
+
+    async def rename_document(self, access_token, package_id, document_id, document_name):
+        access_token = await self._resolve_token(access_token)
+        return await self._execute(self._build_rename_document(access_token, package_id, document_id, document_name))
+
+
+    async def apply_workflow_template(self, access_token, package_id, document_id, template_name, apply_to_all=True):
+        access_token = await self._resolve_token(access_token)
+        return await self._execute(self._build_apply_workflow_template(access_token, package_id, document_id,
+                                                                       template_name, apply_to_all))
+
+
+    async def delete_package(self, access_token, package_id):
+        access_token = await self._resolve_token(access_token)
+        success = await self._execute(self._build_delete_package(access_token, package_id))
+        if success:
+            self._notify_package_deleted(package_id)
+        return success
+
+
+    async def get_packages(self, access_token, folder='INBOX', page_no=1, page_size=DEFAULT_PAGE_SIZE,
+                           search_text=None, status='ALL'):
+        access_token = await self._resolve_token(access_token)
+        return await self._execute(self._build_get_packages(access_token, folder, page_no, page_size,
+                                                            search_text, status))
+
+
+    # Yields all packages, page after page (see SigningHubAPI.iter_packages()).
+    # The next page is fetched in a separate task while the caller processes the current page.
+    async def iter_packages(self, access_token=None, folder='INBOX', page_size=DEFAULT_PAGE_SIZE,
+                            search_text=None, status='ALL'):
+        page_no = 1
+        task = asyncio.ensure_future(self._get_packages_page(access_token, folder, page_no, page_size,
+                                                             search_text, status))
+        try:
+            while task is not None:
+                packages, result = await task
+                self._set_last_result(result)
+                task = None
+                if packages and len(packages) >= page_size:
+                    page_no += 1
+                    task = asyncio.ensure_future(self._get_packages_page(access_token, folder, page_no, page_size,
+                                                                         search_text, status))
+                for package in packages or ():
+                    yield package
+        finally:
+            if task is not None:
+                task.cancel()
+
+
+    # Runs get_packages() in a prefetch task and returns (packages, CallResult)
+    async def _get_packages_page(self, *args):
+        packages = await self.get_packages(*args)
+        return packages, self.last_result
+
+
+    async def update_workflow_user(self, access_token, package_id, user_email, user_name, order=1, role='SIGNER',
+                                   email_notification=True):
+        access_token = await self._resolve_token(access_token)
+        return await self._execute(self._build_update_workflow_user(access_token, package_id, user_email, user_name,
+                                                                    order, role, email_notification))
+
+
+    async def get_document_fields(self, access_token, package_id, document_id):
+        access_token = await self._resolve_token(access_token)
+        return await self._execute(self._build_get_document_fields(access_token, package_id, document_id))
+
+
+    async def update_textbox_field(self, access_token, package_id, document_id, fields, field_name, field_value):
+        access_token = await self._resolve_token(access_token)
+        return await self._execute(self._build_update_textbox_field(access_token, package_id, document_id,
+                                                                    fields, field_name, field_value))
+
+
+    # Returns the (possibly cached) field layout of a document (see SigningHubAPI.get_field_layout()).
+    async def get_field_layout(self, access_token, package_id, document_id, library_document_id, template_name):
+        cache = self.field_layout_cache
+        if cache is not None:
+            field_index = cache.get(library_document_id, template_name)
+            if field_index is not None:
+                return field_index
+        fields = await self.get_document_fields(access_token, package_id, document_id)
+        if fields is None:
+            return None
+        if cache is not None:
+            cache.put(library_document_id, template_name, fields)
+        return FieldIndex(fields)
+
+
+    # Updates many document fields of any type in one pass (see SigningHubAPI.fill_fields()).
+    # The updates are sent concurrently, at most max_workers at a time.
+    async def fill_fields(self, access_token, package_id, document_id, field_values, fields=None,
+                          max_workers=DEFAULT_FILL_WORKERS, strict=False):
+        access_token = await self._resolve_token(access_token)
+        if fields is None:
+            fields = await self.get_document_fields(access_token, package_id, document_id)
+            if fields is None:
+                return _failed_fill(field_values, self.last_error_message)
+        field_index = fields if isinstance(fields, FieldIndex) else FieldIndex(fields)
+        result, calls = self._build_fill_fields(access_token, package_id, document_id, field_index, field_values,
+                                                strict)
+        semaphore = asyncio.Semaphore(max_workers)
+
+        async def update(field_name, call):
+            async with semaphore:
+                try:
+                    success = await self._execute(call)
+                except SigningHubError as e:
+                    return field_name, False, e.message
+                return field_name, success, None if success else self.last_error_message
+
+        outcomes = await asyncio.gather(*[update(field_name, call) for field_name, call in calls])
+        return _collect_fill(result, outcomes)
+
+
+    async def share_document(self, access_token, package_id):
+        access_token = await self._resolve_token(access_token)
+        success = await self._execute(self._build_share_document(access_token, package_id))
+        if success:
+            self._notify_package_shared(package_id)
+        return success
+
+
+    # Sends call over the shared keep-alive session and returns its return value.
+    # Fails fast when the deadline has passed or the circuit breaker of the endpoint group is open.
+    async def _execute(self, call):
+        if call.method is None:
+            return self._process_unsent(call)
+
+        deadline_at, breaker, rejection = self._admit(call)
+        if rejection is not None:
+            return self._fail_fast(call, *rejection)
+        if breaker is None:
+            return await self._execute_with_retries(call, deadline_at)
+        healthy = None
+        try:
+            return await self._execute_with_retries(call, deadline_at)
+        except TRANSIENT_ERRORS:
+            healthy = False                 # Raised on the normal timeout: the deadline fails fast instead
+            raise
+        finally:
+            self._record_outcome(breaker, healthy, call)
+
+
+    # Sends call, retrying transient errors according to the retry policy of the call,
+    # with request timeouts and retries limited by deadline_at.
+    async def _execute_with_retries(self, call, deadline_at):
+        self.last_function_name = call.function_name
+        instrumentation = self.instrumentation
+        if instrumentation is not None:
+            instrumentation.before_call(call.function_name, call.method, call.endpoint)
+        started_at = time.perf_counter()
+        headers = call.headers()
+        policy = self._retry_policy_for(call)
+        attempt = 0
+        token_refreshed = False
+        # The outcome passed to after_call(), which runs however the call ends
+        status_code = error = None
+        bytes_sent = bytes_received = 0
+        try:
+            while True:
+                attempt += 1
+                bytes_sent = bytes_received = 0
+                wait = self._reserve_slot(deadline_at)
+                if wait is not None:
+                    await _sleep(wait)
+                time_left = None
+                if deadline_at is not None:
+                    time_left = deadline_at - time.monotonic()
+                    if wait is None or time_left <= 0:
+                        # The deadline passed between attempts, or would have passed by the time the
+                        # rate limiter lets this attempt through: this attempt is not sent
+                        attempt -= 1
+                        error = DeadlineExceededError(call.function_name, None, DEADLINE_EXCEEDED)
+                        return self._fail_fast(call, DeadlineExceededError, DEADLINE_EXCEEDED)
+                sent_at = time.perf_counter()
+                try:
+                    response_status, response_headers, body, bytes_sent = await self._send(call, headers, time_left)
+                except TRANSIENT_ERRORS as e:
+                    call.send_elapsed = time.perf_counter() - sent_at
+                    delay = self._retry_within_deadline(policy.retry_delay(call.method, attempt, exception=e),
+                                                        deadline_at)
+                    if delay is None:
+                        error = e
+                        if deadline_at is not None and time.monotonic() >= deadline_at:
+                            # The timeout was shortened to the time left before the deadline
+                            return self._fail_fast(call, DeadlineExceededError, DEADLINE_EXCEEDED)
+                        raise
+                else:
+                    call.send_elapsed = time.perf_counter() - sent_at
+                    delay = self._retry_within_deadline(policy.retry_delay(call.method, attempt, response_status,
+                                                                           response_headers.get('Retry-After')),
+                                                        deadline_at)
+                    if response_status == 429 and delay is not None and self.rate_limiter is not None:
+                        self.rate_limiter.pause(delay)
+                    # An upload from an iterator cannot be resent: its 401 is returned (or raised) as is
+                    if delay is None and not token_refreshed and self._token_rejected(call, response_status) \
+                            and self._can_resend(call):
+                        token_refreshed = True
+                        access_token = await self.token_manager.get_token()
+                        if access_token and access_token != call.access_token:
+                            call.access_token = access_token
+                            headers = call.headers()
+                            continue
+                    if delay is None:
+                        if isinstance(body, int):
+                            data = bytes_received = body
+                        else:
+                            data = parse_body(body.decode('utf-8', 'replace'))
+                            bytes_received = len(body)
+                        status_code = response_status
+                        return self._process_response(call, headers, status_code, data,
+                                                      time.perf_counter() - started_at)
+                await _sleep(delay)
+        except BaseException as e:
+            # Such as a failed download sink, a non-transient transport error or a cancelled task
+            if error is None and status_code is None:
+                error = e
+            raise
+        finally:
+            if instrumentation is not None:
+                self._emit(call, status_code, time.perf_counter() - started_at, bytes_sent, bytes_received,
+                           max(attempt, 1), error)
+
+
+    # Sends one HTTP request over the shared keep-alive session.
+    # Returns (status_code, response headers, response body, request body size).
+    # For calls with a sink, a successful response body is streamed into the sink,
+    # and the number of bytes written is returned instead of the body.
+    # time_left optionally limits the whole request, such as to the time left before a deadline.
+    async def _send(self, call, headers, time_left=None):
+        if self.session is None:
+            self.session = create_client_session(self.pool_limit, self.pool_maxsize, self.timeout)
+        if call.content_type == OCTET_CONTENT:
+            upload = call.payload
+            if upload.rewindable:
+                upload.rewind()
+                headers = dict(headers, **{'Content-Length': str(len(upload))})
+            data = _iter_upload(upload)
+        else:
+            data = encode_body(call)
+        options = {}
+        if time_left is not None:
+            options['timeout'] = _client_timeout(clip_timeout(self.timeout, time_left), time_left)
+        async with self.session.request(call.method, call.url, headers=headers, data=data, **options) as response:
+            if call.content_type == OCTET_CONTENT:
+                bytes_sent = call.payload.position
+            else:
+                bytes_sent = len(data) if data else 0
+            if call.sink is not None and response.status in (200, 201):
+                written = await call.sink.write_async(response.content.iter_chunked(call.sink.chunk_size),
+                                                      response.content_length)
+                return response.status, response.headers, written, bytes_sent
+            return response.status, response.headers, await response.read(), bytes_sent
+
+
+async def _sleep(delay):
+    if delay > 0:
+        await asyncio.sleep(delay)
+
+
+# Yields the chunks of an UploadStream, for aiohttp
+async def _iter_upload(upload):
+    for chunk in upload:
+        yield chunk
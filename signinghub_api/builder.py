@@ -0,0 +1,335 @@
+"""
+Copyright 2016, SolidBuilds.com. All rights reserved.
+Author: Ling Thio, ling.thio@gmail.com
+"""
+
+import asyncio
+import inspect
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+from .deadline import bind_deadline, no_deadline
+from .provisioning import ProvisioningError
+from .results import SigningHubError
+
+DEFAULT_BUILD_WORKERS = 4                # Number of independent steps of one package that run in parallel
+
+
+# The outcome of PackageBuilder.build().
+# - package_id and document_ids are set on success. error and failed_step are set on failure.
+# - timings: step name -> wall time in seconds, for every step that ran
+# - elapsed: wall time of the whole build
+class BuildResult(object):
+    __slots__ = ('package_id', 'document_ids', 'error', 'failed_step', 'timings', 'elapsed')
+
+    def __init__(self, package_id=None, document_ids=None, error=None, failed_step=None, timings=None, elapsed=0.0):
+        self.package_id = package_id
+        self.document_ids = document_ids or []
+        self.error = error
+        self.failed_step = failed_step
+        self.timings = timings or {}
+        self.elapsed = elapsed
+
+    @property
+    def success(self):
+        return self.error is None
+
+    def __repr__(self):
+        if self.success:
+            return '<BuildResult package_id=%s documents=%r elapsed=%.3f>' % (self.package_id, self.document_ids,
+                                                                              self.elapsed)
+        return '<BuildResult failed in %s: %s>' % (self.failed_step, self.error)
+
+
+# Declares a package (name, library documents, workflow templates, field values, signers, share)
+# and builds it with as few sequential round trips as possible.
+#
+# The steps form a dependency graph, and steps whose dependencies are done run in parallel:
+#
+#   add_package > upload:i > rename:i
+#                          > template:i > fields:i (get_field_layout > fill_fields)
+#                                       > signer:n (update_workflow_user, after all templates)
+#   share (after everything else)
+#
+# End-to-end latency is therefore the critical path (add_package > upload > template > fields > share)
+# instead of the sum of all calls. The package is deleted again when a step fails.
+#
+#     result = (PackageBuilder('2017 Contract - Jane')
+#               .add_library_document(1234, template_name='ExampleContractTemplate', fields={'SH_FF_TEXT_314': 'x'})
+#               .add_signer('jane@example.com', 'Jane')
+#               .share()
+#               .build(signinghub_api))
+class PackageBuilder(object):
+
+    def __init__(self, package_name):
+        self.package_name = package_name
+        self.documents = []
+        self.signers = []
+        self.share_package = False
+
+
+    # Adds a document from the document library.
+    # - document_name: Rename the document to this name (optional)
+    # - template_name: Apply this workflow template to the document (optional)
+    # - fields:        dict of field names and values to pre-fill (optional)
+    def add_library_document(self, library_document_id, document_name=None, template_name=None, fields=None):
+        self.documents.append({
+            'library_document_id': library_document_id,
+            'document_name': document_name,
+            'template_name': template_name,
+            'fields': dict(fields or {}),
+        })
+        return self
+
+
+    # Fills in the next workflow recipient of the workflow template(s).
+    # Signers are assigned to workflow positions 1, 2, 3, ... in the order in which they are added,
+    # unless order is given.
+    def add_signer(self, user_email, user_name, role='SIGNER', order=None, email_notification=True):
+        self.signers.append({
+            'user_email': user_email,
+            'user_name': user_name,
+            'role': role,
+            'order': order if order is not None else len(self.signers) + 1,
+            'email_notification': email_notification,
+        })
+        return self
+
+
+    # Shares the package with its signers as the last step
+    def share(self):
+        self.share_package = True
+        return self
+
+
+    # Builds the package with a SigningHubAPI instance, running independent steps on max_workers threads.
+    # Returns a BuildResult.
+    def build(self, api, access_token=None, max_workers=DEFAULT_BUILD_WORKERS):
+        state = _BuildState(access_token, len(self.documents))
+        steps = self._steps()
+        started_at = time.perf_counter()
+        try:
+            _run_threaded(steps, api, state, max_workers)
+        except Exception as e:
+            if state.package_id:
+                _delete_quietly(api, state)
+            return _failed_result(state, e, time.perf_counter() - started_at)
+        return BuildResult(state.package_id, state.document_ids, timings=state.timings,
+                           elapsed=time.perf_counter() - started_at)
+
+
+    # Builds the package with an AsyncSigningHubAPI instance, running independent steps as concurrent tasks.
+    # Returns a BuildResult.
+    async def build_async(self, api, access_token=None):
+        state = _BuildState(access_token, len(self.documents))
+        steps = self._steps()
+        started_at = time.perf_counter()
+        try:
+            await _run_async(steps, api, state)
+        except Exception as e:
+            if state.package_id:
+                try:
+                    with no_deadline():
+                        await api.delete_package(state.access_token, state.package_id)
+                except Exception:
+                    pass
+            return _failed_result(state, e, time.perf_counter() - started_at)
+        return BuildResult(state.package_id, state.document_ids, timings=state.timings,
+                           elapsed=time.perf_counter() - started_at)
+
+
+    # Returns the dependency graph as a list of _Step objects
+    def _steps(self):
+        package_name = self.package_name
+        steps = [_Step('add_package', (), 'add_package',
+                       lambda api, state: api.add_package(state.access_token, package_name),
+                       store=lambda state, package_id: setattr(state, 'package_id', package_id))]
+        template_steps = []
+        for i, document in enumerate(self.documents):
+            steps.extend(_document_steps(i, document))
+            if document['template_name']:
+                template_steps.append('template:%d' % i)
+
+        # Workflow positions come from the templates. Without templates, they only need the documents.
+        signer_deps = tuple(template_steps) or tuple('upload:%d' % i for i in range(len(self.documents)))
+        for signer in self.signers:
+            steps.append(_Step('signer:%d' % signer['order'], signer_deps or ('add_package',), 'update_workflow_user',
+                               _signer_call(signer)))
+
+        if self.share_package:
+            steps.append(_Step('share', tuple(step.name for step in steps), 'share_document',
+                               lambda api, state: api.share_document(state.access_token, state.package_id)))
+        return steps
+
+
+def _document_steps(i, document):
+    library_document_id = document['library_document_id']
+    template_name = document['template_name']
+    field_values = document['fields']
+    upload = 'upload:%d' % i
+    steps = [_Step(upload, ('add_package',), 'upload_document_from_library',
+                   lambda api, state: api.upload_document_from_library(state.access_token, state.package_id,
+                                                                       library_document_id),
+                   store=lambda state, document_id: state.document_ids.__setitem__(i, document_id))]
+
+    if document['document_name']:
+        document_name = document['document_name']
+        steps.append(_Step('rename:%d' % i, (upload,), 'rename_document',
+                           lambda api, state: api.rename_document(state.access_token, state.package_id,
+                                                                  state.document_ids[i], document_name)))
+
+    # Each document gets its own template. Template steps run concurrently, so they must not apply to all documents.
+    fields_deps = (upload,)
+    if template_name:
+        steps.append(_Step('template:%d' % i, (upload,), 'apply_workflow_template',
+                           lambda api, state: api.apply_workflow_template(state.access_token, state.package_id,
+                                                                          state.document_ids[i], template_name,
+                                                                          apply_to_all=False)))
+        fields_deps = ('template:%d' % i,)
+
+    if field_values:
+        steps.append(_Step('layout:%d' % i, fields_deps, 'get_document_fields',
+                           lambda api, state: api.get_field_layout(state.access_token, state.package_id,
+                                                                   state.document_ids[i], library_document_id,
+                                                                   template_name),
+                           store=lambda state, field_index: state.field_indexes.__setitem__(i, field_index),
+                           check=lambda api, field_index: None if field_index is not None else
+                           (api.last_error_message or 'Unknown error')))
+        steps.append(_Step('fields:%d' % i, ('layout:%d' % i,), 'fill_fields',
+                           lambda api, state: api.fill_fields(state.access_token, state.package_id,
+                                                              state.document_ids[i], field_values,
+                                                              state.field_indexes[i], strict=True),
+                           check=_check_fill))
+    return steps
+
+
+def _signer_call(signer):
+    return lambda api, state: api.update_workflow_user(state.access_token, state.package_id, signer['user_email'],
+                                                       signer['user_name'], signer['order'], signer['role'],
+                                                       signer['email_notification'])
+
+
+def _check_fill(api, result):
+    if result.unknown_fields:
+        return 'Unknown fields: ' + ', '.join(result.unknown_fields)
+    if result.errors:
+        return '; '.join(name + ': ' + message for name, message in result.errors.items())
+    return None
+
+
+def _check_truthy(api, value):
+    return None if value else (api.last_error_message or 'Unknown error')
+
+
+# One node of the dependency graph.
+# - call:     Callable(api, state) that makes the API call (and returns a coroutine with AsyncSigningHubAPI)
+# - store:    Callable(state, value) that stores the result for later steps
+# - check:    Callable(api, value) that returns an error message, or None on success
+# - api_name: Name of the SigningHubAPI method, reported as failed_step
+class _Step(object):
+    __slots__ = ('name', 'deps', 'api_name', 'call', 'store', 'check')
+
+    def __init__(self, name, deps, api_name, call, store=None, check=_check_truthy):
+        self.name = name
+        self.deps = tuple(deps)
+        self.api_name = api_name
+        self.call = call
+        self.store = store
+        self.check = check
+
+    def finish(self, api, state, value, elapsed):
+        state.timings[self.name] = elapsed
+        error = self.check(api, value)
+        if error:
+            raise ProvisioningError(self.api_name, error)
+        if self.store is not None:
+            self.store(state, value)
+
+
+class _BuildState(object):
+
+    def __init__(self, access_token, document_count):
+        self.access_token = access_token
+        self.package_id = None
+        self.document_ids = [None] * document_count
+        self.field_indexes = [None] * document_count
+        self.timings = {}
+
+
+def _run_step(step, api, state):
+    started_at = time.perf_counter()
+    value = step.call(api, state)
+    step.finish(api, state, value, time.perf_counter() - started_at)
+
+
+async def _run_step_async(step, api, state):
+    started_at = time.perf_counter()
+    value = step.call(api, state)
+    if inspect.isawaitable(value):
+        value = await value
+    step.finish(api, state, value, time.perf_counter() - started_at)
+
+
+# Returns the steps whose dependencies are all done, removing them from remaining
+def _ready_steps(remaining, done):
+    ready = [step for step in remaining if all(dep in done for dep in step.deps)]
+    for step in ready:
+        remaining.remove(step)
+    return ready
+
+
+def _run_threaded(steps, api, state, max_workers):
+    remaining = list(steps)
+    done = set()
+    running = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while remaining or running:
+            for step in _ready_steps(remaining, done):
+                running[executor.submit(bind_deadline(_run_step), step, api, state)] = step
+            if not running:
+                raise ValueError('PackageBuilder steps have unresolvable dependencies')
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                step = running.pop(future)
+                if future.exception() is not None:
+                    # Let the steps that are in flight finish before the package is deleted
+                    wait(running)
+                    raise future.exception()
+                done.add(step.name)
+
+
+async def _run_async(steps, api, state):
+    remaining = list(steps)
+    done = set()
+    running = {}
+    while remaining or running:
+        for step in _ready_steps(remaining, done):
+            running[asyncio.ensure_future(_run_step_async(step, api, state))] = step
+        if not running:
+            raise ValueError('PackageBuilder steps have unresolvable dependencies')
+        finished, _ = await asyncio.wait(list(running), return_when=asyncio.FIRST_COMPLETED)
+        for task in finished:
+            step = running.pop(task)
+            if task.exception() is not None:
+                if running:
+                    await asyncio.wait(list(running))
+                raise task.exception()
+            done.add(step.name)
+
+
+def _failed_result(state, e, elapsed):
+    if isinstance(e, ProvisioningError):
+        error, failed_step = e.message, e.step
+    elif isinstance(e, SigningHubError):
+        error, failed_step = e.message, e.function_name.rpartition('.')[2]
+    else:
+        error, failed_step = str(e) or e.__class__.__name__, None
+    return BuildResult(state.package_id, state.document_ids, error, failed_step, state.timings, elapsed)
+
+
+def _delete_quietly(api, state):
+    try:
+        with no_deadline():
+            api.delete_package(state.access_token, state.package_id)
+    except Exception:
+        pass
@@ -0,0 +1,283 @@
+"""
+Copyright 2016, SolidBuilds.com. All rights reserved.
+Author: Ling Thio, ling.thio@gmail.com
+"""
+
+import itertools
+import json
+import sqlite3
+import threading
+import time
+import uuid
+
+DEFAULT_CALLBACK_WORKERS = 2             # Number of threads that run the handler
+DEFAULT_BATCH_SIZE = 20                  # Max number of events per handler call
+DEFAULT_BATCH_WAIT = 0.5                 # Max seconds an event waits for its batch to fill up
+DEFAULT_MAX_ATTEMPTS = 5                 # Events that failed this many times are parked as 'failed'
+DEFAULT_RETRY_DELAY = 5.0                # Delay before the first retry of a failed event. Doubles on every retry.
+DEFAULT_LEASE = 300.0                    # Seconds a claimed batch is reserved for its worker
+DROPPED_PARAMS = ('token',)              # Callback parameters that are not written to disk (access tokens)
+
+PENDING = 'pending'
+PROCESSING = 'processing'
+DONE = 'done'
+FAILED = 'failed'
+
+
+# One SigningHub callback, as stored in the CallbackQueue.
+# - package_id: From the 'document_id' callback parameter (a legacy name: it really points to the package)
+# - params:     All callback parameters, except DROPPED_PARAMS
+# - attempts:   Number of earlier handler calls that failed for this event
+class CallbackEvent(object):
+    __slots__ = ('event_id', 'package_id', 'user_email', 'params', 'received_at', 'attempts')
+
+    def __init__(self, event_id, package_id, user_email, params, received_at, attempts=0):
+        self.event_id = event_id
+        self.package_id = package_id
+        self.user_email = user_email
+        self.params = params
+        self.received_at = received_at
+        self.attempts = attempts
+
+    def __repr__(self):
+        return '<CallbackEvent %d package_id=%s user_email=%s attempts=%d>' % (
+            self.event_id, self.package_id, self.user_email, self.attempts)
+
+
+# A durable queue for SigningHub callbacks, processed by a pool of background worker threads.
+# - handler:      Callable(events) that processes a list of CallbackEvent objects. It may return the events
+#                 that failed; an exception fails the whole batch. Failed events are retried with exponential
+#                 backoff, up to max_attempts times.
+# - path:         SQLite database file
+# - max_workers:  Number of worker threads
+# - batch_size:   Max number of events per handler call
+# - batch_wait:   Max seconds an event waits for more events to fill its batch
+# - lease:        Seconds a claimed batch is reserved for its worker. Must be longer than the slowest handler call.
+#
+# put() stores the callback and returns right away, so the webhook can be answered immediately.
+# Callbacks are deduplicated by (package_id, user_email): SigningHub may send the same callback more than once.
+# Callbacks without a user_email (or package_id) are deduplicated too.
+# Several processes may share one database: every batch is claimed by one worker only.
+# Events survive restarts: events that were being processed during a crash are claimed again once their
+# lease has expired, and replay() re-queues failed (or already processed) events.
+#
+#     callback_queue = CallbackQueue(process_callbacks, path='callbacks.db').start()
+#
+#     @app.route('/signinghub/callback')
+#     def signinghub_callback():
+#         callback_queue.put(request.args.to_dict())
+#         ...
+class CallbackQueue(object):
+
+    def __init__(self, handler, path='callbacks.db', max_workers=DEFAULT_CALLBACK_WORKERS,
+                 batch_size=DEFAULT_BATCH_SIZE, batch_wait=DEFAULT_BATCH_WAIT, max_attempts=DEFAULT_MAX_ATTEMPTS,
+                 retry_delay=DEFAULT_RETRY_DELAY, lease=DEFAULT_LEASE, clock=time.time):
+        self.handler = handler
+        self.path = path
+        self.max_workers = max_workers
+        self.batch_size = batch_size
+        self.batch_wait = batch_wait
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.lease = lease
+        self.clock = clock
+        self._condition = threading.Condition()
+        self._workers = []
+        self._stopping = False
+        self._owner = uuid.uuid4().hex          # Identifies this queue's claims among all processes
+        self._claims = itertools.count(1)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        with self._db:
+            self._db.execute('PRAGMA journal_mode=WAL')
+            self._db.execute('CREATE TABLE IF NOT EXISTS callbacks ('
+                             'event_id INTEGER PRIMARY KEY AUTOINCREMENT, package_id TEXT, user_email TEXT, '
+                             'params TEXT NOT NULL, received_at REAL NOT NULL, status TEXT NOT NULL, '
+                             'attempts INTEGER NOT NULL DEFAULT 0, available_at REAL NOT NULL, last_error TEXT, '
+                             'owner TEXT, lease_until REAL)')
+            _add_lease_columns(self._db)
+            self._db.execute('CREATE UNIQUE INDEX IF NOT EXISTS callbacks_dedup ON callbacks (package_id, user_email)')
+            self._db.execute('CREATE INDEX IF NOT EXISTS callbacks_status ON callbacks (status, available_at)')
+
+
+    # Stores one callback, given as a dict of its query parameters.
+    # Returns True if it was queued, and False if it is a duplicate of an earlier callback.
+    def put(self, params):
+        params = dict((key, value) for key, value in params.items() if key not in DROPPED_PARAMS)
+        # Missing keys are stored as '': SQLite never considers NULLs equal, so they would not be deduplicated
+        package_id = params.get('package_id') or params.get('document_id') or ''
+        user_email = params.get('user_email') or ''
+        now = self.clock()
+        with self._condition:
+            with self._db:
+                cursor = self._db.execute(
+                    'INSERT OR IGNORE INTO callbacks (package_id, user_email, params, received_at, status, available_at) '
+                    'VALUES (?, ?, ?, ?, ?, ?)',
+                    (package_id, user_email, json.dumps(params), now, PENDING, now))
+            if cursor.rowcount:
+                self._condition.notify()
+            return cursor.rowcount > 0
+
+
+    # Starts the worker threads. Returns self.
+    def start(self):
+        with self._condition:
+            self._stopping = False
+            while len(self._workers) < self.max_workers:
+                worker = threading.Thread(target=self._work, name='CallbackQueue-%d' % (len(self._workers) + 1))
+                worker.daemon = True
+                self._workers.append(worker)
+                worker.start()
+        return self
+
+
+    # Processes the events that are ready now, then stops the worker threads.
+    def stop(self):
+        with self._condition:
+            self._stopping = True
+            self._condition.notify_all()
+        for worker in self._workers:
+            worker.join()
+        self._workers = []
+
+    def close(self):
+        self.stop()
+        with self._condition:
+            self._db.close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+    # Queues events again for processing.
+    # - statuses: Which events to re-queue: 'failed' events by default. Add 'done' to process events again,
+    #             or 'processing' to take back the claimed events of a crashed process before their lease expires.
+    # - since:    Only re-queue events received at or after this time (seconds since the epoch)
+    # Returns the number of re-queued events.
+    def replay(self, statuses=(FAILED,), since=None):
+        now = self.clock()
+        query = 'UPDATE callbacks SET status = ?, attempts = 0, available_at = ?, last_error = NULL, owner = NULL ' \
+                'WHERE status IN (%s)' % ', '.join('?' * len(statuses))
+        params = [PENDING, now] + list(statuses)
+        if since is not None:
+            query += ' AND received_at >= ?'
+            params.append(since)
+        with self._condition:
+            with self._db:
+                count = self._db.execute(query, params).rowcount
+            self._condition.notify_all()
+        return count
+
+
+    # Returns a dict with the number of events per status
+    def counts(self):
+        with self._condition:
+            rows = self._db.execute('SELECT status, COUNT(*) FROM callbacks GROUP BY status').fetchall()
+        counts = dict.fromkeys((PENDING, PROCESSING, DONE, FAILED), 0)
+        counts.update(rows)
+        return counts
+
+
+    # Returns the events with a status, oldest first
+    def events(self, status=FAILED):
+        with self._condition:
+            rows = self._db.execute('SELECT event_id, package_id, user_email, params, received_at, attempts '
+                                    'FROM callbacks WHERE status = ? ORDER BY event_id', (status,)).fetchall()
+        return [_event(row) for row in rows]
+
+
+    def _work(self):
+        while True:
+            with self._condition:
+                while True:
+                    claim_id, events, wait = self._claim()
+                    if events:
+                        break
+                    if self._stopping:
+                        return
+                    self._condition.wait(wait)
+            try:
+                failed = self.handler(events)
+                failed_ids = set(event.event_id for event in failed or ())
+                error = 'Handler reported a failure'
+            except Exception as e:
+                failed_ids = set(event.event_id for event in events)
+                error = '%s: %s' % (e.__class__.__name__, e)
+            self._finish(events, failed_ids, error, claim_id)
+
+
+    # Claims the next batch of events that are ready: pending events, and events whose lease has expired
+    # (their worker crashed or was stopped). Must be called with the lock held.
+    # A batch is claimed when it is full, when its oldest event has waited batch_wait seconds, or when stopping.
+    # Returns (claim ID, events, None), or (None, [], seconds until the next event may be ready, or None).
+    def _claim(self):
+        now = self.clock()
+        rows = self._db.execute('SELECT event_id, available_at FROM callbacks '
+                                'WHERE (status = ? AND available_at <= ?) OR (status = ? AND lease_until <= ?) '
+                                'ORDER BY available_at, event_id LIMIT ?',
+                                (PENDING, now, PROCESSING, now, self.batch_size)).fetchall()
+        if rows and (len(rows) >= self.batch_size or self._stopping or rows[0][1] + self.batch_wait <= now):
+            # Another process may have claimed some of these events since the SELECT. The UPDATE only claims
+            # the events that are still ready, and the events that were claimed are selected by claim ID.
+            claim_id = '%s-%d' % (self._owner, next(self._claims))
+            event_ids = [row[0] for row in rows]
+            placeholders = ', '.join('?' * len(event_ids))
+            with self._db:
+                self._db.execute('UPDATE callbacks SET status = ?, owner = ?, lease_until = ? '
+                                 'WHERE event_id IN (%s) AND (status = ? OR (status = ? AND lease_until <= ?))'
+                                 % placeholders, [PROCESSING, claim_id, now + self.lease] + event_ids +
+                                 [PENDING, PROCESSING, now])
+            claimed = self._db.execute('SELECT event_id, package_id, user_email, params, received_at, attempts '
+                                       'FROM callbacks WHERE event_id IN (%s) AND owner = ? ORDER BY event_id'
+                                       % placeholders, event_ids + [claim_id]).fetchall()
+            if claimed:
+                return claim_id, [_event(row) for row in claimed], None
+            return None, [], 0.0
+        if rows:
+            return None, [], rows[0][1] + self.batch_wait - now
+        if self._stopping:
+            return None, [], None
+        row = self._db.execute('SELECT MIN(CASE WHEN status = ? THEN available_at ELSE lease_until END) '
+                               'FROM callbacks WHERE status IN (?, ?)', (PENDING, PENDING, PROCESSING)).fetchone()
+        return None, [], max(0.0, row[0] - now) if row[0] is not None else None
+
+
+    # Stores the outcome of a batch. Events that were claimed again by another worker after their lease
+    # expired belong to that worker, and are not updated.
+    def _finish(self, events, failed_ids, error, claim_id):
+        now = self.clock()
+        updates = []
+        for event in events:
+            if event.event_id not in failed_ids:
+                updates.append((DONE, event.attempts, now, None, event.event_id, claim_id))
+            elif event.attempts + 1 >= self.max_attempts:
+                updates.append((FAILED, event.attempts + 1, now, error, event.event_id, claim_id))
+            else:
+                delay = self.retry_delay * (2 ** event.attempts)
+                updates.append((PENDING, event.attempts + 1, now + delay, error, event.event_id, claim_id))
+        with self._condition:
+            with self._db:
+                self._db.executemany('UPDATE callbacks SET status = ?, attempts = ?, available_at = ?, last_error = ?, '
+                                     'owner = NULL, lease_until = NULL WHERE event_id = ? AND owner = ?', updates)
+            self._condition.notify_all()
+
+
+# Adds the owner and lease_until columns to a database created by an earlier version.
+# Events that such a version left in 'processing' get an expired lease, so that they are claimed again.
+def _add_lease_columns(db):
+    columns = set(row[1] for row in db.execute('PRAGMA table_info(callbacks)'))
+    for column, column_type in (('owner', 'TEXT'), ('lease_until', 'REAL')):
+        if column not in columns:
+            try:
+                db.execute('ALTER TABLE callbacks ADD COLUMN %s %s' % (column, column_type))
+            except sqlite3.OperationalError as e:
+                if 'duplicate column' not in str(e):   # Another process added it first
+                    raise
+    if 'lease_until' not in columns:
+        db.execute('UPDATE callbacks SET lease_until = 0 WHERE status = ? AND lease_until IS NULL', (PROCESSING,))
+
+
+def _event(row):
+    return CallbackEvent(row[0], row[1] or None, row[2] or None, json.loads(row[3]), row[4], row[5])
@@ -0,0 +1,142 @@
+"""
+Copyright 2016, SolidBuilds.com. All rights reserved.
+Author: Ling Thio, ling.thio@gmail.com
+"""
+
+import threading
+
+from .results import error_for_result
+
+
+# An in-memory index of package information records, with O(1) lookups by package ID, name and status.
+#
+# Packages with the same name are kept in the order in which they were added, and find_by_name()
+# returns the most recently added one, just like SigningHubAPI.find_package_by_name() returns the last match.
+# Replacing a package, or changing its status, does not change its position among packages with the same name.
+#
+# A catalog that is attached to a SigningHubAPI instance (see attach()) follows the packages that are added,
+# shared and deleted through that instance, so it never needs to re-download the package listing.
+class PackageCatalog(object):
+
+    def __init__(self, packages=()):
+        self._lock = threading.RLock()
+        self._by_id = {}
+        self._by_name = {}                 # package_name -> {package_id: None}, in order of addition
+        self._by_status = {}               # package_status -> {package_id: None}, in order of addition
+        for package in packages:
+            self.add(package)
+
+
+    # Builds a catalog from all packages listed by api.iter_packages() and attaches it to api.
+    # Raises a SigningHubError if a page could not be retrieved, instead of returning an incomplete catalog.
+    @classmethod
+    def from_api(cls, api, access_token=None, folder='INBOX', **kwargs):
+        catalog = cls(api.iter_packages(access_token, folder, **kwargs))
+        result = api.last_result
+        if result is not None and result.error_message:
+            raise error_for_result(result)
+        catalog.attach(api)
+        return catalog
+
+
+    # Adds or replaces a package information record (a dict with at least a 'package_id').
+    def add(self, package):
+        package_id = package['package_id']
+        with self._lock:
+            current = self._by_id.get(package_id)
+            if current is not None:
+                # Only unindex the keys that change: the other index entries keep their position
+                for index, field in ((self._by_name, 'package_name'), (self._by_status, 'package_status')):
+                    if current.get(field) != package.get(field):
+                        _discard(index, current.get(field), package_id)
+            self._by_id[package_id] = package
+            self._by_name.setdefault(package.get('package_name'), {})[package_id] = None
+            self._by_status.setdefault(package.get('package_status'), {})[package_id] = None
+
+
+    # Removes a package. Returns the removed package information record, or None if it was not in the catalog.
+    def remove(self, package_id):
+        with self._lock:
+            package = self._by_id.pop(package_id, None)
+            if package is not None:
+                self._unindex(package)
+            return package
+
+
+    # Changes the status of a package.
+    def set_status(self, package_id, package_status):
+        with self._lock:
+            package = self._by_id.get(package_id)
+            if package is not None:
+                package = dict(package, package_status=package_status)
+                self.add(package)
+
+
+    # Returns the package information record of package_id, or None.
+    def get(self, package_id):
+        return self._by_id.get(package_id)
+
+
+    # Returns the ID of the most recently added package named package_name, or None.
+    def find_by_name(self, package_name):
+        with self._lock:
+            package_ids = self._by_name.get(package_name)
+            return next(reversed(package_ids)) if package_ids else None
+
+
+    # Returns the IDs of all packages named package_name, in order of addition.
+    def find_all_by_name(self, package_name):
+        with self._lock:
+            return list(self._by_name.get(package_name, ()))
+
+
+    # Returns the package information records of all packages with status package_status, in order of addition.
+    def find_by_status(self, package_status):
+        with self._lock:
+            return [self._by_id[package_id] for package_id in self._by_status.get(package_status, ())]
+
+
+    def __len__(self):
+        return len(self._by_id)
+
+    def __contains__(self, package_id):
+        return package_id in self._by_id
+
+    def __iter__(self):
+        with self._lock:
+            return iter(list(self._by_id.values()))
+
+
+    # Follows the packages that are added, shared and deleted through api.
+    def attach(self, api):
+        if self not in api.package_listeners:
+            api.package_listeners.append(self)
+
+    def detach(self, api):
+        if self in api.package_listeners:
+            api.package_listeners.remove(self)
+
+
+    # Package listener methods, called by SigningHubAPI
+    def package_added(self, package_id, package_name):
+        self.add({'package_id': package_id, 'package_name': package_name, 'package_status': 'DRAFT'})
+
+    def package_shared(self, package_id):
+        self.set_status(package_id, 'INPROGRESS')
+
+    def package_deleted(self, package_id):
+        self.remove(package_id)
+
+
+    def _unindex(self, package):
+        _discard(self._by_name, package.get('package_name'), package['package_id'])
+        _discard(self._by_status, package.get('package_status'), package['package_id'])
+
+
+# Removes package_id from the index entry of key
+def _discard(index, key, package_id):
+    package_ids = index.get(key)
+    if package_ids is not None:
+        package_ids.pop(package_id, None)
+        if not package_ids:
+            del index[key]
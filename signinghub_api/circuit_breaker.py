@@ -0,0 +1,138 @@
+"""
+Copyright 2016, SolidBuilds.com. All rights reserved.
+Author: Ling Thio, ling.thio@gmail.com
+"""
+
+import threading
+import time
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+# Stops sending requests to an endpoint that keeps failing, so callers fail fast instead of piling up.
+# - failure_threshold: Open after this many failed calls in a row
+# - slow_call_threshold: Calls that take longer than this many seconds count as failed (optional). Only the time
+#                        on the wire of the last attempt counts, not rate limiting or retry backoff.
+# - reset_timeout:     Seconds to stay open before letting probe calls through (half-open)
+# - half_open_probes:  Number of probe calls let through at a time while half-open
+#
+# Failed calls are calls that got a 5xx response, a connection error or a timeout (after retries).
+# Calls that were stopped by their deadline are not counted.
+# While half-open, a successful probe closes the breaker and a failed probe opens it again.
+class CircuitBreaker(object):
+
+    def __init__(self, failure_threshold=5, slow_call_threshold=None, reset_timeout=30.0, half_open_probes=1,
+                 clock=time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.slow_call_threshold = slow_call_threshold
+        self.reset_timeout = reset_timeout
+        self.half_open_probes = half_open_probes
+        self.clock = clock
+        self.state = CLOSED
+        self.failures = 0                   # Failed calls in a row
+        self._opened_at = 0.0
+        self._probes = 0                    # Probe calls in flight while half-open
+        self._lock = threading.Lock()
+
+
+    # Returns True if a call may be sent now. Every allowed call must be followed by record() or release().
+    def allow(self):
+        with self._lock:
+            if self.state == OPEN:
+                if self.clock() - self._opened_at < self.reset_timeout:
+                    return False
+                self.state = HALF_OPEN
+                self._probes = 0
+            if self.state == HALF_OPEN:
+                if self._probes >= self.half_open_probes:
+                    return False
+                self._probes += 1
+            return True
+
+
+    # Records the outcome of an allowed call
+    def record(self, success, elapsed=0.0):
+        if success and self.slow_call_threshold is not None and elapsed > self.slow_call_threshold:
+            success = False
+        with self._lock:
+            if self.state == HALF_OPEN:
+                self._probes = max(0, self._probes - 1)
+                if success:
+                    self.state = CLOSED
+                    self.failures = 0
+                else:
+                    self._open()
+            elif success:
+                self.failures = 0
+            else:
+                self.failures += 1
+                if self.failures >= self.failure_threshold:
+                    self._open()
+
+
+    # Releases the probe slot of an allowed call whose outcome says nothing about the endpoint,
+    # such as a call that was stopped by its deadline
+    def release(self):
+        with self._lock:
+            if self.state == HALF_OPEN:
+                self._probes = max(0, self._probes - 1)
+
+
+    # Seconds until probe calls are let through, or 0 if the breaker is not open
+    def retry_in(self):
+        with self._lock:
+            if self.state != OPEN:
+                return 0.0
+            return max(0.0, self.reset_timeout - (self.clock() - self._opened_at))
+
+
+    def _open(self):
+        self.state = OPEN
+        self._opened_at = self.clock()
+        self.failures = 0
+
+
+# One CircuitBreaker per endpoint group, so that a failing endpoint (such as document fields)
+# does not stop calls to healthy ones (such as the package listing).
+# - group_for:      Callable(endpoint template) that returns the group name. Defaults to endpoint_group().
+# - breaker_kwargs: Passed to every CircuitBreaker
+#
+#     signinghub_api = SigningHubAPI(..., circuit_breakers=CircuitBreakers(failure_threshold=5, reset_timeout=30))
+class CircuitBreakers(object):
+
+    def __init__(self, group_for=None, **breaker_kwargs):
+        self.group_for = group_for or endpoint_group
+        self.breaker_kwargs = breaker_kwargs
+        self._breakers = {}
+        self._lock = threading.Lock()
+
+
+    # Returns (group name, CircuitBreaker) for an endpoint template
+    def get(self, endpoint):
+        group = self.group_for(endpoint)
+        breaker = self._breakers.get(group)
+        if breaker is None:
+            with self._lock:
+                breaker = self._breakers.get(group)
+                if breaker is None:
+                    breaker = self._breakers[group] = CircuitBreaker(**self.breaker_kwargs)
+        return group, breaker
+
+
+    # Returns a dict of group name -> breaker state
+    def states(self):
+        with self._lock:
+            return dict((group, breaker.state) for group, breaker in self._breakers.items())
+
+
+# Returns the endpoint group of an endpoint template:
+# 'authenticate', 'fields', 'workflow', 'documents' or 'packages'
+def endpoint_group(endpoint):
+    if not endpoint or endpoint == 'authenticate':
+        return 'authenticate'
+    for group in ('fields', 'workflow', 'documents'):
+        if '/' + group in endpoint:
+            return group
+    return 'packages'
@@ -0,0 +1,339 @@
+"""
+Copyright 2016, SolidBuilds.com. All rights reserved.
+Author: Ling Thio, ling.thio@gmail.com
+
+The python -m signinghub_api command line tool:
+
+    python -m signinghub_api provision recipients.csv --library-document-id 1234 --template-name MyTemplate
+    python -m signinghub_api export --status COMPLETED --output completed.jsonl
+
+Credentials are read from the SIGNINGHUB_CLIENT_ID, SIGNINGHUB_CLIENT_SECRET, SIGNINGHUB_USERNAME,
+SIGNINGHUB_PASSWORD and SIGNINGHUB_SCOPE environment variables, or from the matching command line options.
+"""
+
+from __future__ import print_function
+import argparse
+import csv
+import io
+import json
+import os
+import signal
+import sys
+import threading
+
+from .provisioning import iter_provision_packages, DEFAULT_MAX_WORKERS
+from .retry import RateLimiter
+from .signinghub_api import SigningHubAPI, DEFAULT_PAGE_SIZE, DEFAULT_POOL_MAXSIZE
+from .transport import HTTPClientTransport
+
+RECIPIENT_COLUMNS = ('user_email', 'user_name', 'package_name', 'document_name')
+REQUIRED_COLUMNS = ('user_email', 'user_name')
+STATE_SYNC_INTERVAL = 100                # The state file is synced to disk every this many rows
+
+PROVISIONED = 'provisioned'
+FAILED = 'failed'
+
+
+# Yields recipients from a CSV or JSONL file, one row at a time, so that the file is never loaded as a whole.
+# - path:         File path, or '-' for stdin
+# - input_format: 'csv' or 'jsonl'. Guessed from the file extension if None (CSV unless .jsonl, .ndjson or .json).
+#
+# Every recipient is a dict with 'row' (the 1-based row number), 'user_email', 'user_name', optionally
+# 'package_name' and 'document_name', and 'fields': the field values. All other CSV columns, and all other
+# JSONL keys, are field values. JSONL rows may also hold their field values in a 'fields' object.
+# Empty field values are left out.
+def iter_recipients(path, input_format=None):
+    if input_format is None:
+        input_format = 'jsonl' if path.lower().endswith(('.jsonl', '.ndjson', '.json')) else 'csv'
+    if path == '-':
+        input_file = io.TextIOWrapper(sys.stdin.buffer, encoding='utf-8-sig', newline='')
+    else:
+        input_file = open(path, encoding='utf-8-sig', newline='')
+    try:
+        if input_format == 'csv':
+            reader = csv.DictReader(input_file)
+            missing = [column for column in REQUIRED_COLUMNS if column not in (reader.fieldnames or ())]
+            if missing:
+                raise ValueError('%s: missing column(s): %s' % (path, ', '.join(missing)))
+            for row, record in enumerate(reader, 1):
+                yield _recipient(row, record)
+        else:
+            row = 0
+            for line in input_file:
+                if not line.strip():
+                    continue
+                row += 1
+                try:
+                    record = json.loads(line)
+                except ValueError as e:
+                    raise ValueError('%s: row %d: %s' % (path, row, e))
+                yield _recipient(row, record)
+    finally:
+        if path != '-':
+            input_file.close()
+
+
+def _recipient(row, record):
+    recipient = {'row': row, 'fields': {}}
+    for key, value in record.items():
+        if key in RECIPIENT_COLUMNS:
+            recipient[key] = value
+        elif key == 'fields' and isinstance(value, dict):
+            recipient['fields'].update(value)
+        elif key is not None and key != 'row' and value not in (None, ''):
+            recipient['fields'][key] = value
+    return recipient
+
+
+# The resumable state of a provisioning job: an append-only JSONL file with one line per finished row.
+# Every line is flushed as soon as its row is finished, so after a crash only the rows that were in progress
+# are provisioned again. A later line for the same row (a retried failure) replaces the earlier one.
+#
+# Rows that were in progress when the process was killed may have left a half-built package behind:
+# SigningHubAPI can only delete a failed package while the process is still running.
+class ProvisioningState(object):
+
+    def __init__(self, path):
+        self.path = path
+        self.rows = {}                      # row -> (status, user_email) of every finished row
+        self._unsynced = 0
+        needs_newline = False
+        if os.path.exists(path):
+            with open(path, encoding='utf-8') as state_file:
+                for line in state_file:
+                    needs_newline = not line.endswith('\n')
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue            # A line cut off by a crash
+                    self.rows[record['row']] = (record['status'], record.get('user_email'))
+        self._file = open(path, 'a', encoding='utf-8')
+        if needs_newline:
+            self._file.write('\n')
+
+
+    # Returns the status of a row ('provisioned' or 'failed'), or None if it has not been finished.
+    # Raises ValueError if the row was finished for another recipient: the input file has changed.
+    def status(self, recipient):
+        status, user_email = self.rows.get(recipient['row'], (None, None))
+        if status is not None and user_email != recipient.get('user_email'):
+            raise ValueError('Row %d of the input was %s, and is now %s: the state file %s belongs to another input'
+                             % (recipient['row'], user_email, recipient.get('user_email'), self.path))
+        return status
+
+
+    # Appends the outcome of a row, given as a ProvisioningResult
+    def record(self, result):
+        recipient = result.recipient
+        status = PROVISIONED if result.success else FAILED
+        record = {'row': recipient['row'], 'user_email': recipient.get('user_email'), 'status': status}
+        if result.success:
+            record.update(package_id=result.package_id, document_id=result.document_id)
+        else:
+            record.update(error=result.error, failed_step=result.failed_step)
+        self._file.write(json.dumps(record) + '\n')
+        self._file.flush()
+        self.rows[record['row']] = (status, record['user_email'])
+        self._unsynced += 1
+        if self._unsynced >= STATE_SYNC_INTERVAL:
+            self._sync()
+
+
+    def close(self):
+        self._sync()
+        self._file.close()
+
+    def _sync(self):
+        os.fsync(self._file.fileno())
+        self._unsynced = 0
+
+
+# Provisions the recipients of an input file in parallel, and records every finished row in a state file.
+# Rows that were provisioned by an earlier run with the same state file are skipped, and so are rows that
+# failed, unless retry_failed is True.
+# The first SIGINT (Ctrl-C) sets stopping, which stops reading the input and lets the rows in progress finish;
+# a second one aborts. stopping is a threading.Event, and can also be set by the caller.
+# Returns a dict with the number of 'provisioned', 'failed' and 'skipped' rows.
+def provision(api, recipients, state, library_document_id, template_name,
+              package_name_format='{user_name} - {user_email}', max_workers=DEFAULT_MAX_WORKERS,
+              retry_failed=False, deadline=None, stopping=None, log=None):
+    counts = {PROVISIONED: 0, FAILED: 0, 'skipped': 0}
+    stopping = stopping or threading.Event()
+    errors = []
+
+    def pending_recipients():
+        try:
+            for recipient in recipients:
+                if stopping.is_set():
+                    return
+                status = state.status(recipient)
+                if status == PROVISIONED or (status == FAILED and not retry_failed):
+                    counts['skipped'] += 1
+                    continue
+                yield recipient
+        except ValueError as e:
+            # Stop reading, but let the rows in progress finish and be recorded
+            errors.append(e)
+
+    with _stop_on_interrupt(stopping, log):
+        for result in iter_provision_packages(api, pending_recipients(), library_document_id, template_name,
+                                              package_name_format, None, max_workers, deadline):
+            state.record(result)
+            if result.success:
+                counts[PROVISIONED] += 1
+            else:
+                counts[FAILED] += 1
+                if log is not None:
+                    print('Row %d (%s) failed in %s: %s' % (result.recipient['row'], result.recipient.get('user_email'),
+                                                           result.failed_step, result.error), file=log)
+    if errors:
+        raise errors[0]
+    return counts
+
+
+# Writes the package information records of a folder to output as JSONL, one page at a time.
+# Returns the number of packages written. Raises RuntimeError if a page could not be retrieved.
+def export_packages(api, output, folder='INBOX', status='ALL', page_size=DEFAULT_PAGE_SIZE):
+    count = 0
+    for package in api.iter_packages(None, folder, page_size, status=status):
+        output.write(json.dumps(package, sort_keys=True) + '\n')
+        count += 1
+    if api.last_error_message:
+        raise RuntimeError('get_packages() failed: ' + api.last_error_message)
+    return count
+
+
+class _stop_on_interrupt(object):
+
+    def __init__(self, stopping, log):
+        self.stopping = stopping
+        self.log = log
+        self.previous = None
+
+    def __enter__(self):
+        if threading.current_thread() is threading.main_thread():
+            self.previous = signal.signal(signal.SIGINT, self._interrupt)
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self.previous is not None:
+            signal.signal(signal.SIGINT, self.previous)
+
+    def _interrupt(self, signum, frame):
+        if self.stopping.is_set():
+            raise KeyboardInterrupt
+        self.stopping.set()
+        if self.log is not None:
+            print('Interrupted: finishing the rows in progress. Press Ctrl-C again to abort.', file=self.log)
+
+
+def create_api(args):
+    rate_limiter = RateLimiter(args.rate) if args.rate else None
+    pool_maxsize = max(DEFAULT_POOL_MAXSIZE, args.workers)
+    transport = HTTPClientTransport(pool_maxsize) if args.transport == 'http.client' else None
+    api = SigningHubAPI(args.client_id, args.client_secret, args.username, args.password,
+                        args.scope or args.username, pool_maxsize=pool_maxsize, transport=transport,
+                        rate_limiter=rate_limiter, verbose=args.verbose)
+    if args.base_url:
+        api.base_url = args.base_url
+    if args.auth_url:
+        api.auth_url = args.auth_url
+    return api
+
+
+def run_provision(args):
+    state_path = args.state or ('provision.state.jsonl' if args.input == '-' else args.input + '.state.jsonl')
+    api = create_api(args)
+    state = ProvisioningState(state_path)
+    stopping = threading.Event()
+    try:
+        recipients = iter_recipients(args.input, args.format)
+        counts = provision(api, recipients, state, args.library_document_id, args.template_name,
+                           args.package_name_format, args.workers, args.retry_failed, args.deadline,
+                           stopping, log=sys.stderr)
+    except ValueError as e:
+        print('ERROR: %s' % e, file=sys.stderr)
+        return 2
+    finally:
+        state.close()
+        api.close()
+    print('Provisioned %(provisioned)d, failed %(failed)d, skipped %(skipped)d.' % counts, file=sys.stderr)
+    print('State file: ' + state_path, file=sys.stderr)
+    if stopping.is_set():
+        print('Interrupted: run the same command again to resume.', file=sys.stderr)
+        return 130
+    return 1 if counts[FAILED] else 0
+
+
+def run_export(args):
+    api = create_api(args)
+    try:
+        if args.output == '-':
+            count = export_packages(api, sys.stdout, args.folder, args.status, args.page_size)
+        else:
+            # Write to a .part file first, so that an interrupted export never looks complete
+            part_path = args.output + '.part'
+            try:
+                with open(part_path, 'w', encoding='utf-8') as output:
+                    count = export_packages(api, output, args.folder, args.status, args.page_size)
+            except BaseException:
+                os.remove(part_path)
+                raise
+            os.replace(part_path, args.output)
+    except RuntimeError as e:
+        print('ERROR: %s' % e, file=sys.stderr)
+        return 1
+    finally:
+        api.close()
+    print('Exported %d packages.' % count, file=sys.stderr)
+    return 0
+
+
+def build_parser():
+    environ = os.environ
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument('--client-id', default=environ.get('SIGNINGHUB_CLIENT_ID', ''))
+    common.add_argument('--client-secret', default=environ.get('SIGNINGHUB_CLIENT_SECRET', ''))
+    common.add_argument('--username', default=environ.get('SIGNINGHUB_USERNAME', ''))
+    common.add_argument('--password', default=environ.get('SIGNINGHUB_PASSWORD', ''))
+    common.add_argument('--scope', default=environ.get('SIGNINGHUB_SCOPE', ''), help='defaults to the username')
+    common.add_argument('--base-url', default=environ.get('SIGNINGHUB_BASE_URL'),
+                        help='API base URL, such as https://api.signinghub.com/v3/')
+    common.add_argument('--auth-url', default=environ.get('SIGNINGHUB_AUTH_URL'),
+                        help='authentication URL, such as https://api.signinghub.com/authenticate')
+    common.add_argument('--workers', type=int, default=DEFAULT_MAX_WORKERS, help='number of parallel workers')
+    common.add_argument('--rate', type=float, help='max number of API calls per second')
+    common.add_argument('--verbose', action='store_true', help='print a line for every API call')
+    common.add_argument('--transport', choices=('requests', 'http.client'), default='requests',
+                        help="'http.client' sends requests with the standard library only")
+
+    parser = argparse.ArgumentParser(prog='python -m signinghub_api', description='SigningHub API bulk tool.')
+    commands = parser.add_subparsers(dest='command', metavar='command')
+    commands.required = True
+
+    provision_parser = commands.add_parser('provision', parents=[common],
+                                           help='provision and share a package per recipient of a CSV or JSONL file')
+    provision_parser.add_argument('input', help="CSV or JSONL file with recipients, or '-' for stdin")
+    provision_parser.add_argument('--format', choices=('csv', 'jsonl'), help='defaults to the file extension')
+    provision_parser.add_argument('--library-document-id', required=True)
+    provision_parser.add_argument('--template-name', required=True)
+    provision_parser.add_argument('--package-name-format', default='{user_name} - {user_email}')
+    provision_parser.add_argument('--state', help='resumable state file (default: INPUT.state.jsonl)')
+    provision_parser.add_argument('--retry-failed', action='store_true',
+                                  help='provision rows that failed in an earlier run again')
+    provision_parser.add_argument('--deadline', type=float, help='time budget in seconds per recipient')
+    provision_parser.set_defaults(run=run_provision)
+
+    export_parser = commands.add_parser('export', parents=[common], help='export a package listing to JSONL')
+    export_parser.add_argument('--folder', default='INBOX')
+    export_parser.add_argument('--status', default='ALL', help='such as DRAFT, INPROGRESS or COMPLETED')
+    export_parser.add_argument('--page-size', type=int, default=DEFAULT_PAGE_SIZE)
+    export_parser.add_argument('--output', default='-', help="JSONL file, or '-' for stdout")
+    export_parser.set_defaults(run=run_export)
+    return parser
+
+
+# Runs the command line tool and returns its exit status:
+# 0 on success, 1 if rows failed or the export failed, 2 on usage errors, and 130 if provisioning was interrupted.
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    return args.run(args)
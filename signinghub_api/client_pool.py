@@ -0,0 +1,268 @@
+"""
+Copyright 2016, SolidBuilds.com. All rights reserved.
+Author: Ling Thio, ling.thio@gmail.com
+"""
+
+import collections
+import threading
+import time
+from concurrent.futures import Future
+
+from .deadline import bind_deadline
+from .retry import RateLimiter
+from .signinghub_api import SigningHubAPI
+from .transport import RequestsTransport, default_transport, DEFAULT_POOL_CONNECTIONS
+
+DEFAULT_MAX_TENANTS = 100                # Max number of tenant clients (and cached tokens) kept in memory
+DEFAULT_IDLE_TIMEOUT = 900.0             # Evict tenants that were not used for this many seconds
+DEFAULT_TENANT_RATE = 10.0               # Requests per second per tenant
+DEFAULT_POOL_WORKERS = 16                # Number of threads that run submitted jobs
+DEFAULT_TENANT_CONCURRENCY = 4           # Max number of jobs of one tenant that run at the same time
+
+
+# Serves many SigningHub accounts (tenants) from one process.
+# - credentials:      Optional callable(tenant_id) that returns a dict with client_id, client_secret, username,
+#                     password and (optionally) scope, rate and burst, for tenants that were not registered.
+# - max_tenants:      Max number of tenant clients kept in memory. The least recently used idle tenants are evicted.
+# - idle_timeout:     Tenants that were not used for this many seconds are evicted.
+# - rate, burst:      Default per-tenant request quota (see RateLimiter)
+# - max_workers:      Number of threads that run submitted jobs
+# - max_tenant_concurrency: Max number of jobs of one tenant that run at the same time
+# - pool_maxsize:     Max number of keep-alive connections, shared by all tenants
+# - session, transport: Optional requests.Session or transport (see transport.py) shared by all tenants
+# - configure:        Optional callable(api) that is called with every new tenant client,
+#                     such as FakeSigningHub.configure
+# - client_kwargs:    Passed to every SigningHubAPI, such as timeout, retry_policy, verbose or instrumentation.
+#                     Do not share one FieldLayoutCache between tenants: library document IDs are per account.
+#
+# Every tenant gets its own SigningHubAPI with its own token cache and RateLimiter,
+# while all tenants share one transport with its keep-alive connection pool.
+# Evicted tenants only lose their cached token: they are re-created on their next use.
+#
+# Jobs submitted with submit() are scheduled round-robin between tenants. A tenant with a long queue,
+# or one that is being throttled with 429 responses (which pause its RateLimiter), is skipped
+# until it may send again, so it does not hold up the worker threads of the other tenants.
+#
+#     pool = SigningHubClientPool(max_workers=32)
+#     pool.register('acme', client_id, client_secret, username, password, rate=5)
+#     future = pool.submit('acme', lambda api: api.add_package(None, 'My Package'))
+#     packages = pool.client('acme').get_packages(None)
+class SigningHubClientPool(object):
+
+    def __init__(self, credentials=None, max_tenants=DEFAULT_MAX_TENANTS, idle_timeout=DEFAULT_IDLE_TIMEOUT,
+                 rate=DEFAULT_TENANT_RATE, burst=None, max_workers=DEFAULT_POOL_WORKERS,
+                 max_tenant_concurrency=DEFAULT_TENANT_CONCURRENCY, session=None, transport=None,
+                 pool_connections=DEFAULT_POOL_CONNECTIONS, pool_maxsize=DEFAULT_POOL_WORKERS, configure=None,
+                 clock=time.monotonic, **client_kwargs):
+        self.credentials = credentials
+        self.max_tenants = max_tenants
+        self.idle_timeout = idle_timeout
+        self.rate = rate
+        self.burst = burst
+        self.max_workers = max_workers
+        self.max_tenant_concurrency = max_tenant_concurrency
+        self.configure = configure
+        self.client_kwargs = client_kwargs
+        self.clock = clock
+        self._owns_transport = transport is None
+        if transport is None:
+            if session is not None:
+                transport = RequestsTransport(session)
+            else:
+                transport = default_transport(pool_connections, pool_maxsize)
+        self.transport = transport
+        self._registered = {}               # tenant_id -> credentials dict
+        self._tenants = collections.OrderedDict()   # tenant_id -> _Tenant, least recently used first
+        self._ready = collections.deque()   # tenant_ids with queued jobs, in round-robin order
+        self._condition = threading.Condition()
+        self._workers = []
+        self._closed = False
+
+
+    # Registers the credentials of a tenant. rate and burst override the pool's default quota.
+    def register(self, tenant_id, client_id, client_secret, username, password, scope='', rate=None, burst=None):
+        with self._condition:
+            self._registered[tenant_id] = {
+                'client_id': client_id, 'client_secret': client_secret, 'username': username,
+                'password': password, 'scope': scope, 'rate': rate, 'burst': burst,
+            }
+
+
+    # Forgets a tenant and its cached token
+    def unregister(self, tenant_id):
+        with self._condition:
+            self._registered.pop(tenant_id, None)
+            tenant = self._tenants.get(tenant_id)
+            if tenant is not None and not tenant.busy:
+                self._evict(tenant_id)
+
+
+    # Returns the SigningHubAPI instance of a tenant, creating it if needed.
+    # Raises KeyError for unknown tenants.
+    def client(self, tenant_id):
+        with self._condition:
+            return self._tenant(tenant_id).api
+
+
+    # Schedules fn(api, *args, **kwargs) to run with the SigningHubAPI instance of a tenant.
+    # Returns a concurrent.futures.Future.
+    def submit(self, tenant_id, fn, *args, **kwargs):
+        future = Future()
+        with self._condition:
+            if self._closed:
+                raise RuntimeError('SigningHubClientPool is closed')
+            tenant = self._tenant(tenant_id)
+            tenant.queue.append((future, bind_deadline(fn), args, kwargs))
+            if len(tenant.queue) == 1:
+                self._ready.append(tenant_id)
+            if len(self._workers) < self.max_workers:
+                self._start_worker()
+            self._condition.notify()
+        return future
+
+
+    # Evicts the tenants that were idle for longer than idle_timeout
+    def evict_idle(self):
+        with self._condition:
+            self._evict_idle(self.clock())
+
+
+    @property
+    def tenant_count(self):
+        return len(self._tenants)
+
+
+    # Runs the jobs that are still queued, then stops the worker threads and closes the shared transport
+    def close(self):
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        for worker in self._workers:
+            worker.join()
+        with self._condition:
+            for tenant_id in list(self._tenants):
+                self._evict(tenant_id)
+        if self._owns_transport:
+            self.transport.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+    # Returns the _Tenant of tenant_id, creating its client if needed. Must be called with the lock held.
+    def _tenant(self, tenant_id):
+        now = self.clock()
+        tenant = self._tenants.get(tenant_id)
+        if tenant is None:
+            self._evict_idle(now, reserve=1)
+            tenant = self._create_tenant(tenant_id)
+            self._tenants[tenant_id] = tenant
+        else:
+            self._tenants.move_to_end(tenant_id)
+        tenant.last_used = now
+        return tenant
+
+
+    def _create_tenant(self, tenant_id):
+        credentials = self._registered.get(tenant_id)
+        if credentials is None and self.credentials is not None:
+            credentials = self.credentials(tenant_id)
+        if credentials is None:
+            raise KeyError('Unknown tenant: %r' % (tenant_id,))
+        rate = credentials.get('rate') or self.rate
+        burst = credentials.get('burst') or self.burst
+        rate_limiter = RateLimiter(rate, burst) if rate else None
+        api = SigningHubAPI(credentials['client_id'], credentials['client_secret'], credentials['username'],
+                            credentials['password'], credentials.get('scope', ''), transport=self.transport,
+                            rate_limiter=rate_limiter, **self.client_kwargs)
+        if self.configure is not None:
+            self.configure(api)
+        return _Tenant(api)
+
+
+    # Evicts idle tenants, then the least recently used ones while there are more than max_tenants - reserve.
+    # Tenants with queued or running jobs are never evicted.
+    def _evict_idle(self, now, reserve=0):
+        for tenant_id, tenant in list(self._tenants.items()):
+            if not tenant.busy and now - tenant.last_used > self.idle_timeout:
+                self._evict(tenant_id)
+        excess = len(self._tenants) + reserve - self.max_tenants
+        for tenant_id, tenant in list(self._tenants.items()):
+            if excess <= 0:
+                break
+            if not tenant.busy:
+                self._evict(tenant_id)
+                excess -= 1
+
+
+    def _evict(self, tenant_id):
+        tenant = self._tenants.pop(tenant_id)
+        tenant.api.stop_token_refresh()
+        tenant.api.close()
+
+
+    def _start_worker(self):
+        worker = threading.Thread(target=self._work, name='SigningHubClientPool-%d' % (len(self._workers) + 1))
+        worker.daemon = True
+        self._workers.append(worker)
+        worker.start()
+
+
+    def _work(self):
+        while True:
+            with self._condition:
+                while True:
+                    tenant, job, wait = self._next_job()
+                    if job is not None:
+                        break
+                    if self._closed and not self._ready:
+                        return
+                    self._condition.wait(wait)
+            future, fn, args, kwargs = job
+            if future.set_running_or_notify_cancel():
+                try:
+                    future.set_result(fn(tenant.api, *args, **kwargs))
+                except BaseException as e:
+                    future.set_exception(e)
+            with self._condition:
+                tenant.in_flight -= 1
+                tenant.last_used = self.clock()
+                self._condition.notify()
+
+
+    # Takes the next job, visiting tenants in round-robin order and skipping those that are at their
+    # concurrency limit or must wait for their rate limiter. Must be called with the lock held.
+    # Returns (tenant, job, None), or (None, None, seconds to wait) if no tenant may run a job now.
+    def _next_job(self):
+        wait = None
+        for _ in range(len(self._ready)):
+            tenant_id = self._ready.popleft()
+            tenant = self._tenants[tenant_id]
+            delay = tenant.api.rate_limiter.delay() if tenant.api.rate_limiter is not None else 0.0
+            if tenant.in_flight < self.max_tenant_concurrency and delay <= 0:
+                job = tenant.queue.popleft()
+                tenant.in_flight += 1
+                if tenant.queue:
+                    self._ready.append(tenant_id)
+                return tenant, job, None
+            self._ready.append(tenant_id)
+            if delay > 0:
+                wait = delay if wait is None else min(wait, delay)
+        return None, None, wait
+
+
+class _Tenant(object):
+    __slots__ = ('api', 'queue', 'in_flight', 'last_used')
+
+    def __init__(self, api):
+        self.api = api
+        self.queue = collections.deque()    # (future, fn, args, kwargs)
+        self.in_flight = 0
+        self.last_used = 0.0
+
+    @property
+    def busy(self):
+        return bool(self.queue) or self.in_flight > 0
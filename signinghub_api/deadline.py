@@ -0,0 +1,78 @@
+"""
+Copyright 2016, SolidBuilds.com. All rights reserved.
+Author: Ling Thio, ling.thio@gmail.com
+"""
+
+import contextlib
+import contextvars
+import time
+
+# Absolute time.monotonic() deadline of the current thread or asyncio task, or None
+_deadline = contextvars.ContextVar('signinghub_deadline', default=None)
+
+
+# Sets a time budget, in seconds, for all SigningHubAPI calls made inside the with block,
+# such as all steps of a provisioning chain. Nested deadlines can only shorten the budget.
+#
+# Request timeouts are shortened to the time that is left, retries that would end after the deadline
+# are not made, and calls made after the deadline fail with DeadlineExceededError.
+# The deadline is kept per thread and per asyncio task. fill_fields(), iter_packages(), PackageBuilder.build(),
+# sweep_packages() and SigningHubClientPool.submit() pass it on to their worker threads.
+#
+#     with signinghub_api.deadline(10):
+#         provision_package(signinghub_api, recipient, library_document_id, template_name)
+@contextlib.contextmanager
+def deadline(seconds):
+    expires_at = time.monotonic() + seconds
+    outer = _deadline.get()
+    if outer is not None and outer < expires_at:
+        expires_at = outer
+    token = _deadline.set(expires_at)
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+# Lifts the deadline inside the with block, for cleanup calls that must be made even after the deadline,
+# such as deleting a half-built package.
+@contextlib.contextmanager
+def no_deadline():
+    token = _deadline.set(None)
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+# Returns the absolute time.monotonic() deadline of the caller, or None
+def current_deadline():
+    return _deadline.get()
+
+
+# Returns the seconds left until the deadline of the caller, or None if there is no deadline
+def time_left():
+    expires_at = _deadline.get()
+    return None if expires_at is None else expires_at - time.monotonic()
+
+
+# Returns fn wrapped to run with the deadline of the caller, for use in worker threads
+def bind_deadline(fn):
+    expires_at = _deadline.get()
+    if expires_at is None:
+        return fn
+
+    def run(*args, **kwargs):
+        token = _deadline.set(expires_at)
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            _deadline.reset(token)
+    return run
+
+
+# Returns a requests-style timeout ((connect, read) or a number) that ends no later than time_left seconds
+def clip_timeout(timeout, time_left):
+    if isinstance(timeout, (tuple, list)):
+        return tuple(min(value, time_left) if value is not None else time_left for value in timeout)
+    return min(timeout, time_left) if timeout is not None else time_left
@@ -0,0 +1,354 @@
+"""
+Copyright 2016, SolidBuilds.com. All rights reserved.
+Author: Ling Thio, ling.thio@gmail.com
+"""
+
+import json
+import random
+import re
+import socket
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl
+
+
+# The content of documents added from the document library
+LIBRARY_DOCUMENT = b'%PDF-1.4\n% FakeSigningHub library document\n%%EOF\n'
+
+# The field layout of every document created by the fake server
+DEFAULT_FIELDS = {
+    'text': [
+        {'field_name': 'SH_FF_TEXT_314', 'page_no': 1, 'placeholder': '', 'max_length': 100, 'type': 'SINGLELINE',
+         'validation_rule': None, 'font': {'name': 'Arial', 'size': 10},
+         'dimensions': {'field': {'x': 100, 'y': 100, 'width': 200, 'height': 20}}, 'value': ''},
+    ],
+    'checkbox': [
+        {'field_name': 'SH_FF_CHECKBOX_1', 'page_no': 1, 'value': False,
+         'dimensions': {'field': {'x': 100, 'y': 140, 'width': 12, 'height': 12}}},
+    ],
+    'date': [
+        {'field_name': 'SH_FF_DATE_1', 'page_no': 1, 'format': 'dd/MM/yyyy', 'value': '',
+         'dimensions': {'field': {'x': 100, 'y': 180, 'width': 100, 'height': 20}}},
+    ],
+}
+
+
+# An in-process stand-in for the SigningHub API, for tests and benchmarks.
+# It implements /authenticate and the packages, documents, documents/library, fields, template, workflow and
+# workflow/{order}/user endpoints used by SigningHubAPI, and keeps packages in memory.
+# - latency:       Seconds added to every response, or a (min, max) tuple for a uniformly random latency
+# - error_rate:    Fraction of requests that fail with 500 Internal Server Error
+# - throttle_rate: Fraction of requests that fail with 429 Too Many Requests
+# - retry_after:   Retry-After header value sent with 429 responses (None to omit it)
+#
+#     with FakeSigningHub(latency=0.05, throttle_rate=0.01) as server:
+#         api = server.configure(SigningHubAPI('client', 'secret', 'user', 'password'))
+class FakeSigningHub(object):
+
+    def __init__(self, latency=0.0, error_rate=0.0, throttle_rate=0.0, retry_after=0, host='127.0.0.1', port=0,
+                 fields=None, seed=None, token_expires_in=3600):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+        self.host = host
+        self.port = port
+        self.fields = fields if fields is not None else DEFAULT_FIELDS
+        self.token_expires_in = token_expires_in
+        self.random = random.Random(seed)
+        self.packages = {}                  # package_id -> package information record
+        self.request_count = 0
+        self.status_counts = {}
+        self._next_id = 1000
+        self._tokens = set()
+        self._lock = threading.Lock()
+        self._server = None
+        self._thread = None
+
+
+    @property
+    def url(self):
+        return 'http://%s:%d/' % (self.host, self.port)
+
+    @property
+    def base_url(self):
+        return self.url + 'v3/'
+
+    @property
+    def auth_url(self):
+        return self.url + 'authenticate'
+
+
+    # Points a SigningHubAPI or AsyncSigningHubAPI instance at this server and returns it
+    def configure(self, api):
+        api.base_url = self.base_url
+        api.auth_url = self.auth_url
+        return api
+
+
+    def start(self):
+        server = ThreadingHTTPServer((self.host, self.port), _make_handler(self))
+        server.daemon_threads = True
+        self._server = server
+        self.port = server.server_address[1]
+        self._thread = threading.Thread(target=server.serve_forever, name='FakeSigningHub')
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._thread.join()
+            self._server = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+
+    # Handles one request. Returns (status_code, extra headers, response data).
+    def handle(self, method, path, headers, body):
+        with self._lock:
+            self.request_count += 1
+            roll = self.random.random()
+        self._sleep()
+
+        if roll < self.throttle_rate:
+            extra_headers = {} if self.retry_after is None else {'Retry-After': str(self.retry_after)}
+            return 429, extra_headers, {'Message': 'Too many requests'}
+        if roll < self.throttle_rate + self.error_rate:
+            return 500, {}, {'Message': 'Internal server error'}
+
+        if path == '/authenticate' and method == 'POST':
+            return self._authenticate(dict(parse_qsl(body.decode('utf-8'))))
+
+        if not path.startswith('/v3/'):
+            return 404, {}, {'Message': 'Not found'}
+        authorization = headers.get('Authorization') or ''
+        if authorization[len('Bearer '):] not in self._tokens:
+            return 401, {}, {'Message': 'Invalid access token'}
+        if (headers.get('Content-Type') or '').startswith('application/json'):
+            data = json.loads(body.decode('utf-8')) if body else None
+        else:
+            data = body                     # Document uploads
+
+        for route_method, pattern, handler in _ROUTES:
+            if route_method == method:
+                match = pattern.match(path[len('/v3/'):])
+                if match:
+                    with self._lock:
+                        return handler(self, headers, data, *match.groups())
+        return 404, {}, {'Message': 'Not found'}
+
+
+    def _sleep(self):
+        latency = self.latency
+        if isinstance(latency, (tuple, list)):
+            latency = self.random.uniform(latency[0], latency[1])
+        if latency > 0:
+            time.sleep(latency)
+
+    def _new_id(self):
+        self._next_id += 1
+        return self._next_id
+
+    def _authenticate(self, form):
+        if form.get('grant_type') not in ('password', 'refresh_token') or not form.get('client_id'):
+            return 400, {}, {'Message': 'Invalid grant'}
+        with self._lock:
+            access_token = 'token-%d' % self._new_id()
+            self._tokens.add(access_token)
+        return 200, {}, {'access_token': access_token, 'token_type': 'bearer', 'expires_in': self.token_expires_in,
+                         'refresh_token': 'refresh-' + access_token}
+
+    def _package(self, package_id):
+        return self.packages.get(int(package_id))
+
+    def _add_package(self, headers, data):
+        package_id = self._new_id()
+        self.packages[package_id] = {
+            'package_id': package_id,
+            'package_name': (data or {}).get('package_name', ''),
+            'package_status': 'DRAFT',
+            'folder': 'INBOX',
+            'modified_on': _now(),
+            'documents': {},
+            'users': {},
+        }
+        return 200, {}, {'package_id': package_id}
+
+    def _get_packages(self, headers, data, status, page_no, page_size):
+        folder = headers.get('x-folder') or 'INBOX'
+        search_text = headers.get('x-search-text')
+        page_no, page_size = int(page_no), int(page_size)
+        # Like SigningHub, list the most recently modified packages first
+        packages = sorted(self.packages.values(), key=lambda package: (package['modified_on'], package['package_id']),
+                          reverse=True)
+        records = [_public(package) for package in packages
+                   if package['folder'] == folder
+                   and (status == 'ALL' or package['package_status'] == status)
+                   and (not search_text or search_text in package['package_name'])]
+        return 200, {'x-total-records': str(len(records))}, records[(page_no - 1) * page_size:page_no * page_size]
+
+    def _delete_package(self, headers, data, package_id):
+        if self.packages.pop(int(package_id), None) is None:
+            return 404, {}, {'Message': 'Package not found'}
+        return 200, {}, None
+
+    def _add_library_document(self, headers, data, package_id, library_document_id):
+        package = self._package(package_id)
+        if package is None:
+            return 404, {}, {'Message': 'Package not found'}
+        return 200, {}, {'document_id': self._new_document(package, library_document_id, LIBRARY_DOCUMENT)}
+
+    def _upload_document(self, headers, data, package_id):
+        package = self._package(package_id)
+        if package is None:
+            return 404, {}, {'Message': 'Package not found'}
+        if not data:
+            return 400, {}, {'Message': 'Empty document'}
+        return 200, {}, {'document_id': self._new_document(package, headers.get('x-file-name'), data)}
+
+    def _new_document(self, package, document_name, content):
+        document_id = self._new_id()
+        package['documents'][document_id] = {'document_id': document_id, 'document_name': document_name,
+                                             'fields': json.loads(json.dumps(self.fields)), 'content': content}
+        return document_id
+
+    def _download_document(self, headers, data, package_id, document_id):
+        document = self._document(package_id, document_id)
+        if document is None:
+            return 404, {}, {'Message': 'Document not found'}
+        return 200, {}, document['content']
+
+    def _document(self, package_id, document_id):
+        package = self._package(package_id)
+        return package['documents'].get(int(document_id)) if package else None
+
+    def _rename_document(self, headers, data, package_id, document_id):
+        document = self._document(package_id, document_id)
+        if document is None:
+            return 404, {}, {'Message': 'Document not found'}
+        document['document_name'] = (data or {}).get('document_name')
+        return 200, {}, None
+
+    def _apply_template(self, headers, data, package_id, document_id):
+        if self._document(package_id, document_id) is None:
+            return 404, {}, {'Message': 'Document not found'}
+        return 200, {}, None
+
+    def _get_fields(self, headers, data, package_id, document_id):
+        document = self._document(package_id, document_id)
+        if document is None:
+            return 404, {}, {'Message': 'Document not found'}
+        return 200, {}, document['fields']
+
+    def _update_field(self, headers, data, package_id, document_id, field_type):
+        document = self._document(package_id, document_id)
+        if document is None:
+            return 404, {}, {'Message': 'Document not found'}
+        for field in document['fields'].get(field_type, ()):
+            if field['field_name'] == (data or {}).get('field_name'):
+                field['value'] = data.get('value')
+                return 200, {}, None
+        return 400, {}, {'Message': 'Field not found'}
+
+    def _update_workflow_user(self, headers, data, package_id, order):
+        package = self._package(package_id)
+        if package is None:
+            return 404, {}, {'Message': 'Package not found'}
+        package['users'][int(order)] = data
+        _touch(package)
+        return 200, {}, None
+
+    def _share(self, headers, data, package_id):
+        package = self._package(package_id)
+        if package is None:
+            return 404, {}, {'Message': 'Package not found'}
+        package['package_status'] = 'INPROGRESS'
+        _touch(package)
+        return 200, {}, None
+
+
+_ROUTES = [(method, re.compile(pattern + '$'), handler) for method, pattern, handler in (
+    ('POST', r'packages', FakeSigningHub._add_package),
+    ('GET', r'packages/(\w+)/(\d+)/(\d+)', FakeSigningHub._get_packages),
+    ('DELETE', r'packages/(\d+)', FakeSigningHub._delete_package),
+    ('POST', r'packages/(\d+)/documents', FakeSigningHub._upload_document),
+    ('POST', r'packages/(\d+)/documents/library/(\w+)', FakeSigningHub._add_library_document),
+    ('GET', r'packages/(\d+)/documents/(\d+)', FakeSigningHub._download_document),
+    ('PUT', r'packages/(\d+)/documents/(\d+)', FakeSigningHub._rename_document),
+    ('POST', r'packages/(\d+)/documents/(\d+)/template', FakeSigningHub._apply_template),
+    ('GET', r'packages/(\d+)/documents/(\d+)/fields', FakeSigningHub._get_fields),
+    ('PUT', r'packages/(\d+)/documents/(\d+)/fields/(\w+)', FakeSigningHub._update_field),
+    ('PUT', r'packages/(\d+)/workflow/(\d+)/user', FakeSigningHub._update_workflow_user),
+    ('POST', r'packages/(\d+)/workflow', FakeSigningHub._share),
+)]
+
+
+# Returns the current time in the format of 'modified_on'
+def _now():
+    return time.strftime('%Y-%m-%dT%H:%M:%S')
+
+
+def _touch(package):
+    package['modified_on'] = _now()
+
+
+# Returns a package information record without the server-side document and user state
+def _public(package):
+    return dict((key, value) for key, value in package.items() if key not in ('documents', 'users'))
+
+
+def _make_handler(fake):
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'       # Keep-alive, like the real API
+
+        def setup(self):
+            BaseHTTPRequestHandler.setup(self)
+            # Headers and body are written separately: do not let Nagle's algorithm delay the body
+            self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+        def _handle(self):
+            if self.headers.get('Transfer-Encoding') == 'chunked':
+                body = self._read_chunked()
+            else:
+                length = int(self.headers.get('Content-Length') or 0)
+                body = self.rfile.read(length) if length else b''
+            status_code, extra_headers, data = fake.handle(self.command, self.path, self.headers, body)
+            with fake._lock:
+                fake.status_counts[status_code] = fake.status_counts.get(status_code, 0) + 1
+            if isinstance(data, bytes):
+                content, content_type = data, 'application/octet-stream'
+            else:
+                content, content_type = json.dumps(data).encode('utf-8') if data is not None else b'', 'application/json'
+            self.send_response(status_code)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(content)))
+            for name, value in extra_headers.items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(content)
+
+        def _read_chunked(self):
+            chunks = []
+            while True:
+                size = int(self.rfile.readline().split(b';')[0].strip(), 16)
+                if not size:
+                    self.rfile.readline()
+                    return b''.join(chunks)
+                chunks.append(self.rfile.read(size))
+                self.rfile.readline()
+
+        do_GET = do_POST = do_PUT = do_DELETE = _handle
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
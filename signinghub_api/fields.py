@@ -0,0 +1,82 @@
+"""
+Copyright 2016, SolidBuilds.com. All rights reserved.
+Author: Ling Thio, ling.thio@gmail.com
+"""
+
+# Field settings that are copied from the current field when a field value is updated
+COPIED_FIELD_SETTINGS = ('page_no', 'placeholder', 'max_length', 'validation_rule', 'font', 'format',
+                         'radio_group_name', 'tab_order', 'level_of_assurance')
+
+
+# Indexes a get_document_fields() response by field name, across all field types
+# ('text', 'checkbox', 'radio', 'date', ...), so that each field is found with a single dict lookup.
+# When several fields share a name, the last one wins, like SigningHubAPI.update_textbox_field() does.
+class FieldIndex(object):
+
+    def __init__(self, fields):
+        self._fields = {}
+        for field_type, type_fields in (fields or {}).items():
+            if not isinstance(type_fields, list):
+                continue
+            for field in type_fields:
+                if isinstance(field, dict) and 'field_name' in field:
+                    self._fields[field['field_name']] = (field_type, field)
+
+
+    # Returns (field_type, field) for field_name, or None.
+    def get(self, field_name):
+        return self._fields.get(field_name)
+
+
+    # Returns the names in field_names that are not in this index, in order.
+    def unknown(self, field_names):
+        return [field_name for field_name in field_names if field_name not in self._fields]
+
+
+    def names(self):
+        return list(self._fields)
+
+    def __contains__(self, field_name):
+        return field_name in self._fields
+
+    def __len__(self):
+        return len(self._fields)
+
+
+# Returns the payload to update field (of type field_type) with a new value,
+# re-using the current settings of the field.
+def field_update_payload(field_type, field, field_value):
+    payload = {
+        'field_name': field['field_name'],
+    }
+    for key in COPIED_FIELD_SETTINGS:
+        if key in field:
+            payload[key] = field[key]
+    if 'type' in field:
+        payload['field_type'] = field['type']
+    dimensions = field.get('dimensions')
+    if isinstance(dimensions, dict) and 'field' in dimensions:
+        payload['dimensions'] = dimensions['field']
+    payload['value'] = field_value
+    return payload
+
+
+# The outcome of SigningHubAPI.fill_fields().
+# - unknown_fields: names that are not fields of the document. These were not sent.
+# - results:        field_name -> True or False, for every field that was sent
+# - errors:         field_name -> error message, for every field that failed
+class FieldFillResult(object):
+    __slots__ = ('unknown_fields', 'results', 'errors')
+
+    def __init__(self, unknown_fields=None):
+        self.unknown_fields = unknown_fields or []
+        self.results = {}
+        self.errors = {}
+
+    @property
+    def success(self):
+        return not self.unknown_fields and all(self.results.values())
+
+    def __repr__(self):
+        return '<FieldFillResult updated=%d failed=%d unknown=%r>' % (
+            sum(1 for ok in self.results.values() if ok), len(self.errors), self.unknown_fields)
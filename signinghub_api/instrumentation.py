@@ -0,0 +1,194 @@
+"""
+Copyright 2016, SolidBuilds.com. All rights reserved.
+Author: Ling Thio, ling.thio@gmail.com
+"""
+
+import math
+import threading
+
+
+# Describes one completed SigningHubAPI call, including all its retries.
+# - endpoint:       URL template, such as 'packages/{package_id}/workflow'
+# - status_code:    HTTP status code of the last attempt, or None if no response was received
+# - elapsed:        Wall time in seconds, including retries and backoff
+# - bytes_sent:     Request body size of the last attempt
+# - bytes_received: Response body size of the last attempt
+# - retries:        Number of attempts after the first one
+# - error:          Exception class name if the call ended without a (complete) response: a connection error,
+#                   timeout, passed deadline ('DeadlineExceededError') or any other exception. None otherwise.
+class CallEvent(object):
+    __slots__ = ('function_name', 'method', 'endpoint', 'status_code', 'elapsed', 'bytes_sent', 'bytes_received',
+                 'retries', 'error')
+
+    def __init__(self, function_name, method, endpoint, status_code, elapsed, bytes_sent, bytes_received, retries,
+                 error=None):
+        self.function_name = function_name
+        self.method = method
+        self.endpoint = endpoint
+        self.status_code = status_code
+        self.elapsed = elapsed
+        self.bytes_sent = bytes_sent
+        self.bytes_received = bytes_received
+        self.retries = retries
+        self.error = error
+
+    @property
+    def success(self):
+        return self.status_code in (200, 201)
+
+
+# Base class for instrumentation hooks. Set SigningHubAPI.instrumentation to an instance of a subclass.
+# Hooks are called on the thread (or in the task) that makes the call, so they should be fast.
+# Without instrumentation (the default), no events are created at all.
+class Instrumentation(object):
+
+    # Called before the first attempt of a call
+    def before_call(self, function_name, method, endpoint):
+        pass
+
+    # Called with a CallEvent after the last attempt of a call
+    def after_call(self, event):
+        pass
+
+
+# Forwards events to several Instrumentation objects
+class MultiInstrumentation(Instrumentation):
+
+    def __init__(self, *instrumentations):
+        self.instrumentations = list(instrumentations)
+
+    def before_call(self, function_name, method, endpoint):
+        for instrumentation in self.instrumentations:
+            instrumentation.before_call(function_name, method, endpoint)
+
+    def after_call(self, event):
+        for instrumentation in self.instrumentations:
+            instrumentation.after_call(event)
+
+
+# A latency histogram with logarithmic buckets: bucket i holds latencies up to min_latency * growth ** i.
+# Memory use is constant, and percentiles are accurate to within one bucket (about 10% with growth=1.1).
+class LatencyHistogram(object):
+
+    def __init__(self, min_latency=0.0001, growth=1.1, max_buckets=200):
+        self.min_latency = min_latency
+        self.growth = growth
+        self._log_growth = math.log(growth)
+        self.counts = [0] * max_buckets
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, latency):
+        if latency <= self.min_latency:
+            index = 0
+        else:
+            index = min(len(self.counts) - 1, int(math.ceil(math.log(latency / self.min_latency) / self._log_growth)))
+        self.counts[index] += 1
+        self.count += 1
+        self.total += latency
+        if latency > self.max:
+            self.max = latency
+
+    # Returns the upper bound of the bucket that holds the p-th percentile (0-100)
+    def percentile(self, p):
+        if not self.count:
+            return 0.0
+        rank = max(1, int(math.ceil(p / 100.0 * self.count)))
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                return min(self.max, self.min_latency * self.growth ** index)
+        return self.max
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else 0.0
+
+
+# Aggregates call events in memory, per function name and endpoint template.
+#
+#     collector = HistogramCollector()
+#     signinghub_api.instrumentation = collector
+#     ...
+#     print(collector.report())
+class HistogramCollector(Instrumentation):
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    def after_call(self, event):
+        key = (event.function_name, event.endpoint)
+        with self._lock:
+            stats = self._stats.get(key)
+            if stats is None:
+                stats = self._stats[key] = _EndpointStats()
+            stats.add(event)
+
+
+    # Returns a list of dicts, one per (function_name, endpoint), with counts, bytes and latency percentiles
+    def summary(self):
+        with self._lock:
+            items = sorted(self._stats.items())
+            return [stats.as_dict(function_name, endpoint) for (function_name, endpoint), stats in items]
+
+
+    # Returns the summary as a text table, slowest endpoints (by total time) first
+    def report(self):
+        rows = sorted(self.summary(), key=lambda row: row['total_time'], reverse=True)
+        lines = ['%-45s %7s %6s %7s %9s %9s %9s %9s %10s %10s' % (
+            'function', 'calls', 'errors', 'retries', 'total s', 'p50 ms', 'p95 ms', 'p99 ms', 'sent', 'received')]
+        for row in rows:
+            lines.append('%-45s %7d %6d %7d %9.2f %9.1f %9.1f %9.1f %10d %10d' % (
+                row['function_name'], row['calls'], row['errors'], row['retries'], row['total_time'],
+                row['p50'] * 1000, row['p95'] * 1000, row['p99'] * 1000, row['bytes_sent'], row['bytes_received']))
+        return '\n'.join(lines)
+
+
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
+
+
+class _EndpointStats(object):
+    __slots__ = ('calls', 'errors', 'retries', 'bytes_sent', 'bytes_received', 'status_codes', 'histogram')
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.retries = 0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.status_codes = {}
+        self.histogram = LatencyHistogram()
+
+    def add(self, event):
+        self.calls += 1
+        if not event.success:
+            self.errors += 1
+        self.retries += event.retries
+        self.bytes_sent += event.bytes_sent
+        self.bytes_received += event.bytes_received
+        self.status_codes[event.status_code] = self.status_codes.get(event.status_code, 0) + 1
+        self.histogram.add(event.elapsed)
+
+    def as_dict(self, function_name, endpoint):
+        histogram = self.histogram
+        return {
+            'function_name': function_name,
+            'endpoint': endpoint,
+            'calls': self.calls,
+            'errors': self.errors,
+            'retries': self.retries,
+            'bytes_sent': self.bytes_sent,
+            'bytes_received': self.bytes_received,
+            'status_codes': dict(self.status_codes),
+            'total_time': histogram.total,
+            'mean': histogram.mean,
+            'p50': histogram.percentile(50),
+            'p95': histogram.percentile(95),
+            'p99': histogram.percentile(99),
+            'max': histogram.max,
+        }
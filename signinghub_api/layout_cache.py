@@ -0,0 +1,110 @@
+"""
+Copyright 2016, SolidBuilds.com. All rights reserved.
+Author: Ling Thio, ling.thio@gmail.com
+"""
+
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+from .fields import FieldIndex
+
+DEFAULT_MAX_ENTRIES = 128                # Max number of field layouts kept in memory
+DEFAULT_TTL = 24 * 60 * 60.0             # Field layouts expire after this many seconds
+
+
+# A bounded LRU cache of document field layouts, keyed by (library_document_id, template_name).
+#
+# Every package created from the same library document and workflow template has the same field layout,
+# so the get_document_fields() response of one package can be re-used to build the field updates of the next.
+# - max_entries: Least recently used layouts are evicted beyond this number
+# - ttl:         Layouts older than this many seconds are ignored. None means: never expire.
+# - path:        Optional JSON file. Layouts are loaded from it on creation and written to it on every put(),
+#                so that later runs can skip the get_document_fields() round trip as well.
+class FieldLayoutCache(object):
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES, ttl=DEFAULT_TTL, path=None, clock=time.time):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.path = path
+        self.clock = clock
+        self._entries = OrderedDict()       # key -> [fields, stored_at, FieldIndex or None]
+        self._lock = threading.Lock()
+        if path and os.path.exists(path):
+            self.load(path)
+
+
+    # Returns the FieldIndex of the cached layout, or None if there is no fresh layout for this key.
+    def get(self, library_document_id, template_name):
+        key = _key(library_document_id, template_name)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if self.ttl is not None and self.clock() - entry[1] > self.ttl:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            if entry[2] is None:
+                entry[2] = FieldIndex(entry[0])
+            return entry[2]
+
+
+    # Stores a get_document_fields() response.
+    def put(self, library_document_id, template_name, fields):
+        key = _key(library_document_id, template_name)
+        with self._lock:
+            self._entries[key] = [fields, self.clock(), None]
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        if self.path:
+            self.save(self.path)
+
+
+    def invalidate(self, library_document_id=None, template_name=None):
+        with self._lock:
+            if library_document_id is None and template_name is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(_key(library_document_id, template_name), None)
+
+
+    def __len__(self):
+        return len(self._entries)
+
+
+    # Writes all layouts to a JSON file, atomically.
+    def save(self, path):
+        with self._lock:
+            records = [{'library_document_id': key[0], 'template_name': key[1], 'fields': entry[0],
+                        'stored_at': entry[1]} for key, entry in self._entries.items()]
+        directory = os.path.dirname(os.path.abspath(path))
+        fd, temp_path = tempfile.mkstemp(dir=directory, prefix='.field_layouts.')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(records, f)
+            os.replace(temp_path, path)
+        except Exception:
+            os.unlink(temp_path)
+            raise
+
+
+    # Reads layouts from a JSON file written by save().
+    def load(self, path):
+        with open(path) as f:
+            records = json.load(f)
+        with self._lock:
+            for record in records:
+                key = _key(record['library_document_id'], record['template_name'])
+                self._entries[key] = [record['fields'], record.get('stored_at', self.clock()), None]
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+# Library document IDs are ints in settings files but strings after a JSON round trip
+def _key(library_document_id, template_name):
+    return str(library_document_id), template_name or ''
@@ -0,0 +1,256 @@
+"""
+Copyright 2016, SolidBuilds.com. All rights reserved.
+Author: Ling Thio, ling.thio@gmail.com
+"""
+
+import json
+import sqlite3
+import threading
+
+from .signinghub_api import DEFAULT_PAGE_SIZE
+
+DEFAULT_DELTA_PAGE_SIZE = 20             # Most polls find few changes: fetch small pages
+
+
+# The outcome of PackageMirror.sync().
+# - pages:   Number of get_packages() pages fetched
+# - fetched: Number of package information records received
+# - changed: Number of packages that were new or changed
+# - deleted: Number of packages removed because they are no longer listed (full syncs only).
+#            0 if the listing changed during the sync: see PackageMirror.
+# - error:   None on success. On failure, the records fetched so far are kept but the watermark is not moved,
+#            so the next sync fetches them again.
+class SyncResult(object):
+    __slots__ = ('pages', 'fetched', 'changed', 'deleted', 'full', 'error')
+
+    def __init__(self, full):
+        self.pages = 0
+        self.fetched = 0
+        self.changed = 0
+        self.deleted = 0
+        self.full = full
+        self.error = None
+
+    @property
+    def success(self):
+        return self.error is None
+
+    def __repr__(self):
+        return '<SyncResult full=%s pages=%d fetched=%d changed=%d deleted=%d error=%r>' % (
+            self.full, self.pages, self.fetched, self.changed, self.deleted, self.error)
+
+
+# A local SQLite copy of the package listing of one folder, kept up to date with delta syncs.
+# - path:      SQLite database file. ':memory:' keeps the mirror in memory only.
+# - folder:    The folder to mirror
+# - page_size: get_packages() page size of full syncs
+# - delta_page_size: get_packages() page size of delta syncs. A poll without changes fetches one such page.
+#
+# SigningHub lists packages most recently modified first. sync() remembers the highest 'modified_on'
+# it has seen (the watermark) and stops paging at the first package that is older than the watermark,
+# so a poll costs one page plus the pages with changes, instead of the whole folder.
+# Deleted packages do not show up in a delta sync: sync(full=True) pages through the whole folder
+# and removes the packages that are no longer listed. The first sync is always a full sync.
+#
+# Pages are fetched by offset, so packages that are deleted or modified during a full sync shift the later pages,
+# and live packages may be skipped. A package that is missing from the listing is therefore only removed when
+# a second listing confirms it, and only if both listings agree. Otherwise nothing is removed and the
+# watermark is not moved, so that the next sync fetches the skipped packages again.
+#
+# Like a PackageCatalog, an attached mirror also follows the packages that are added, shared and deleted
+# through the SigningHubAPI instance.
+#
+#     mirror = PackageMirror('packages.db')
+#     mirror.sync(signinghub_api)
+#     completed = mirror.find_by_status('COMPLETED')
+class PackageMirror(object):
+
+    def __init__(self, path=':memory:', folder='INBOX', page_size=DEFAULT_PAGE_SIZE,
+                 delta_page_size=DEFAULT_DELTA_PAGE_SIZE):
+        self.path = path
+        self.folder = folder
+        self.page_size = page_size
+        self.delta_page_size = delta_page_size
+        self._lock = threading.RLock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        with self._db:
+            self._db.execute('CREATE TABLE IF NOT EXISTS packages ('
+                             'folder TEXT NOT NULL, package_id INTEGER NOT NULL, package_name TEXT, '
+                             'package_status TEXT, modified_on TEXT, data TEXT NOT NULL, '
+                             'PRIMARY KEY (folder, package_id))')
+            self._db.execute('CREATE INDEX IF NOT EXISTS packages_status ON packages (folder, package_status)')
+            self._db.execute('CREATE INDEX IF NOT EXISTS packages_name ON packages (folder, package_name)')
+            self._db.execute('CREATE TABLE IF NOT EXISTS sync_state (folder TEXT PRIMARY KEY, watermark TEXT)')
+
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+    # The highest 'modified_on' seen by the last successful sync, or None before the first sync
+    @property
+    def watermark(self):
+        with self._lock:
+            row = self._db.execute('SELECT watermark FROM sync_state WHERE folder = ?', (self.folder,)).fetchone()
+            return row[0] if row else None
+
+
+    # Fetches the packages that changed since the last sync and stores them.
+    # With full=True (or on the first sync), fetches all packages and removes the ones that are confirmed gone.
+    # Returns a SyncResult.
+    def sync(self, api, access_token=None, full=False):
+        watermark = self.watermark
+        full = full or not watermark
+        result = SyncResult(full)
+        listing = self._fetch(api, access_token, full, watermark, result)
+        if listing is None:
+            return result
+        seen_ids, new_watermark = listing
+
+        with self._lock:
+            stored_ids = set(row[0] for row in self._db.execute(
+                'SELECT package_id FROM packages WHERE folder = ?', (self.folder,))) if full else set()
+        gone = stored_ids - seen_ids
+        if gone:
+            # Confirm that the missing packages are really gone, and not skipped by shifting pages
+            listing = self._fetch(api, access_token, True, watermark, result)
+            if listing is None:
+                return result
+            if listing[0] != seen_ids:
+                return result               # The listing changed while it was read: remove nothing
+        with self._lock, self._db:
+            self._db.executemany('DELETE FROM packages WHERE folder = ? AND package_id = ?',
+                                 [(self.folder, package_id) for package_id in gone])
+            result.deleted = len(gone)
+            self._db.execute('INSERT OR REPLACE INTO sync_state (folder, watermark) VALUES (?, ?)',
+                             (self.folder, new_watermark or ''))
+        return result
+
+
+    # Pages through the listing and stores the new and changed packages. A delta listing (full=False)
+    # stops at the first package that is older than watermark.
+    # Returns (IDs of the listed packages, new watermark), or None if a page could not be retrieved.
+    def _fetch(self, api, access_token, full, watermark, result):
+        page_size = self.page_size if full else self.delta_page_size
+        new_watermark = watermark
+        seen_ids = set()
+        page_no = 1
+        while True:
+            packages = api.get_packages(access_token, self.folder, page_no, page_size)
+            if packages is None:
+                result.error = api.last_error_message or 'Unknown error'
+                return None
+            result.pages += 1
+            result.fetched += len(packages)
+            done = len(packages) < page_size
+            changed = []
+            for package in packages:
+                modified_on = package.get('modified_on')
+                if not full and watermark is not None and modified_on is not None and modified_on < watermark:
+                    # Everything from here on was seen by an earlier sync
+                    done = True
+                    break
+                seen_ids.add(package['package_id'])
+                changed.append(package)
+                if modified_on is not None and (new_watermark is None or modified_on > new_watermark):
+                    new_watermark = modified_on
+            result.changed += self._store(changed)
+            if done:
+                return seen_ids, new_watermark
+            page_no += 1
+
+
+    # Returns the package information record of package_id, or None.
+    def get(self, package_id):
+        with self._lock:
+            row = self._db.execute('SELECT data FROM packages WHERE folder = ? AND package_id = ?',
+                                   (self.folder, package_id)).fetchone()
+            return json.loads(row[0]) if row else None
+
+
+    # Returns the package information records of all packages with status package_status, most recent first.
+    def find_by_status(self, package_status):
+        return self._query('package_status = ?', (package_status,))
+
+
+    # Returns the package information records of all packages named package_name, most recent first.
+    def find_by_name(self, package_name):
+        return self._query('package_name = ?', (package_name,))
+
+
+    # Returns the package information records of the packages modified after modified_on, most recent first.
+    def modified_since(self, modified_on):
+        return self._query('modified_on > ?', (modified_on,))
+
+
+    def __len__(self):
+        with self._lock:
+            return self._db.execute('SELECT COUNT(*) FROM packages WHERE folder = ?', (self.folder,)).fetchone()[0]
+
+    def __contains__(self, package_id):
+        return self.get(package_id) is not None
+
+    def __iter__(self):
+        return iter(self._query('1', ()))
+
+
+    # Follows the packages that are added, shared and deleted through api.
+    def attach(self, api):
+        if self not in api.package_listeners:
+            api.package_listeners.append(self)
+
+    def detach(self, api):
+        if self in api.package_listeners:
+            api.package_listeners.remove(self)
+
+
+    # Package listener methods, called by SigningHubAPI.
+    # Local changes do not move the watermark: the next sync fetches the server's version of these packages.
+    def package_added(self, package_id, package_name):
+        self._store([{'package_id': package_id, 'package_name': package_name, 'package_status': 'DRAFT',
+                      'folder': self.folder}])
+
+    def package_shared(self, package_id):
+        package = self.get(package_id)
+        if package is not None:
+            package['package_status'] = 'INPROGRESS'
+            self._store([package])
+
+    def package_deleted(self, package_id):
+        with self._lock, self._db:
+            self._db.execute('DELETE FROM packages WHERE folder = ? AND package_id = ?', (self.folder, package_id))
+
+
+    # Upserts package information records in one transaction. Returns the number of new or changed records.
+    def _store(self, packages):
+        if not packages:
+            return 0
+        with self._lock, self._db:
+            changed = 0
+            for package in packages:
+                data = json.dumps(package, sort_keys=True)
+                row = self._db.execute('SELECT data FROM packages WHERE folder = ? AND package_id = ?',
+                                       (self.folder, package['package_id'])).fetchone()
+                if row is not None and row[0] == data:
+                    continue
+                self._db.execute('INSERT OR REPLACE INTO packages '
+                                 '(folder, package_id, package_name, package_status, modified_on, data) '
+                                 'VALUES (?, ?, ?, ?, ?, ?)',
+                                 (self.folder, package['package_id'], package.get('package_name'),
+                                  package.get('package_status'), package.get('modified_on'), data))
+                changed += 1
+            return changed
+
+
+    def _query(self, where, params):
+        with self._lock:
+            rows = self._db.execute('SELECT data FROM packages WHERE folder = ? AND ' + where +
+                                    ' ORDER BY modified_on DESC, package_id DESC', (self.folder,) + params)
+            return [json.loads(row[0]) for row in rows]
@@ -0,0 +1,161 @@
+"""
+Copyright 2016, SolidBuilds.com. All rights reserved.
+Author: Ling Thio, ling.thio@gmail.com
+"""
+
+import contextlib
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+from .deadline import deadline as deadline_scope, no_deadline, bind_deadline
+from .results import SigningHubError
+
+DEFAULT_MAX_WORKERS = 8                  # Number of provisioning chains that run in parallel
+
+
+# Raised by provision_package() when one of the steps of the provisioning chain fails.
+class ProvisioningError(Exception):
+
+    def __init__(self, step, message):
+        super(ProvisioningError, self).__init__(step + '() failed: ' + str(message))
+        self.step = step
+        self.message = message
+
+
+# The outcome of provisioning one recipient.
+# - package_id and document_id are set on success. error is set on failure.
+# - failed_step is the name of the SigningHubAPI method that failed.
+class ProvisioningResult(object):
+    __slots__ = ('index', 'recipient', 'package_id', 'document_id', 'error', 'failed_step')
+
+    def __init__(self, index, recipient, package_id=None, document_id=None, error=None, failed_step=None):
+        self.index = index
+        self.recipient = recipient
+        self.package_id = package_id
+        self.document_id = document_id
+        self.error = error
+        self.failed_step = failed_step
+
+    @property
+    def success(self):
+        return self.error is None
+
+    def __repr__(self):
+        if self.success:
+            return '<ProvisioningResult %s package_id=%s>' % (self.recipient.get('user_email'), self.package_id)
+        return '<ProvisioningResult %s failed in %s: %s>' % (self.recipient.get('user_email'), self.failed_step,
+                                                           self.error)
+
+
+# Runs the full provisioning chain for one recipient:
+#   add_package > upload_document_from_library > rename_document > apply_workflow_template >
+#   get_document_fields > fill_fields > update_workflow_user > share_document
+#
+# get_document_fields is skipped when api has a field_layout_cache that knows the layout.
+# - recipient: dict with 'user_email' and 'user_name', and optionally 'package_name',
+#              'document_name' and 'fields' (a dict of field names and values).
+#
+# Returns (package_id, document_id) on success.
+# Raises ProvisioningError otherwise, after deleting the partially created package.
+def provision_package(api, recipient, library_document_id, template_name,
+                      package_name_format='{user_name} - {user_email}', access_token=None):
+    user_email = recipient['user_email']
+    user_name = recipient['user_name']
+    package_name = recipient.get('package_name') or package_name_format.format(**recipient)
+    document_name = recipient.get('document_name') or package_name
+    field_values = recipient.get('fields') or {}
+
+    package_id = api.add_package(access_token, package_name)
+    if not package_id:
+        raise ProvisioningError('add_package', api.last_error_message)
+
+    try:
+        document_id = api.upload_document_from_library(access_token, package_id, library_document_id)
+        if not document_id:
+            raise ProvisioningError('upload_document_from_library', api.last_error_message)
+
+        if not api.rename_document(access_token, package_id, document_id, document_name):
+            raise ProvisioningError('rename_document', api.last_error_message)
+
+        if template_name and not api.apply_workflow_template(access_token, package_id, document_id, template_name):
+            raise ProvisioningError('apply_workflow_template', api.last_error_message)
+
+        if field_values:
+            fields = api.get_field_layout(access_token, package_id, document_id, library_document_id, template_name)
+            if fields is None:
+                raise ProvisioningError('get_document_fields', api.last_error_message)
+            result = api.fill_fields(access_token, package_id, document_id, field_values, fields, strict=True)
+            if result.unknown_fields:
+                raise ProvisioningError('fill_fields', 'Unknown fields: ' + ', '.join(result.unknown_fields))
+            if result.errors:
+                raise ProvisioningError('fill_fields', '; '.join(name + ': ' + message
+                                                                 for name, message in result.errors.items()))
+
+        if not api.update_workflow_user(access_token, package_id, user_email, user_name):
+            raise ProvisioningError('update_workflow_user', api.last_error_message)
+
+        if not api.share_document(access_token, package_id):
+            raise ProvisioningError('share_document', api.last_error_message)
+
+    except Exception:
+        # Do not leave half-built packages behind, not even when the deadline has passed.
+        # A failing cleanup must not replace the original error, which is re-raised.
+        try:
+            with no_deadline():
+                api.delete_package(access_token, package_id)
+        except Exception:
+            pass
+        raise
+
+    return package_id, document_id
+
+
+# Provisions recipients on a pool of worker threads and yields a ProvisioningResult per recipient,
+# in order of completion.
+# recipients may be any iterable (including a generator): at most 2 * max_workers recipients are
+# read ahead, so memory use does not grow with the number of recipients.
+#
+# The api instance is shared by all workers. Pass access_token=None to use its cached access token,
+# which is refreshed automatically during long runs.
+# - deadline: Optional time budget in seconds for the provisioning chain of each recipient (see deadline.py)
+def iter_provision_packages(api, recipients, library_document_id, template_name,
+                            package_name_format='{user_name} - {user_email}', access_token=None,
+                            max_workers=DEFAULT_MAX_WORKERS, deadline=None):
+
+    def provision(index, recipient):
+        try:
+            with deadline_scope(deadline) if deadline is not None else contextlib.nullcontext():
+                package_id, document_id = provision_package(api, recipient, library_document_id, template_name,
+                                                            package_name_format, access_token)
+            return ProvisioningResult(index, recipient, package_id, document_id)
+        except ProvisioningError as e:
+            return ProvisioningResult(index, recipient, error=e.message or 'Unknown error', failed_step=e.step)
+        except SigningHubError as e:
+            return ProvisioningResult(index, recipient, error=e.message, failed_step=e.function_name.rpartition('.')[2])
+        except Exception as e:
+            return ProvisioningResult(index, recipient, error=str(e) or e.__class__.__name__)
+
+    provision = bind_deadline(provision)
+    max_pending = 2 * max_workers
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        pending = set()
+        for index, recipient in enumerate(recipients):
+            pending.add(executor.submit(provision, index, recipient))
+            if len(pending) >= max_pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+
+
+# Provisions recipients in parallel (see iter_provision_packages()).
+# Returns a list with one ProvisioningResult per recipient, in the same order as recipients.
+def provision_packages(api, recipients, library_document_id, template_name,
+                       package_name_format='{user_name} - {user_email}', access_token=None,
+                       max_workers=DEFAULT_MAX_WORKERS, deadline=None):
+    results = list(iter_provision_packages(api, recipients, library_document_id, template_name,
+                                           package_name_format, access_token, max_workers, deadline))
+    results.sort(key=lambda result: result.index)
+    return results
@@ -0,0 +1,87 @@
+"""
+Copyright 2016, SolidBuilds.com. All rights reserved.
+Author: Ling Thio, ling.thio@gmail.com
+"""
+
+
+# The outcome of one SigningHubAPI call.
+# - status_code:   HTTP status code of the last attempt, or None if no request was sent
+# - error_message: None on success
+# - elapsed:       Wall time of the call in seconds, including retries
+class CallResult(object):
+    __slots__ = ('function_name', 'status_code', 'error_message', 'elapsed')
+
+    def __init__(self, function_name, status_code=None, error_message=None, elapsed=0.0):
+        self.function_name = function_name
+        self.status_code = status_code
+        self.error_message = error_message
+        self.elapsed = elapsed
+
+    @property
+    def success(self):
+        return self.error_message is None
+
+    def __repr__(self):
+        return '<CallResult %s status_code=%s error_message=%r elapsed=%.3f>' % (
+            self.function_name, self.status_code, self.error_message, self.elapsed)
+
+
+# Raised by SigningHubAPI methods when the API returns an error and raise_errors is enabled.
+class SigningHubError(Exception):
+
+    def __init__(self, function_name, status_code, message, elapsed=0.0):
+        super(SigningHubError, self).__init__(
+            '%s() failed%s: %s' % (function_name, ' with status %s' % status_code if status_code else '', message))
+        self.function_name = function_name
+        self.status_code = status_code
+        self.message = message
+        self.elapsed = elapsed
+
+
+# 401 and 403 responses, and calls made without credentials or access token
+class AuthenticationError(SigningHubError):
+    pass
+
+
+# 404 responses
+class NotFoundError(SigningHubError):
+    pass
+
+
+# 429 responses that were still rejected after all retries
+class RateLimitError(SigningHubError):
+    pass
+
+
+# 5xx responses that still failed after all retries
+class ServerError(SigningHubError):
+    pass
+
+
+# Calls that were not sent because the circuit breaker of their endpoint group is open
+class CircuitOpenError(SigningHubError):
+    pass
+
+
+# Calls that were not sent (or not retried) because the deadline of the caller has passed
+class DeadlineExceededError(SigningHubError):
+    pass
+
+
+# Returns the SigningHubError subclass for an HTTP status code
+def error_class_for_status(status_code):
+    if status_code in (401, 403):
+        return AuthenticationError
+    if status_code == 404:
+        return NotFoundError
+    if status_code == 429:
+        return RateLimitError
+    if status_code and status_code >= 500:
+        return ServerError
+    return SigningHubError
+
+
+# Returns the SigningHubError for a failed CallResult, such as the last_result of an incomplete iter_packages()
+def error_for_result(result):
+    return error_class_for_status(result.status_code)(result.function_name, result.status_code,
+                                                      result.error_message, result.elapsed)
@@ -0,0 +1,144 @@
+"""
+Copyright 2016, SolidBuilds.com. All rights reserved.
+Author: Ling Thio, ling.thio@gmail.com
+"""
+
+import random
+import threading
+import time
+
+IDEMPOTENT_METHODS = ('GET', 'PUT', 'DELETE')
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+# Decides whether, and after how long, a failed API call is retried.
+# - max_attempts:    Total number of attempts, including the first one. 1 disables retries.
+# - backoff_base:    Delay before the first retry. The delay doubles on every retry (exponential backoff).
+# - backoff_max:     Upper bound of the backoff delay, and of the Retry-After delay.
+# - jitter:          If True, the delay is drawn uniformly from [0, backoff] ('full jitter'),
+#                    so that many clients that failed together do not retry together.
+# - retry_methods:   HTTP methods that are retried on transient errors (5xx, connection errors, timeouts).
+#                    POST is not idempotent and is not retried by default.
+# - retry_statuses:  HTTP status codes that count as transient errors.
+#
+# 429 Too Many Requests means the request was not processed, so it is retried for every method.
+# A Retry-After response header overrides the backoff delay.
+class RetryPolicy(object):
+
+    def __init__(self, max_attempts=3, backoff_base=0.5, backoff_max=30.0, jitter=True,
+                 retry_methods=IDEMPOTENT_METHODS, retry_statuses=RETRY_STATUSES):
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.jitter = jitter
+        self.retry_methods = tuple(retry_methods)
+        self.retry_statuses = tuple(retry_statuses)
+
+
+    # Returns the number of seconds to wait before the next attempt, or None if the call must not be retried.
+    # - attempt:     Number of attempts made so far (1 after the first attempt)
+    # - status_code: HTTP status code of the response, or None if no response was received
+    # - retry_after: Value of the Retry-After response header, if any
+    # - exception:   The connection error or timeout, if no response was received
+    def retry_delay(self, method, attempt, status_code=None, retry_after=None, exception=None):
+        if attempt >= self.max_attempts:
+            return None
+        if exception is not None:
+            if method not in self.retry_methods:
+                return None
+        elif status_code == 429:
+            pass
+        elif status_code not in self.retry_statuses or method not in self.retry_methods:
+            return None
+
+        delay = parse_retry_after(retry_after)
+        if delay is not None:
+            return min(delay, self.backoff_max)
+        return self.backoff(attempt)
+
+
+    # Returns the exponential backoff delay after attempt attempts
+    def backoff(self, attempt):
+        delay = min(self.backoff_max, self.backoff_base * (2 ** (attempt - 1)))
+        return random.uniform(0, delay) if self.jitter else delay
+
+
+# A RetryPolicy that never retries
+NO_RETRY = RetryPolicy(max_attempts=1)
+
+
+# Returns the number of seconds in a Retry-After header value (delay-seconds or HTTP-date), or None.
+def parse_retry_after(value, now=None):
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    import email.utils                  # Rarely needed: imported here to keep 'import signinghub_api' fast
+    parsed = email.utils.parsedate_tz(value)
+    if parsed is None:
+        return None
+    now = time.time() if now is None else now
+    return max(0.0, email.utils.mktime_tz(parsed) - now)
+
+
+# A thread-safe token bucket that keeps the request rate under a quota.
+# - rate:  Sustained number of requests per second
+# - burst: Number of requests that may be sent at once after an idle period (defaults to rate)
+#
+# One RateLimiter may be shared by several SigningHubAPI instances that use the same account.
+# SigningHubAPI pauses the bucket when the API responds with 429 Too Many Requests, so that the other
+# callers that share it back off too, instead of each running into the quota on their own.
+class RateLimiter(object):
+
+    def __init__(self, rate, burst=None, clock=time.monotonic):
+        self.rate = float(rate)
+        self.burst = float(burst if burst is not None else max(rate, 1))
+        self.clock = clock
+        self._tokens = self.burst
+        self._updated_at = clock()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+
+    # Takes one token from the bucket.
+    # Returns the number of seconds the caller must wait before sending its request (0 if it may send now).
+    # Callers that wait are served in order, because every reservation is taken immediately.
+    def reserve(self):
+        with self._lock:
+            now = self._refill()
+            self._tokens -= 1.0
+            pause = max(0.0, self._paused_until - now)
+            if self._tokens >= 0:
+                return pause
+            return max(pause, -self._tokens / self.rate)
+
+
+    # Returns the number of seconds until a token is available, without taking one
+    def delay(self):
+        with self._lock:
+            now = self._refill()
+            pause = max(0.0, self._paused_until - now)
+            if self._tokens >= 1.0:
+                return pause
+            return max(pause, (1.0 - self._tokens) / self.rate)
+
+
+    # Holds back all reservations for the next seconds seconds, such as after a 429 response
+    def pause(self, seconds):
+        with self._lock:
+            self._paused_until = max(self._paused_until, self.clock() + seconds)
+
+
+    # Takes one token, sleeping until it is available.
+    def acquire(self):
+        delay = self.reserve()
+        if delay > 0:
+            time.sleep(delay)
+
+
+    def _refill(self):
+        now = self.clock()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated_at) * self.rate)
+        self._updated_at = now
+        return now
@@ -4,41 +4,185 @@ Author: Ling Thio, ling.thio@gmail.com
 """
 
 from __future__ import print_function
-import requests
+import contextvars
 import json
+import time
+import weakref
+from urllib.parse import urlencode
+from .fields import FieldIndex, FieldFillResult, field_update_payload
+from .instrumentation import CallEvent
+from .deadline import deadline as deadline_scope, current_deadline, bind_deadline, clip_timeout
+from .results import CallResult, SigningHubError, AuthenticationError, CircuitOpenError, DeadlineExceededError, \
+    error_class_for_status
+from .retry import RetryPolicy, NO_RETRY
+from .token_manager import TokenManager, DEFAULT_REFRESH_MARGIN
+from .transfer import UploadStream, DownloadSink, STREAM_CHUNK_SIZE
+from .transport import RequestsTransport, default_transport, DEFAULT_POOL_CONNECTIONS, DEFAULT_POOL_MAXSIZE
 
 LOCAL_DEBUG = False                      # Print local debug info or not
 API_BASE_URL = 'api/rest/v5/'
 
-
-# The SigningHubAPI class offers access to the Adobe Sign REST API version 5
-class SigningHubAPI(object):
-
-    # Creates an instance of the SigningHubAPI class.
-    # - client_id:     See Adobe Sign > API > API Applications > YOURAPP > Configure OAuth for Application
-    # - client_secret: See Adobe Sign > API > API Applications > YOURAPP > Configure OAuth for Application
-    def __init__(self, client_id='', client_secret='', username='', password='', scope=''):
+DEFAULT_TIMEOUT = (5.0, 30.0)            # (connect timeout, read timeout) in seconds
+
+DEFAULT_FILL_WORKERS = 8                 # Number of fields that fill_fields() updates in parallel
+DEFAULT_PAGE_SIZE = 100                  # Number of packages per page for get_packages() and iter_packages()
+
+# The last call of the current thread or asyncio task, as (weak reference to the instance, CallResult).
+# One ContextVar is shared by all instances, and it only holds the latest result: a long-lived worker thread
+# that used many instances does not keep a result for every one of them, and recording a result costs O(1).
+_last_result = contextvars.ContextVar('signinghub_last_result', default=None)
+
+JSON_CONTENT = 'application/json'
+FORM_CONTENT = 'application/x-www-form-urlencoded'
+OCTET_CONTENT = 'application/octet-stream'
+
+NO_ACCESS_TOKEN = 'No access token'
+NO_CREDENTIALS = 'No client credentials'
+DEADLINE_EXCEEDED = 'Deadline exceeded'
+CIRCUIT_OPEN = 'Circuit breaker open for %s endpoints'
+
+
+# Describes one SigningHub API call: what to send, and how to turn a successful response into a return value.
+# A call with method=None is not sent at all and simply returns its default value,
+# failing with error if one is given (for example when no access token is available).
+# Calls with content_type OCTET_CONTENT send an UploadStream as payload. Calls with a sink (a DownloadSink)
+# stream a successful response body into the sink, and parse the number of bytes written.
+# send_elapsed is set to the seconds the last attempt spent on the wire, without rate limiting or retry backoff.
+class ApiCall(object):
+    __slots__ = ('function_name', 'method', 'url', 'access_token', 'content_type', 'payload', 'default', 'parse',
+                 'extra_headers', 'error', 'endpoint', 'sink', 'send_elapsed')
+
+    def __init__(self, function_name, method=None, url=None, access_token=None, content_type=None, payload=None,
+                 default=None, parse=None, extra_headers=None, error=None, endpoint=None, sink=None):
+        self.function_name = function_name
+        self.method = method
+        self.url = url
+        self.access_token = access_token
+        self.content_type = content_type
+        self.payload = payload
+        self.default = default
+        self.parse = parse
+        self.extra_headers = extra_headers
+        self.error = error
+        self.endpoint = endpoint            # URL template, such as 'packages/{package_id}/workflow'
+        self.sink = sink
+        self.send_elapsed = 0.0
+
+    # Returns the HTTP headers for this call
+    def headers(self):
+        headers = {'Accept': 'application/json'}
+        if self.content_type:
+            headers['Content-Type'] = self.content_type
+        if self.access_token:
+            headers['Authorization'] = 'Bearer ' + self.access_token
+        if self.extra_headers:
+            headers.update(self.extra_headers)
+        return headers
+
+
+# Decodes a JSON response body. Returns None if the body is empty or not JSON.
+def parse_body(text):
+    if not text:
+        return None
+    try:
+        return json.loads(text)
+    except ValueError:
+        return None
+
+
+# Encodes the JSON or form payload of call as a request body. Returns None if the call has no payload.
+def encode_body(call):
+    if call.payload is None:
+        return None
+    if call.content_type == FORM_CONTENT:
+        return urlencode(call.payload).encode('utf-8')
+    return json.dumps(call.payload).encode('utf-8')
+
+
+# Shared by SigningHubAPI and AsyncSigningHubAPI.
+# Builds ApiCall objects for every SigningHub API endpoint and interprets their responses,
+# so that the sync and async clients only differ in how they send requests.
+#
+# The outcome of the last call (last_result, last_function_name and last_error_message) is kept per thread
+# and per asyncio task, so one instance can be shared by all threads and tasks of a process.
+# With raise_errors=True, failed calls raise a SigningHubError instead.
+class SigningHubAPIBase(object):
+
+    def __init__(self, client_id='', client_secret='', username='', password='', scope='', timeout=DEFAULT_TIMEOUT,
+                 raise_errors=False):
         self.client_id = client_id
         self.client_secret = client_secret
         self.username = username
         self.password = password
         self.scope = scope
         self.base_url = 'https://api.signinghub.com/v3/'
-        self.last_function_name = None
-        self.last_error_message = None
-        pass
-
-
-    # Returns the access_token on success.
-    # Returns '' otherwise.
-    def get_access_token(self):
-        self.last_function_name = 'SigningHubAPI.get_access_token'
-        access_token = ''
-        if self.client_id and self.client_secret and self.username and self.password:
-            headers = {
-                'Content-Type': 'application/x-www-form-urlencoded',
-                'Accept': 'application/json',
+        self.auth_url = 'https://api.signinghub.com/authenticate'
+        self.timeout = timeout
+        self.raise_errors = raise_errors
+        self._ref = weakref.ref(self)       # Identifies this instance's results in _last_result
+
+        # Print a line to stdout for every call, and an optional Instrumentation object with hooks
+        # that are called before and after every call
+        self.verbose = True
+        self.instrumentation = None
+
+        # Retry policy for all calls, per-method retry policies ({'add_package': RetryPolicy(...)})
+        # and an optional, possibly shared, RateLimiter
+        self.retry_policy = RetryPolicy()
+        self.retry_policies = {}
+        self.rate_limiter = None
+
+        # Optional CircuitBreakers, with one CircuitBreaker per endpoint group
+        self.circuit_breakers = None
+
+        # Optional FieldLayoutCache, used by get_field_layout()
+        self.field_layout_cache = None
+
+        # Objects with package_added(), package_shared() and package_deleted() methods,
+        # such as an attached PackageCatalog
+        self.package_listeners = []
+
+
+    # The CallResult of the last call made by the current thread or asyncio task, or None if that call
+    # was made through another instance
+    @property
+    def last_result(self):
+        last = _last_result.get()
+        return last[1] if last is not None and last[0] is self._ref else None
+
+    @property
+    def last_function_name(self):
+        result = self.last_result
+        return result.function_name if result else None
+
+    @last_function_name.setter
+    def last_function_name(self, function_name):
+        self._set_last_result(CallResult(function_name))
+
+    @property
+    def last_error_message(self):
+        result = self.last_result
+        return result.error_message if result else None
+
+
+    def _set_last_result(self, result):
+        _last_result.set((self._ref, result))
+
+
+    # Calls /authenticate with the password grant, or with the refresh_token grant if refresh_token is given.
+    # Parses to the response data (access_token, expires_in, refresh_token).
+    def _build_authenticate(self, refresh_token=None):
+        function_name = 'SigningHubAPI.get_access_token'
+        if not (self.client_id and self.client_secret and (refresh_token or (self.username and self.password))):
+            return ApiCall(function_name, error=NO_CREDENTIALS)
+        if refresh_token:
+            payload = {
+                'grant_type': 'refresh_token',
+                'client_id': self.client_id,
+                'client_secret': self.client_secret,
+                'refresh_token': refresh_token,
             }
+        else:
             payload = {
                 'grant_type': 'password',
                 'client_id': self.client_id,
@@ -46,319 +190,817 @@ class SigningHubAPI(object):
                 'username': self.username,
                 'password': self.password,
             }
+        return ApiCall(function_name, 'POST', self.auth_url, None, FORM_CONTENT, payload,
+                       parse=lambda data: data,
+                       endpoint='authenticate')
+
+
+    def _build_add_package(self, access_token, package_name):
+        function_name = 'SigningHubAPI.add_package'
+        if not access_token:
+            return ApiCall(function_name, default=0, error=NO_ACCESS_TOKEN)
+        payload = {
+            'package_name': package_name,
+        }
+        url = self.base_url + 'packages'
+        return ApiCall(function_name, 'POST', url, access_token, JSON_CONTENT, payload, default=0,
+                       parse=lambda data: data.get('package_id'),
+                       endpoint='packages')
+
+
+    def _build_upload_document_from_library(self, access_token, package_id, library_document_id):
+        function_name = 'SigningHubAPI.upload_document_from_library'
+        if not access_token:
+            return ApiCall(function_name, default=0, error=NO_ACCESS_TOKEN)
+        url = self.base_url + 'packages/' + str(package_id) + '/documents/library/' + str(library_document_id)
+        return ApiCall(function_name, 'POST', url, access_token, JSON_CONTENT, default=0,
+                       parse=lambda data: data.get('document_id'),
+                       endpoint='packages/{package_id}/documents/library/{library_document_id}')
+
+
+    # Uploads a document from an UploadStream.
+    # - file_name:        Name of the document, including its extension
+    # - convert_document: Let SigningHub convert Word and other documents to PDF
+    # Parses to the new document_id.
+    def _build_upload_document(self, access_token, package_id, stream, file_name, convert_document=True):
+        function_name = 'SigningHubAPI.upload_document'
+        if not access_token:
+            return ApiCall(function_name, default=0, error=NO_ACCESS_TOKEN)
+        url = self.base_url + 'packages/' + str(package_id) + '/documents'
+        extra_headers = {
+            'x-file-name': file_name,
+            'x-convert-document': 'true' if convert_document else 'false',
+            'x-source': 'API',
+        }
+        return ApiCall(function_name, 'POST', url, access_token, OCTET_CONTENT, stream, default=0,
+                       parse=lambda data: data.get('document_id'), extra_headers=extra_headers,
+                       endpoint='packages/{package_id}/documents')
+
+
+    # Downloads a document into a DownloadSink.
+    # Parses to the number of bytes written.
+    def _build_download_document(self, access_token, package_id, document_id, sink):
+        function_name = 'SigningHubAPI.download_document'
+        if not access_token:
+            return ApiCall(function_name, error=NO_ACCESS_TOKEN)
+        url = self.base_url + 'packages/' + str(package_id) + '/documents/' + str(document_id)
+        return ApiCall(function_name, 'GET', url, access_token, parse=lambda written: written or 0,
+                       extra_headers={'Accept': OCTET_CONTENT}, sink=sink,
+                       endpoint='packages/{package_id}/documents/{document_id}')
+
+
+    def _build_rename_document(self, access_token, package_id, document_id, document_name):
+        function_name = 'SigningHubAPI.rename_document'
+        if not access_token:
+            return ApiCall(function_name, default=False, error=NO_ACCESS_TOKEN)
+        payload = {
+            'document_name': document_name,
+        }
+        url = self.base_url + 'packages/' + str(package_id) + '/documents/' + str(document_id)
+        return ApiCall(function_name, 'PUT', url, access_token, JSON_CONTENT, payload, default=False,
+                       parse=_success,
+                       endpoint='packages/{package_id}/documents/{document_id}')
+
+
+    # With apply_to_all, the template is also applied to the other documents of the package.
+    def _build_apply_workflow_template(self, access_token, package_id, document_id, template_name, apply_to_all=True):
+        function_name = 'SigningHubAPI.apply_workflow_template'
+        if not access_token:
+            return ApiCall(function_name, default=False, error=NO_ACCESS_TOKEN)
+        payload = {
+            'template_name': template_name,
+            'apply_to_all': apply_to_all,
+        }
+        url = self.base_url + 'packages/' + str(package_id) + '/documents/' + str(document_id) + '/template'
+        return ApiCall(function_name, 'POST', url, access_token, JSON_CONTENT, payload, default=False,
+                       parse=_success,
+                       endpoint='packages/{package_id}/documents/{document_id}/template')
+
+
+    def _build_delete_package(self, access_token, package_id):
+        function_name = 'SigningHubAPI.delete_package'
+        if not access_token:
+            return ApiCall(function_name, default=False, error=NO_ACCESS_TOKEN)
+        url = self.base_url + 'packages/' + str(package_id)
+        return ApiCall(function_name, 'DELETE', url, access_token, JSON_CONTENT, default=False,
+                       parse=_success,
+                       endpoint='packages/{package_id}')
+
+
+    # Get one page of packages.
+    # - status:      Package status filter, such as 'ALL', 'DRAFT', 'INPROGRESS' or 'COMPLETED'
+    # - search_text: Only list packages that match this text (optional)
+    # Parses to a list of package information records.
+    def _build_get_packages(self, access_token, folder='INBOX', page_no=1, page_size=DEFAULT_PAGE_SIZE,
+                            search_text=None, status='ALL'):
+        function_name = 'SigningHubAPI.get_packages'
+        if not access_token:
+            return ApiCall(function_name, error=NO_ACCESS_TOKEN)
+        url = self.base_url + 'packages/' + str(status) + '/' + str(page_no) + '/' + str(page_size)
+        extra_headers = {
+            'x-folder': folder,
+        }
+        if search_text:
+            extra_headers['x-search-text'] = search_text
+        return ApiCall(function_name, 'GET', url, access_token, parse=lambda data: data or [],
+                       extra_headers=extra_headers, endpoint='packages/{status}/{page_no}/{page_size}')
+
+
+    # Updates the workflow user at position order (1 for the first recipient of the workflow template).
+    def _build_update_workflow_user(self, access_token, package_id, user_email, user_name, order=1, role='SIGNER',
+                                    email_notification=True):
+        function_name = 'SigningHubAPI.update_workflow_user'
+        if not access_token:
+            return ApiCall(function_name, default=False, error=NO_ACCESS_TOKEN)
+        payload = {
+            'user_email': user_email,
+            'user_name': user_name,
+            'role': role,
+            'email_notification': email_notification,
+        }
+        url = self.base_url + 'packages/' + str(package_id) + '/workflow/' + str(order) + '/user'
+        return ApiCall(function_name, 'PUT', url, access_token, JSON_CONTENT, payload, default=False,
+                       parse=_success,
+                       endpoint='packages/{package_id}/workflow/{order}/user')
+
+
+    def _build_get_document_fields(self, access_token, package_id, document_id):
+        function_name = 'SigningHubAPI.get_document_fields'
+        if not access_token:
+            return ApiCall(function_name, error=NO_ACCESS_TOKEN)
+        url = self.base_url + 'packages/' + str(package_id) + '/documents/' + str(document_id) + '/fields'
+        return ApiCall(function_name, 'GET', url, access_token, parse=lambda data: data,
+                       endpoint='packages/{package_id}/documents/{document_id}/fields')
+
+
+    def _build_update_textbox_field(self, access_token, package_id, document_id, fields, field_name, field_value):
+        function_name = 'SigningHubAPI.update_textbox_field'
+        if not access_token:
+            return ApiCall(function_name, default=False, error=NO_ACCESS_TOKEN)
 
-            # Call the SigningHub API
-            url = 'https://api.signinghub.com/authenticate'
-            response = requests.post(url, headers=headers, data=payload)
+        # Find field by name
+        old_field = None
+        for field in fields['text']:
+            if field['field_name']==field_name:
+                old_field = field
+        if not old_field:
+            return ApiCall(function_name, default=False, error='Unknown field: ' + str(field_name))
+
+        # Use old field settings with new value
+        return self._build_update_field(access_token, package_id, document_id, 'text', old_field, field_value,
+                                        function_name)
+
+
+    # Updates the value of one field of any type ('text', 'checkbox', 'radio', 'date', ...),
+    # re-using the current settings of field.
+    def _build_update_field(self, access_token, package_id, document_id, field_type, field, field_value,
+                            function_name='SigningHubAPI.update_field'):
+        if not access_token:
+            return ApiCall(function_name, default=False, error=NO_ACCESS_TOKEN)
+        payload = field_update_payload(field_type, field, field_value)
+        url = self.base_url + 'packages/' + str(package_id) + '/documents/' + str(document_id) + '/fields/' + field_type
+        return ApiCall(function_name, 'PUT', url, access_token, JSON_CONTENT, payload, default=False,
+                       parse=_success,
+                       endpoint='packages/{package_id}/documents/{document_id}/fields/{field_type}')
+
+
+    # Prepares fill_fields(): looks up every field name once in the field index.
+    # Returns a FieldFillResult (with unknown_fields filled in) and a list of (field_name, ApiCall) to send.
+    def _build_fill_fields(self, access_token, package_id, document_id, field_index, field_values, strict):
+        result = FieldFillResult(field_index.unknown(field_values))
+        if strict and result.unknown_fields:
+            return result, []
+        calls = []
+        for field_name, field_value in field_values.items():
+            found = field_index.get(field_name)
+            if found:
+                field_type, field = found
+                calls.append((field_name, self._build_update_field(access_token, package_id, document_id,
+                                                                   field_type, field, field_value,
+                                                                   'SigningHubAPI.fill_fields')))
+        return result, calls
+
+
+    def _build_share_document(self, access_token, package_id):
+        function_name = 'SigningHubAPI.share_document'
+        if not access_token:
+            return ApiCall(function_name, default=False, error=NO_ACCESS_TOKEN)
+        url = self.base_url + 'packages/' + str(package_id) + '/workflow'
+        return ApiCall(function_name, 'POST', url, access_token, JSON_CONTENT, default=False,
+                       parse=_success,
+                       endpoint='packages/{package_id}/workflow')
+
+
+    # Find a package by package name.
+    # packages may be a list of package information records or a PackageCatalog (for O(1) lookups).
+    # Returns the package ID on success.
+    # Returns None otherwise.
+    def find_package_by_name(self, packages, package_name):
+        self.last_function_name = 'SigningHubAPI.find_package_by_name'
+        package_id = None
+        if hasattr(packages, 'find_by_name'):
+            package_id = packages.find_by_name(package_name)
+        elif packages:
+            for package in packages:
+                if package['package_name'] == package_name:
+                    package_id = package['package_id']
 
-            # Process the response
-            if response.status_code in (200, 201):
-                data = response.json()
-                access_token = data.get('access_token')
-                self._print_success()
-            else:
-                self._print_response_error('POST', url, headers, payload, response)
+        return package_id
 
-        return access_token
 
+    def _notify_package_added(self, package_id, package_name):
+        for listener in self.package_listeners:
+            listener.package_added(package_id, package_name)
+
+    def _notify_package_shared(self, package_id):
+        for listener in self.package_listeners:
+            listener.package_shared(package_id)
+
+    def _notify_package_deleted(self, package_id):
+        for listener in self.package_listeners:
+            listener.package_deleted(package_id)
+
+
+    # Sets a time budget, in seconds, for all calls made inside the with block (see signinghub_api.deadline)
+    #
+    #     with signinghub_api.deadline(10):
+    #         ...
+    def deadline(self, seconds):
+        return deadline_scope(seconds)
+
+
+    # Decides whether call may be sent.
+    # Returns (deadline, circuit breaker or None, None), or (None, None, (error class, message)) to fail fast.
+    def _admit(self, call):
+        deadline_at = current_deadline()
+        if deadline_at is not None and time.monotonic() >= deadline_at:
+            return None, None, (DeadlineExceededError, DEADLINE_EXCEEDED)
+        if self.circuit_breakers is None:
+            return deadline_at, None, None
+        group, breaker = self.circuit_breakers.get(call.endpoint)
+        if not breaker.allow():
+            return None, None, (CircuitOpenError, CIRCUIT_OPEN % group)
+        return deadline_at, breaker, None
+
+
+    # Returns True if call was rejected with 401 while using an access token from the token manager, which may
+    # have been revoked or expired early. The token is forgotten if it is still cached, so that the call can be
+    # sent once more with the token that get_token() returns next. Concurrent calls that were rejected with the
+    # same token all get that one new token, because get_token() single-flights the refresh.
+    def _token_rejected(self, call, status_code):
+        if status_code != 401 or not call.access_token or not self.token_manager.issued(call.access_token):
+            return False
+        self.token_manager.invalidate(call.access_token)
+        return True
+
+
+    # Records the outcome of a call in its circuit breaker. healthy is False for a connection error or timeout,
+    # and None to use the status code of the last response: 5xx responses are failures.
+    # Calls that ended without a response for another reason, such as a passed deadline, say nothing about
+    # the endpoint: they only release their probe slot. Slow calls are timed by the last attempt on the wire.
+    def _record_outcome(self, breaker, healthy, call):
+        if healthy is None and self.last_result is not None and self.last_result.status_code is not None:
+            healthy = self.last_result.status_code < 500
+        if healthy is None:
+            breaker.release()
+        else:
+            breaker.record(healthy, call.send_elapsed)
+
+
+    # Takes a slot from the rate limiter, if there is one. Returns the seconds to wait for the slot,
+    # or None if the slot would only be free after deadline_at: no slot is taken then.
+    def _reserve_slot(self, deadline_at):
+        if self.rate_limiter is None:
+            return 0.0
+        if deadline_at is not None and time.monotonic() + self.rate_limiter.delay() >= deadline_at:
+            return None
+        return self.rate_limiter.reserve()
+
+
+    # Returns delay, or None if retrying after delay seconds would end after the deadline
+    def _retry_within_deadline(self, delay, deadline_at):
+        if delay is not None and deadline_at is not None and time.monotonic() + delay >= deadline_at:
+            return None
+        return delay
+
+
+    # Returns False for uploads from an iterator, which cannot be sent twice
+    def _can_resend(self, call):
+        return call.content_type != OCTET_CONTENT or call.payload.rewindable
+
+
+    # Returns the RetryPolicy for call: a per-method policy if one is configured, the default policy otherwise.
+    # Uploads from an iterator cannot be sent twice, and are never retried.
+    def _retry_policy_for(self, call):
+        if not self._can_resend(call):
+            return NO_RETRY
+        if self.retry_policies:
+            policy = self.retry_policies.get(call.function_name.rpartition('.')[2])
+            if policy is not None:
+                return policy
+        return self.retry_policy
+
+
+    # Returns the return value of call, given the HTTP status code and the decoded response body.
+    # Raises a SigningHubError on failure if raise_errors is enabled.
+    def _process_response(self, call, headers, status_code, data, elapsed=0.0):
+        result = CallResult(call.function_name, status_code, elapsed=elapsed)
+        self._set_last_result(result)
+        if status_code in (200, 201):
+            # An empty list or object is a valid result. Only a missing or non-JSON body is parsed as {}.
+            value = call.parse({} if data is None else data) if call.parse else call.default
+            self._print_success(result)
+            return value
+
+        result.error_message = data.get('Message', 'Unknown error') if isinstance(data, dict) else 'Unknown error'
+        self._print_response_error(result, call.method, call.url, headers, call.payload)
+        if self.raise_errors:
+            raise error_class_for_status(status_code)(call.function_name, status_code, result.error_message, elapsed)
+        return call.default
+
+
+    # Returns the default value of a call that is not sent because of a passed deadline or an open circuit breaker.
+    # Raises error_class if raise_errors is enabled.
+    def _fail_fast(self, call, error_class, message):
+        self._set_last_result(CallResult(call.function_name, error_message=message))
+        if self.raise_errors:
+            raise error_class(call.function_name, None, message)
+        return call.default
+
+
+    # Returns the default value of a call that is not sent.
+    # Raises a SigningHubError if the call has an error and raise_errors is enabled.
+    def _process_unsent(self, call):
+        self._set_last_result(CallResult(call.function_name, error_message=call.error))
+        if call.error and self.raise_errors:
+            error_class = AuthenticationError if call.error in (NO_ACCESS_TOKEN, NO_CREDENTIALS) else SigningHubError
+            raise error_class(call.function_name, None, call.error)
+        return call.default
+
+
+    # Passes a CallEvent to the instrumentation hooks
+    def _emit(self, call, status_code, elapsed, bytes_sent, bytes_received, attempts, exception=None):
+        self.instrumentation.after_call(CallEvent(
+            call.function_name, call.method, call.endpoint, status_code, elapsed, bytes_sent, bytes_received,
+            attempts - 1, exception.__class__.__name__ if exception is not None else None))
+
+
+    def _print_success(self, result):
+        if not self.verbose:
+            return
+        print(result.function_name+'() completed successfully.')
+
+
+    def _print_response_error(self, result, method, url, headers, payload):
+        if not self.verbose:
+            return
+        print('ERROR: '+result.function_name+'() failed.')
+        print('error_message:', result.error_message)
 
-    def add_package(self, access_token, package_name):
-        self.last_function_name = 'SigningHubAPI.add_package'
-        package_id = 0
-        if access_token:
-            headers = {
-                'Content-Type': 'application/json',
-                'Accept': 'application/json',
-                'Authorization': 'Bearer ' + access_token,
-            }
-            payload = {
-                'package_name': package_name,
-            }
-            url = self.base_url + 'packages'
-            response = requests.post(url, headers=headers, json=payload)
-
-            # Process the response
-            if response.status_code in (200, 201):
-                json_data = response.json()
-                package_id = json_data.get('package_id')
-                self._print_success()
-            else:
-                self._print_response_error('GET', url, headers, payload, response)
+        if LOCAL_DEBUG:
+            print(method, url)
+            print('headers:', json.dumps(headers, indent=4))
+            if isinstance(payload, dict):
+                print('payload:', json.dumps(payload, indent=4))
+            print('status_code:', result.status_code)
 
-        return package_id
 
+def _success(data):
+    return True
 
-    def upload_document_from_library(self, access_token, package_id, library_document_id):
-        self.last_function_name = 'SigningHubAPI.upload_document_from_library'
-        document_id = 0
-        if access_token:
-            headers = {
-                'Content-Type': 'application/json',
-                'Accept': 'application/json',
-                'Authorization': 'Bearer ' + access_token,
-            }
-            url = self.base_url + 'packages/' + str(package_id) + '/documents/library/' + str(library_document_id)
-            response = requests.post(url, headers=headers)
-
-            # Process the response
-            if response.status_code in (200, 201):
-                json_data = response.json()
-                document_id = json_data.get('document_id')
-                self._print_success()
-            else:
-                self._print_response_error('POST', url, headers, None, response)
 
-        return document_id
+# Returns a FieldFillResult in which every field failed with error_message
+def _failed_fill(field_values, error_message):
+    return _collect_fill(FieldFillResult(), [(field_name, False, error_message) for field_name in field_values])
 
 
-    def rename_document(self, access_token, package_id, document_id, document_name):
-        self.last_function_name = 'SigningHubAPI.rename_document'
-        success = False
-        if access_token:
-            headers = {
-                'Content-Type': 'application/json',
-                'Accept': 'application/json',
-                'Authorization': 'Bearer ' + access_token,
-            }
-            payload = {
-                'document_name': document_name,
-            }
-            url = self.base_url + 'packages/' + str(package_id) + '/documents/' + str(document_id)
-            response = requests.put(url, headers=headers, json=payload)
+# Adds (field_name, success, error_message) outcomes to result
+def _collect_fill(result, outcomes):
+    for field_name, success, error_message in outcomes:
+        result.results[field_name] = success
+        if not success:
+            result.errors[field_name] = error_message or 'Unknown error'
+    return result
+
 
-            # Process the response
-            if response.status_code in (200, 201):
-                success = True
-                self._print_success()
+# The SigningHubAPI class offers access to the SigningHub REST API version 3
+class SigningHubAPI(SigningHubAPIBase):
+
+    # Creates an instance of the SigningHubAPI class.
+    # - client_id:     See SigningHub > Enterprise Actions > API Key > Application Name
+    # - client_secret: See SigningHub > Enterprise Actions > API Key > API Key
+    # - session:       Optional requests.Session to use. All calls share one pooled keep-alive session.
+    # - transport:     Optional transport that sends the requests (see transport.py), such as an
+    #                  HTTPClientTransport, which only uses the standard library. Defaults to a RequestsTransport.
+    # - pool_maxsize:  Max number of keep-alive connections per host (ignored if session or transport is given)
+    # - timeout:       (connect, read) timeout in seconds, or a single number for both
+    # - refresh_margin: Refresh the cached access token this many seconds before it expires
+    # - field_layout_cache: Optional FieldLayoutCache for get_field_layout()
+    # - retry_policy:  RetryPolicy for all calls. Idempotent calls are retried with jittered exponential backoff.
+    # - retry_policies: Optional dict of per-method RetryPolicy objects, such as {'add_package': RetryPolicy(...)}
+    # - rate_limiter:  Optional RateLimiter, which may be shared with other instances that use the same account
+    # - raise_errors:  If True, failed calls raise a SigningHubError (carrying the status code, error message and
+    #                  elapsed time) instead of returning a default value.
+    # - verbose:       If False, calls do not print to stdout.
+    # - instrumentation: Optional Instrumentation object, such as a HistogramCollector
+    # - circuit_breakers: Optional CircuitBreakers. Calls to an endpoint group whose breaker is open fail fast
+    #                  with CircuitOpenError.
+    #
+    # All methods that take an access_token argument use the cached access token when access_token is None.
+    def __init__(self, client_id='', client_secret='', username='', password='', scope='',
+                 session=None, pool_connections=DEFAULT_POOL_CONNECTIONS, pool_maxsize=DEFAULT_POOL_MAXSIZE,
+                 timeout=DEFAULT_TIMEOUT, refresh_margin=DEFAULT_REFRESH_MARGIN, field_layout_cache=None,
+                 retry_policy=None, retry_policies=None, rate_limiter=None, raise_errors=False, verbose=True,
+                 instrumentation=None, circuit_breakers=None, transport=None):
+        super(SigningHubAPI, self).__init__(client_id, client_secret, username, password, scope, timeout,
+                                            raise_errors)
+        self.verbose = verbose
+        self.instrumentation = instrumentation
+        self.circuit_breakers = circuit_breakers
+        self.field_layout_cache = field_layout_cache
+        if retry_policy is not None:
+            self.retry_policy = retry_policy
+        self.retry_policies = dict(retry_policies or {})
+        self.rate_limiter = rate_limiter
+
+        # Only close transports that we created ourselves
+        self._owns_transport = transport is None
+        if transport is None:
+            if session is not None:
+                transport = RequestsTransport(session)
             else:
-                self._print_response_error('PUT', url, headers, payload, response)
+                transport = default_transport(pool_connections, pool_maxsize)
+        self.transport = transport
+        self.token_manager = TokenManager(self._authenticate, refresh_margin=refresh_margin)
 
-        return success
 
+    # Releases the pooled connections (only if the transport was created by this instance)
+    def close(self):
+        if self._owns_transport:
+            self.transport.close()
 
-    def apply_workflow_template(self, access_token, package_id, document_id, template_name):
-        self.last_function_name = 'SigningHubAPI.apply_workflow_template'
-        success = False
-        if access_token:
-            headers = {
-                'Content-Type': 'application/json',
-                'Accept': 'application/json',
-                'Authorization': 'Bearer ' + access_token,
-            }
-            payload = {
-                'template_name': template_name,
-                'apply_to_all': True,
-            }
-            url = self.base_url + 'packages/' + str(package_id) + '/documents/' + str(document_id) + '/template'
-            response = requests.post(url, headers=headers, json=payload)
 
-            # Process the response
-            if response.status_code in (200, 201):
-                success = True
-                self._print_success()
-            else:
-                self._print_response_error('POST', url, headers, payload, response)
+    # The requests.Session of a RequestsTransport, or None
+    @property
+    def session(self):
+        return getattr(self.transport, 'session', None)
 
-        return success
+    def __enter__(self):
+        return self
 
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
 
-    def delete_package(self, access_token, package_id):
-        self.last_function_name = 'SigningHubAPI.delete_package'
-        if access_token:
-            headers = {
-                'Content-Type': 'application/json',
-                'Accept': 'application/json',
-                'Authorization': 'Bearer ' + access_token,
-            }
-            url = self.base_url + 'packages/'+str(package_id)
-            response = requests.delete(url, headers=headers)
 
-            # Process the response
-            if response.status_code in (200, 201):
-                self._print_success()
-            else:
-                self._print_response_error('DELETE', url, headers, None, response)
+    # Returns a cached access_token on success, authenticating only when the cached token
+    # is missing or about to expire. Use force=True to always obtain a new token.
+    # Returns '' otherwise.
+    def get_access_token(self, force=False):
+        self.last_function_name = 'SigningHubAPI.get_access_token'
+        return self.token_manager.get_token(force=force)
+
+
+    # Starts a daemon thread that refreshes the cached access token before it expires.
+    def start_token_refresh(self):
+        self.token_manager.start_background_refresh()
 
 
-    # Get a list of library documents.
-    # Returns a list of library document information records on success.
+    def stop_token_refresh(self):
+        self.token_manager.stop_background_refresh()
+
+
+    # Returns the /authenticate response data on success.
     # Returns None otherwise.
-    def get_packages(self, access_token, folder='INBOX'):
-        self.last_function_name = 'SigningHubAPI.get_packages'
-        packages = None
-
-        # Retrieve a list of library documents
-        if access_token:
-            headers = {
-                'Authorization': 'Bearer '+access_token,
-                'Accept': 'application/json',
-                'x-folder': folder,
-                # 'x-search-text': '',
-            }
+    def _authenticate(self, refresh_token=None):
+        return self._execute(self._build_authenticate(refresh_token))
 
-            # Call the API
-            url = self.base_url + 'packages/ALL/1/100'
-            response = requests.get(url, headers=headers)
 
-            # Process the response
-            if response.status_code in (200, 201):
-                response_body = response.json()
-                packages = response_body
-                self._print_success()
-            else:
-                self._print_response_error('GET', url, headers, None, response)
+    # Returns access_token, or the cached access token if access_token is None.
+    def _resolve_token(self, access_token):
+        if access_token is None:
+            access_token = self.token_manager.get_token()
+        return access_token
+
 
-        return packages
+    # Returns the package_id on success.
+    # Returns 0 otherwise.
+    def add_package(self, access_token, package_name):
+        access_token = self._resolve_token(access_token)
+        package_id = self._execute(self._build_add_package(access_token, package_name))
+        if package_id:
+            self._notify_package_added(package_id, package_name)
+        return package_id
 
 
-    # Find a library document by document name.
-    # Returns the library document ID on success.
+    # Returns the document_id on success.
+    # Returns 0 otherwise.
+    def upload_document_from_library(self, access_token, package_id, library_document_id):
+        access_token = self._resolve_token(access_token)
+        return self._execute(self._build_upload_document_from_library(access_token, package_id, library_document_id))
+
+
+    # Uploads a document, streaming it in chunks so that memory use does not grow with the document size.
+    # - source:    A file path, a binary file object, bytes, or an iterator of bytes chunks.
+    #              Files given by path are memory-mapped.
+    # - file_name: Name of the document. Defaults to the name of the file.
+    # - progress:  Optional callable(bytes_sent, total_bytes). total_bytes is None for iterators.
+    # Returns the document_id on success.
+    # Returns 0 otherwise.
+    def upload_document(self, access_token, package_id, source, file_name=None, convert_document=True,
+                        progress=None, chunk_size=STREAM_CHUNK_SIZE):
+        access_token = self._resolve_token(access_token)
+        stream = UploadStream(source, progress, chunk_size)
+        try:
+            return self._execute(self._build_upload_document(access_token, package_id, stream,
+                                                             file_name or stream.name or 'document.pdf',
+                                                             convert_document))
+        finally:
+            stream.close()
+
+
+    # Downloads a document, writing it to dest chunk by chunk.
+    # - dest:     A file path or a binary file object. A path is only created once the download is complete.
+    # - progress: Optional callable(bytes_received, total_bytes). total_bytes is None if the size is unknown.
+    # Returns the number of bytes written on success.
     # Returns None otherwise.
-    def find_package_by_name(self, packages, package_name):
-        self.last_function_name = 'SigningHubAPI.find_package_by_name'
-        package_id = None
-        if packages:
-            for package in packages:
-                if package['package_name'] == package_name:
-                    package_id = package['package_id']
+    def download_document(self, access_token, package_id, document_id, dest, progress=None,
+                          chunk_size=STREAM_CHUNK_SIZE):
+        access_token = self._resolve_token(access_token)
+        sink = DownloadSink(dest, progress, chunk_size)
+        return self._execute(self._build_download_document(access_token, package_id, document_id, sink))
 
-        return package_id
 
+    def rename_document(self, access_token, package_id, document_id, document_name):
+        access_token = self._resolve_token(access_token)
+        return self._execute(self._build_rename_document(access_token, package_id, document_id, document_name))
 
-    def update_workflow_user(self, access_token, package_id, user_email, user_name):
-        self.last_function_name = 'SigningHubAPI.update_workflow_user'
-        success = False
-        if access_token:
-            headers = {
-                'Content-Type': 'application/json',
-                'Accept': 'application/json',
-                'Authorization': 'Bearer ' + access_token,
-            }
-            payload = {
-                'user_email': user_email,
-                'user_name': user_name,
-                'role': 'SIGNER',
-                'email_notification': True,
-            }
-            url = self.base_url + 'packages/' + str(package_id) + '/workflow/1/user'
-            response = requests.put(url, headers=headers, json=payload)
 
-            # Process the response
-            if response.status_code in (200, 201):
-                success = True
-                self._print_success()
-            else:
-                self._print_response_error('PUT', url, headers, payload, response)
+    def apply_workflow_template(self, access_token, package_id, document_id, template_name, apply_to_all=True):
+        access_token = self._resolve_token(access_token)
+        return self._execute(self._build_apply_workflow_template(access_token, package_id, document_id, template_name,
+                                                                 apply_to_all))
 
-        return success
 
+    # Returns True on success.
+    # Returns False otherwise.
+    def delete_package(self, access_token, package_id):
+        access_token = self._resolve_token(access_token)
+        success = self._execute(self._build_delete_package(access_token, package_id))
+        if success:
+            self._notify_package_deleted(package_id)
+        return success
 
-    def get_document_fields(self, access_token, package_id, document_id):
-        self.last_function_name = 'SigningHubAPI.get_document_fields'
-        fields = None
-
-        # Retrieve a list of documents fields
-        if access_token:
-            headers = {
-                'Authorization': 'Bearer '+access_token,
-                'Accept': 'application/json',
-            }
 
-            # Call the API
-            url = self.base_url + 'packages/' + str(package_id) + '/documents/' + str(document_id) + '/fields'
-            response = requests.get(url, headers=headers)
+    # Get one page of packages.
+    # Returns a list of package information records on success.
+    # Returns None otherwise.
+    def get_packages(self, access_token, folder='INBOX', page_no=1, page_size=DEFAULT_PAGE_SIZE,
+                     search_text=None, status='ALL'):
+        access_token = self._resolve_token(access_token)
+        return self._execute(self._build_get_packages(access_token, folder, page_no, page_size, search_text, status))
+
+
+    # Yields all packages, page after page.
+    # The next page is fetched in a background thread while the caller processes the current page,
+    # and only one page is held in memory at a time.
+    # Stops at the first page that is shorter than page_size, or when a page could not be retrieved
+    # (last_error_message is set in that case).
+    def iter_packages(self, access_token=None, folder='INBOX', page_size=DEFAULT_PAGE_SIZE,
+                      search_text=None, status='ALL'):
+        from concurrent.futures import ThreadPoolExecutor    # Imported on first use, for fast imports
+        executor = ThreadPoolExecutor(max_workers=1)
+        try:
+            page_no = 1
+            get_page = bind_deadline(self._get_packages_page)
+            future = executor.submit(get_page, access_token, folder, page_no, page_size, search_text, status)
+            while future is not None:
+                packages, result = future.result()
+                self._set_last_result(result)
+                future = None
+                if packages and len(packages) >= page_size:
+                    page_no += 1
+                    future = executor.submit(get_page, access_token, folder, page_no, page_size, search_text, status)
+                for package in packages or ():
+                    yield package
+        finally:
+            executor.shutdown(wait=False)
+
+
+    # Runs get_packages() in a prefetch thread and returns (packages, CallResult),
+    # so that the outcome can be handed over to the thread that consumes the page.
+    def _get_packages_page(self, *args):
+        packages = self.get_packages(*args)
+        return packages, self.last_result
+
+
+    def update_workflow_user(self, access_token, package_id, user_email, user_name, order=1, role='SIGNER',
+                             email_notification=True):
+        access_token = self._resolve_token(access_token)
+        return self._execute(self._build_update_workflow_user(access_token, package_id, user_email, user_name,
+                                                              order, role, email_notification))
 
-            # Process the response
-            if response.status_code in (200, 201):
-                response_body = response.json()
-                fields = response_body
-                self._print_success()
-            else:
-                self._print_response_error('GET', url, headers, None, response)
 
-        return fields
+    def get_document_fields(self, access_token, package_id, document_id):
+        access_token = self._resolve_token(access_token)
+        return self._execute(self._build_get_document_fields(access_token, package_id, document_id))
 
 
     def update_textbox_field(self, access_token, package_id, document_id, fields, field_name, field_value):
-        self.last_function_name = 'SigningHubAPI.update_textbox_field'
-        success = False
+        access_token = self._resolve_token(access_token)
+        return self._execute(self._build_update_textbox_field(access_token, package_id, document_id,
+                                                              fields, field_name, field_value))
+
+
+    # Returns the field layout (a FieldIndex) of a document created from library_document_id with
+    # workflow template template_name. With a field_layout_cache, get_document_fields() is only called
+    # for the first document of every (library_document_id, template_name) combination.
+    # Returns None if the fields could not be retrieved.
+    def get_field_layout(self, access_token, package_id, document_id, library_document_id, template_name):
+        cache = self.field_layout_cache
+        if cache is not None:
+            field_index = cache.get(library_document_id, template_name)
+            if field_index is not None:
+                return field_index
+        fields = self.get_document_fields(access_token, package_id, document_id)
+        if fields is None:
+            return None
+        if cache is not None:
+            cache.put(library_document_id, template_name, fields)
+        return FieldIndex(fields)
+
+
+    # Updates many document fields of any type in one pass.
+    # - field_values: dict of field names and new values
+    # - fields:       get_document_fields() response or FieldIndex. Retrieved if not given.
+    # - strict:       If True, nothing is updated when some field names are unknown.
+    # Every field name is looked up once and the updates are sent in parallel on max_workers threads.
+    # Returns a FieldFillResult with the unknown field names and the per-field outcomes.
+    def fill_fields(self, access_token, package_id, document_id, field_values, fields=None,
+                    max_workers=DEFAULT_FILL_WORKERS, strict=False):
+        access_token = self._resolve_token(access_token)
+        if fields is None:
+            fields = self.get_document_fields(access_token, package_id, document_id)
+            if fields is None:
+                return _failed_fill(field_values, self.last_error_message)
+        field_index = fields if isinstance(fields, FieldIndex) else FieldIndex(fields)
+        result, calls = self._build_fill_fields(access_token, package_id, document_id, field_index, field_values,
+                                                strict)
+
+        def update(field_name_and_call):
+            field_name, call = field_name_and_call
+            try:
+                success = self._execute(call)
+            except SigningHubError as e:
+                return field_name, False, e.message
+            return field_name, success, None if success else self.last_error_message
+
+        if len(calls) > 1 and max_workers > 1:
+            from concurrent.futures import ThreadPoolExecutor
+            with ThreadPoolExecutor(max_workers=min(max_workers, len(calls))) as executor:
+                outcomes = list(executor.map(bind_deadline(update), calls))
+        else:
+            outcomes = [update(field_name_and_call) for field_name_and_call in calls]
+        return _collect_fill(result, outcomes)
 
-        # Find field by name
-        if access_token:
-            old_field = None
-            for field in fields['text']:
-                if field['field_name']==field_name:
-                    old_field = field
-
-            # Use old field settings with new value
-            if old_field:
-                headers = {
-                    'Content-Type': 'application/json',
-                    'Accept': 'application/json',
-                    'Authorization': 'Bearer ' + access_token,
-                }
-                payload = {
-                    # Old field settings
-                    'field_name': field_name,
-                    'page_no': old_field['page_no'],
-                    'placeholder': old_field['placeholder'],
-                    'max_length': old_field['max_length'],
-                    'field_type': old_field['type'],
-                    'validation_rule': old_field['validation_rule'],
-                    'font': old_field['font'],
-                    'dimensions': old_field['dimensions']['field'],
-                    # New field value
-                    'value': field_value,
-                }
-                url = self.base_url + 'packages/' + str(package_id) + '/documents/' + str(document_id) + '/fields/text'
-                response = requests.put(url, headers=headers, json=payload)
-
-                # Process the response
-                if response.status_code in (200, 201):
-                    success = True
-                    self._print_success()
-                else:
-                    self._print_response_error('PUT', url, headers, payload, response)
 
+    def share_document(self, access_token, package_id):
+        access_token = self._resolve_token(access_token)
+        success = self._execute(self._build_share_document(access_token, package_id))
+        if success:
+            self._notify_package_shared(package_id)
         return success
 
 
-    def share_document(self, access_token, package_id):
-        self.last_function_name = 'SigningHubAPI.share_document'
-        success = False
-        if access_token:
-            headers = {
-                'Content-Type': 'application/json',
-                'Accept': 'application/json',
-                'Authorization': 'Bearer ' + access_token,
-            }
-            url = self.base_url + 'packages/' + str(package_id) + '/workflow'
-            response = requests.post(url, headers=headers)
-
-            # Process the respon
-            # se
-            if response.status_code in (200, 201):
-                success = True
-                self._print_success()
+    # Sends call over the shared keep-alive session and returns its return value.
+    # Fails fast when the deadline has passed or the circuit breaker of the endpoint group is open.
+    def _execute(self, call):
+        if call.method is None:
+            return self._process_unsent(call)
+
+        deadline_at, breaker, rejection = self._admit(call)
+        if rejection is not None:
+            return self._fail_fast(call, *rejection)
+        if breaker is None:
+            return self._execute_with_retries(call, deadline_at)
+        healthy = None
+        try:
+            return self._execute_with_retries(call, deadline_at)
+        except self.transport.transient_errors:
+            healthy = False                 # Raised on the normal timeout: the deadline fails fast instead
+            raise
+        finally:
+            self._record_outcome(breaker, healthy, call)
+
+
+    # Sends call, retrying transient errors according to the retry policy of the call,
+    # with request timeouts and retries limited by deadline_at.
+    def _execute_with_retries(self, call, deadline_at):
+        self.last_function_name = call.function_name
+        instrumentation = self.instrumentation
+        if instrumentation is not None:
+            instrumentation.before_call(call.function_name, call.method, call.endpoint)
+        started_at = time.perf_counter()
+        headers = call.headers()
+        policy = self._retry_policy_for(call)
+        attempt = 0
+        token_refreshed = False
+        # The outcome passed to after_call(), which runs however the call ends
+        status_code = error = None
+        bytes_sent = bytes_received = 0
+        try:
+            while True:
+                attempt += 1
+                bytes_sent = bytes_received = 0
+                wait = self._reserve_slot(deadline_at)
+                if wait is not None:
+                    _sleep(wait)
+                timeout = self.timeout
+                if deadline_at is not None:
+                    time_left = deadline_at - time.monotonic()
+                    if wait is None or time_left <= 0:
+                        # The deadline passed between attempts, or would have passed by the time the
+                        # rate limiter lets this attempt through: this attempt is not sent
+                        attempt -= 1
+                        error = DeadlineExceededError(call.function_name, None, DEADLINE_EXCEEDED)
+                        return self._fail_fast(call, DeadlineExceededError, DEADLINE_EXCEEDED)
+                    timeout = clip_timeout(timeout, time_left)
+                sent_at = time.perf_counter()
+                try:
+                    response, bytes_sent = self._send(call, headers, timeout)
+                except self.transport.transient_errors as e:
+                    call.send_elapsed = time.perf_counter() - sent_at
+                    delay = self._retry_within_deadline(policy.retry_delay(call.method, attempt, exception=e),
+                                                        deadline_at)
+                    if delay is None:
+                        error = e
+                        if deadline_at is not None and time.monotonic() >= deadline_at:
+                            # The timeout was shortened to the time left before the deadline
+                            return self._fail_fast(call, DeadlineExceededError, DEADLINE_EXCEEDED)
+                        raise
+                else:
+                    call.send_elapsed = time.perf_counter() - sent_at
+                    delay = self._retry_within_deadline(policy.retry_delay(call.method, attempt, response.status_code,
+                                                                           response.headers.get('Retry-After')),
+                                                        deadline_at)
+                    if response.status_code == 429 and delay is not None and self.rate_limiter is not None:
+                        self.rate_limiter.pause(delay)
+                    # An upload from an iterator cannot be resent: its 401 is returned (or raised) as is
+                    if delay is None and not token_refreshed and self._token_rejected(call, response.status_code) \
+                            and self._can_resend(call):
+                        token_refreshed = True
+                        access_token = self.token_manager.get_token()
+                        if access_token and access_token != call.access_token:
+                            response.close()
+                            call.access_token = access_token
+                            headers = call.headers()
+                            continue
+                    if delay is None:
+                        if call.sink is not None and response.status_code in (200, 201):
+                            data = bytes_received = call.sink.write(response.iter_content(call.sink.chunk_size),
+                                                                    _content_length(response.headers))
+                        else:
+                            data = parse_body(response.text)
+                            bytes_received = len(response.content)
+                        status_code = response.status_code
+                        return self._process_response(call, headers, status_code, data,
+                                                      time.perf_counter() - started_at)
+                    response.close()
+                _sleep(delay)
+        except BaseException as e:
+            # Such as a failed download sink or a non-transient transport error
+            if error is None and status_code is None:
+                error = e
+            raise
+        finally:
+            if instrumentation is not None:
+                self._emit(call, status_code, time.perf_counter() - started_at, bytes_sent, bytes_received,
+                           max(attempt, 1), error)
+
+
+    # Sends one HTTP request over the transport. Returns (response, request body size).
+    # Responses of calls with a sink are streamed: their body is read by _execute().
+    def _send(self, call, headers, timeout):
+        stream = call.sink is not None
+        if call.content_type == OCTET_CONTENT:
+            upload = call.payload
+            if upload.rewindable:
+                upload.rewind()
+                data = upload                # Sent with a Content-Length header
             else:
-                self._print_response_error('POST', url, headers, None, response)
-
-        return success
-
+                data = iter(upload)          # Sent with chunked transfer encoding
+            response = self.transport.request(call.method, call.url, headers, data, timeout, stream)
+            return response, upload.position
+        data = encode_body(call)
+        response = self.transport.request(call.method, call.url, headers, data, timeout, stream)
+        return response, len(data) if data else 0
 
-    def _print_success(self):
-        self.last_error_message = None
-        print(self.last_function_name+'() completed successfully.')
 
+def _sleep(delay):
+    if delay > 0:
+        time.sleep(delay)
 
-    def _print_response_error(self, method, url, headers, payload, response):
-        self.last_error_message = response.json().get('Message', 'Unknown error')
-        print('ERROR: '+self.last_function_name+'() failed.')
-        print('error_message:', self.last_error_message)
 
-        if LOCAL_DEBUG:
-            print(method, url)
-            print('headers:', json.dumps(headers, indent=4))
-            if payload:
-                print('payload:', json.dumps(payload, indent=4))
-            print('status_code:', response.status_code)
+# Returns the Content-Length header value as an int, or None
+def _content_length(headers):
+    value = headers.get('Content-Length')
+    return int(value) if value and value.isdigit() else None
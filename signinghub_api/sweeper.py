@@ -0,0 +1,142 @@
+"""
+Copyright 2016, SolidBuilds.com. All rights reserved.
+Author: Ling Thio, ling.thio@gmail.com
+"""
+
+import datetime
+import re
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+from .deadline import bind_deadline
+from .results import SigningHubError, error_for_result
+from .retry import RateLimiter
+
+DEFAULT_SWEEP_WORKERS = 8                # Number of packages that are deleted in parallel
+
+
+# The outcome of sweeping one package.
+# - deleted: True if the package was deleted. Always False in dry-run mode.
+# - error:   None on success (and in dry-run mode)
+class SweepResult(object):
+    __slots__ = ('package_id', 'package_name', 'modified_on', 'deleted', 'error', 'dry_run')
+
+    def __init__(self, package, deleted=False, error=None, dry_run=False):
+        self.package_id = package['package_id']
+        self.package_name = package.get('package_name')
+        self.modified_on = package.get('modified_on')
+        self.deleted = deleted
+        self.error = error
+        self.dry_run = dry_run
+
+    @property
+    def success(self):
+        return self.error is None
+
+    def __repr__(self):
+        if self.dry_run:
+            return '<SweepResult %s would be deleted>' % self.package_id
+        if self.success:
+            return '<SweepResult %s deleted>' % self.package_id
+        return '<SweepResult %s failed: %s>' % (self.package_id, self.error)
+
+
+# Yields the package information records of stale packages, using api.iter_packages().
+# - older_than:   Only packages last modified more than this long ago: seconds or a datetime.timedelta (optional)
+# - status:       Only packages with this status. 'ALL' for any status.
+# - name_pattern: Only packages whose name matches this regular expression (re.search; optional)
+# - now:          The datetime that older_than is counted back from. Defaults to the local time,
+#                 which should match the time zone of 'modified_on'.
+# Packages without a (parsable) 'modified_on' are never considered older than older_than.
+# Raises a SigningHubError once the listing is exhausted if a page could not be retrieved,
+# so that a failed listing is not mistaken for 'nothing is stale'.
+def find_stale_packages(api, older_than=None, status='DRAFT', name_pattern=None, folder='INBOX',
+                        access_token=None, now=None):
+    cutoff = None
+    if older_than is not None:
+        if not isinstance(older_than, datetime.timedelta):
+            older_than = datetime.timedelta(seconds=older_than)
+        cutoff = (now or datetime.datetime.now()) - older_than
+    if isinstance(name_pattern, str):
+        name_pattern = re.compile(name_pattern)
+
+    for package in api.iter_packages(access_token, folder, status=status):
+        if status != 'ALL' and package.get('package_status') not in (None, status):
+            continue
+        if name_pattern is not None and not name_pattern.search(package.get('package_name') or ''):
+            continue
+        if cutoff is not None:
+            modified_on = parse_modified_on(package.get('modified_on'))
+            if modified_on is None or modified_on >= cutoff:
+                continue
+        yield package
+
+    # iter_packages() stops at the first page that could not be retrieved
+    result = api.last_result
+    if result is not None and result.error_message:
+        raise error_for_result(result)
+
+
+# Deletes packages on a pool of worker threads and yields a SweepResult per package, in order of completion.
+# - packages: Package information records (dicts with a 'package_id'), such as from find_stale_packages()
+# - dry_run:  If True, nothing is deleted
+# - rate:     Optional max number of deletes per second, on top of the api's own rate_limiter
+# At most 2 * max_workers packages are read ahead from packages.
+def iter_sweep_packages(api, packages, dry_run=False, access_token=None, max_workers=DEFAULT_SWEEP_WORKERS,
+                        rate=None):
+    if dry_run:
+        for package in packages:
+            yield SweepResult(package, dry_run=True)
+        return
+
+    rate_limiter = RateLimiter(rate) if rate else None
+
+    def delete(package):
+        if rate_limiter is not None:
+            rate_limiter.acquire()
+        try:
+            if api.delete_package(access_token, package['package_id']):
+                return SweepResult(package, deleted=True)
+            return SweepResult(package, error=api.last_error_message or 'Unknown error')
+        except SigningHubError as e:
+            return SweepResult(package, error=e.message)
+        except Exception as e:
+            return SweepResult(package, error=str(e) or e.__class__.__name__)
+
+    delete = bind_deadline(delete)
+    max_pending = 2 * max_workers
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        pending = set()
+        for package in packages:
+            pending.add(executor.submit(delete, package))
+            if len(pending) >= max_pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+
+
+# Finds stale packages (see find_stale_packages()) and deletes them in parallel (see iter_sweep_packages()).
+# The listing is read completely before the first delete, because deleting packages while paging
+# through the listing would shift later pages and skip packages.
+# Returns a list with one SweepResult per stale package.
+# Raises a SigningHubError, before anything is deleted, if the listing could not be retrieved completely.
+#
+#     results = sweep_packages(signinghub_api, older_than=24 * 3600, name_pattern='^2017 Contract', dry_run=True)
+def sweep_packages(api, older_than=None, status='DRAFT', name_pattern=None, folder='INBOX', dry_run=False,
+                   access_token=None, max_workers=DEFAULT_SWEEP_WORKERS, rate=None, now=None):
+    stale = list(find_stale_packages(api, older_than, status, name_pattern, folder, access_token, now))
+    return list(iter_sweep_packages(api, stale, dry_run, access_token, max_workers, rate))
+
+
+# Parses a 'modified_on' value, such as '2017-03-14T09:26:53.4' or '2017-03-14 09:26:53'.
+# Returns a naive datetime, or None if value cannot be parsed.
+def parse_modified_on(value):
+    if not value:
+        return None
+    try:
+        return datetime.datetime.strptime(value[:19].replace(' ', 'T'), '%Y-%m-%dT%H:%M:%S')
+    except ValueError:
+        return None
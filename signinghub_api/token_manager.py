@@ -0,0 +1,244 @@
+"""
+Copyright 2016, SolidBuilds.com. All rights reserved.
+Author: Ling Thio, ling.thio@gmail.com
+"""
+
+import threading
+import time
+
+DEFAULT_REFRESH_MARGIN = 60.0            # Refresh tokens this many seconds before they expire
+DEFAULT_EXPIRES_IN = 300.0               # Token lifetime to assume if the API does not return 'expires_in'
+MIN_REFRESH_INTERVAL = 1.0               # Min seconds between two background refreshes
+ISSUED_TOKENS = 8                        # Number of recently obtained access tokens that issued() recognizes
+
+
+# An access token together with its refresh token, its absolute expiry time and the time to refresh it.
+class AccessToken(object):
+    __slots__ = ('access_token', 'refresh_token', 'expires_at', 'refresh_at')
+
+    def __init__(self, access_token, refresh_token, expires_at, refresh_at=None):
+        self.access_token = access_token
+        self.refresh_token = refresh_token
+        self.expires_at = expires_at
+        self.refresh_at = refresh_at if refresh_at is not None else expires_at
+
+    def is_expired(self, now):
+        return now >= self.expires_at
+
+
+# Caches an access token and refreshes it ahead of expiry.
+# - fetch_token:    Callable(refresh_token) that returns the parsed /authenticate response, or None on failure.
+#                   refresh_token is None when a new token must be obtained with the password grant.
+# - refresh_margin: Refresh the token when it expires in less than this many seconds.
+#                   Short-lived tokens are refreshed halfway through their lifetime instead.
+#
+# Concurrent refreshes are single-flighted: only one thread calls fetch_token at a time.
+# While a refresh is in flight, other threads keep using the current token if it has not expired yet,
+# and wait for the refresh only if it has.
+class TokenManager(object):
+
+    def __init__(self, fetch_token, refresh_margin=DEFAULT_REFRESH_MARGIN, default_expires_in=DEFAULT_EXPIRES_IN,
+                 clock=time.time):
+        self.fetch_token = fetch_token
+        self.refresh_margin = refresh_margin
+        self.default_expires_in = default_expires_in
+        self.clock = clock
+        self._token = None
+        self._issued = ()                   # Recently obtained access tokens, newest last
+        self._lock = threading.Lock()
+        self._refresher = None
+        self._stop_event = threading.Event()
+
+
+    # Returns a valid access_token, refreshing it first if needed.
+    # Returns '' if no token could be obtained.
+    def get_token(self, force=False):
+        token = self._token
+        now = self.clock()
+        if token and not force and now < token.refresh_at:
+            return token.access_token
+
+        # Token is about to expire: refresh it unless another thread is already doing so
+        if token and not force and not token.is_expired(now):
+            if not self._lock.acquire(False):
+                return token.access_token
+        else:
+            self._lock.acquire()
+
+        try:
+            # Another thread may have refreshed the token while we were waiting for the lock
+            current = self._token
+            if current is not token and current and not force and not current.is_expired(self.clock()):
+                return current.access_token
+            new_token = self._fetch(current)
+            if new_token or not current or current.is_expired(self.clock()):
+                self._token = new_token
+                self._issued = _issued(self._issued, new_token)
+        finally:
+            self._lock.release()
+
+        return self._token.access_token if self._token else ''
+
+
+    # Returns True if access_token was obtained by this manager: the cached token or one it recently replaced.
+    def issued(self, access_token):
+        return access_token in self._issued
+
+
+    # Forgets the cached token, for example after the API rejected it.
+    def invalidate(self, access_token=None):
+        with self._lock:
+            if access_token is None or (self._token and self._token.access_token == access_token):
+                self._token = None
+
+
+    # Returns the number of seconds until the cached token expires, or None if no token is cached.
+    def expires_in(self):
+        token = self._token
+        return token.expires_at - self.clock() if token else None
+
+
+    # Starts a daemon thread that refreshes the token refresh_margin seconds before it expires,
+    # so that callers never have to wait for /authenticate.
+    def start_background_refresh(self):
+        if self._refresher is not None:
+            return
+        self._stop_event.clear()
+        self._refresher = threading.Thread(target=self._refresh_loop, name='SigningHubTokenRefresher')
+        self._refresher.daemon = True
+        self._refresher.start()
+
+
+    def stop_background_refresh(self):
+        refresher = self._refresher
+        if refresher is None:
+            return
+        self._stop_event.set()
+        refresher.join()
+        self._refresher = None
+
+
+    def _refresh_loop(self):
+        while not self._stop_event.is_set():
+            token = self._token
+            if token is None:
+                delay = 0
+            else:
+                delay = token.refresh_at - self.clock()
+            if delay > 0:
+                self._stop_event.wait(delay)
+                continue
+            try:
+                self.get_token(force=True)
+            except Exception:
+                pass                        # Keep refreshing, callers see the error on their next call
+            if self._token is None or self._token is token:
+                # Authentication failed: back off before trying again
+                self._stop_event.wait(max(self.refresh_margin / 4.0, 1.0))
+            else:
+                # Do not hammer /authenticate with tokens that (almost) expire on arrival
+                self._stop_event.wait(MIN_REFRESH_INTERVAL)
+
+
+    # Obtains a new token, preferring the refresh_token grant over the password grant.
+    def _fetch(self, current):
+        data = None
+        if current and current.refresh_token:
+            try:
+                data = self.fetch_token(current.refresh_token)
+            except Exception:
+                data = None                 # Fall back to the password grant
+        if not data:
+            data = self.fetch_token(None)
+        return token_from_response(data, self.clock(), self.default_expires_in, self.refresh_margin)
+
+
+# The asyncio counterpart of TokenManager.
+# - fetch_token: Coroutine function(refresh_token) that returns the parsed /authenticate response, or None.
+#
+# Concurrent refreshes within one event loop are single-flighted with an asyncio.Lock.
+class AsyncTokenManager(object):
+
+    def __init__(self, fetch_token, refresh_margin=DEFAULT_REFRESH_MARGIN, default_expires_in=DEFAULT_EXPIRES_IN,
+                 clock=time.time):
+        self.fetch_token = fetch_token
+        self.refresh_margin = refresh_margin
+        self.default_expires_in = default_expires_in
+        self.clock = clock
+        self._token = None
+        self._issued = ()
+        self._lock = None
+        self._refreshing = False
+
+
+    # Returns a valid access_token, refreshing it first if needed.
+    # Returns '' if no token could be obtained.
+    async def get_token(self, force=False):
+        token = self._token
+        now = self.clock()
+        if token and not force and now < token.refresh_at:
+            return token.access_token
+
+        # Token is about to expire: let the task that is already refreshing it do the work
+        if token and not force and not token.is_expired(now) and self._refreshing:
+            return token.access_token
+
+        if self._lock is None:
+            import asyncio              # Only imported here: SigningHubAPI does not need asyncio
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            current = self._token
+            if current is not token and current and not force and not current.is_expired(self.clock()):
+                return current.access_token
+            self._refreshing = True
+            try:
+                new_token = await self._fetch(current)
+            finally:
+                self._refreshing = False
+            if new_token or not current or current.is_expired(self.clock()):
+                self._token = new_token
+                self._issued = _issued(self._issued, new_token)
+
+        return self._token.access_token if self._token else ''
+
+
+    def issued(self, access_token):
+        return access_token in self._issued
+
+
+    # Forgets the cached token, for example after the API rejected it.
+    def invalidate(self, access_token=None):
+        if access_token is None or (self._token and self._token.access_token == access_token):
+            self._token = None
+
+
+    async def _fetch(self, current):
+        data = None
+        if current and current.refresh_token:
+            try:
+                data = await self.fetch_token(current.refresh_token)
+            except Exception:
+                data = None                 # Fall back to the password grant
+        if not data:
+            data = await self.fetch_token(None)
+        return token_from_response(data, self.clock(), self.default_expires_in, self.refresh_margin)
+
+
+# Returns the tuple of recently obtained access tokens with new_token added.
+# A new tuple is created, so that issued() can read it without taking the lock.
+def _issued(issued, new_token):
+    if new_token is None:
+        return issued
+    return (issued + (new_token.access_token,))[-ISSUED_TOKENS:]
+
+
+# Returns an AccessToken for the /authenticate response data, or None if data has no access_token.
+# The token is due for a refresh refresh_margin seconds before it expires, but no earlier than halfway
+# through its lifetime: a token that lives shorter than refresh_margin would otherwise be refreshed on every use.
+def token_from_response(data, now, default_expires_in=DEFAULT_EXPIRES_IN, refresh_margin=DEFAULT_REFRESH_MARGIN):
+    if not data or not data.get('access_token'):
+        return None
+    expires_in = data.get('expires_in')
+    expires_in = float(expires_in) if expires_in else default_expires_in
+    return AccessToken(data.get('access_token'), data.get('refresh_token'), now + expires_in,
+                       now + expires_in - min(refresh_margin, expires_in / 2.0))
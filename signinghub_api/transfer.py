@@ -0,0 +1,200 @@
+"""
+Copyright 2016, SolidBuilds.com. All rights reserved.
+Author: Ling Thio, ling.thio@gmail.com
+"""
+
+import io
+import mmap
+import os
+
+STREAM_CHUNK_SIZE = 64 * 1024            # Bytes per chunk of document uploads and downloads
+
+
+# A document upload body that is read in chunks, so only one chunk is held in memory at a time.
+# - source:   A file path, a binary file object, bytes, or an iterator of bytes chunks
+# - progress: Optional callable(bytes_sent, total_bytes) that is called after every chunk.
+#             total_bytes is None for iterators.
+#
+# Files given by path are memory-mapped, so their pages come from the OS page cache instead of
+# being copied into Python memory. Files, paths and bytes have a known size (sent as Content-Length)
+# and can be rewound when the upload is retried. Iterators are sent with chunked transfer encoding,
+# and uploads from iterators are never retried.
+class UploadStream(object):
+
+    def __init__(self, source, progress=None, chunk_size=STREAM_CHUNK_SIZE):
+        self.progress = progress
+        self.chunk_size = chunk_size
+        self.position = 0
+        self._file = None
+        self._owns_file = False
+        self._mmap = None
+        self._map = None                    # memoryview of the bytes or of the memory-mapped file
+        self._start = 0                     # Offset of the first byte to send
+        self._iterator = None
+        if _is_path(source):
+            self._file = open(source, 'rb')
+            self._owns_file = True
+            self._map_file()
+        elif isinstance(source, (bytes, bytearray, memoryview)):
+            self._map = memoryview(source)
+            self.size = len(self._map)
+        elif hasattr(source, 'read'):
+            self._file = source
+            self._map_file()
+        else:
+            self._iterator = iter(source)
+            self.size = None
+
+
+    # The file name to report to SigningHub, if the source is a path or a named file object
+    @property
+    def name(self):
+        name = getattr(self._file, 'name', None)
+        return os.path.basename(name) if isinstance(name, str) else None
+
+    @property
+    def rewindable(self):
+        return self._iterator is None
+
+
+    # Restarts the upload from the first byte, for retries
+    def rewind(self):
+        if self._iterator is not None:
+            raise ValueError('Uploads from an iterator cannot be rewound')
+        self.position = 0
+        if self._map is None:
+            self._file.seek(self._start)
+
+
+    # Returns the next chunk of at most size bytes (chunk_size if size is negative), or b'' at the end.
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = self.chunk_size
+        if self._iterator is not None:
+            chunk = next(self._iterator, b'')
+        elif self._map is not None:
+            offset = self._start + self.position
+            chunk = bytes(self._map[offset:offset + size])
+        else:
+            chunk = self._file.read(size)
+        if chunk:
+            self.position += len(chunk)
+            if self.progress is not None:
+                self.progress(self.position, self.size)
+        return chunk
+
+
+    def __iter__(self):
+        while True:
+            chunk = self.read(self.chunk_size)
+            if not chunk:
+                return
+            yield chunk
+
+
+    # Used by requests to send a Content-Length header
+    def __len__(self):
+        if self.size is None:
+            raise TypeError('Uploads from an iterator have no length')
+        return self.size - self.position
+
+
+    def close(self):
+        if self._map is not None:
+            self._map.release()
+            self._map = None
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+        if self._owns_file:
+            self._file.close()
+
+
+    # Memory-maps a regular file, from its current position on.
+    # In-memory files are read in chunks, and files that cannot seek (pipes, sockets) are streamed like iterators.
+    def _map_file(self):
+        try:
+            self._start = self._file.tell()
+            self.size = self._file.seek(0, os.SEEK_END) - self._start
+            self._file.seek(self._start)
+        except (AttributeError, OSError, io.UnsupportedOperation):
+            self._start = 0
+            self._iterator = iter(lambda: self._file.read(self.chunk_size), b'')
+            self.size = None
+            return
+        try:
+            if self.size > 0:
+                self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+                self._map = memoryview(self._mmap)
+        except (AttributeError, OSError, ValueError, io.UnsupportedOperation):
+            pass
+
+
+# Writes a document download to a file path or a binary file object, chunk by chunk.
+# - dest:     A file path or a binary file object. A path is first written to dest + '.part',
+#             and only renamed to dest when the download is complete.
+# - progress: Optional callable(bytes_received, total_bytes) that is called after every chunk.
+#             total_bytes is None if the response has no Content-Length.
+class DownloadSink(object):
+
+    def __init__(self, dest, progress=None, chunk_size=STREAM_CHUNK_SIZE):
+        self.dest = dest
+        self.progress = progress
+        self.chunk_size = chunk_size
+
+
+    # Writes all chunks. total is the expected number of bytes, if known. Returns the number of bytes written.
+    def write(self, chunks, total=None):
+        output, part_path = self._open()
+        try:
+            written = 0
+            for chunk in chunks:
+                written = self._write_chunk(output, chunk, written, total)
+        except BaseException:
+            self._abort(output, part_path)
+            raise
+        self._commit(output, part_path)
+        return written
+
+
+    # Writes all chunks of an async iterator. Returns the number of bytes written.
+    async def write_async(self, chunks, total=None):
+        output, part_path = self._open()
+        try:
+            written = 0
+            async for chunk in chunks:
+                written = self._write_chunk(output, chunk, written, total)
+        except BaseException:
+            self._abort(output, part_path)
+            raise
+        self._commit(output, part_path)
+        return written
+
+
+    def _open(self):
+        if _is_path(self.dest):
+            part_path = os.fspath(self.dest) + '.part'
+            return open(part_path, 'wb'), part_path
+        return self.dest, None
+
+    def _write_chunk(self, output, chunk, written, total):
+        if chunk:
+            output.write(chunk)
+            written += len(chunk)
+            if self.progress is not None:
+                self.progress(written, total)
+        return written
+
+    def _commit(self, output, part_path):
+        if part_path is not None:
+            output.close()
+            os.replace(part_path, self.dest)
+
+    def _abort(self, output, part_path):
+        if part_path is not None:
+            output.close()
+            os.remove(part_path)
+
+
+def _is_path(value):
+    return isinstance(value, (str, os.PathLike))
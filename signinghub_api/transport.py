@@ -0,0 +1,218 @@
+"""
+Copyright 2016, SolidBuilds.com. All rights reserved.
+Author: Ling Thio, ling.thio@gmail.com
+"""
+
+import http.client
+import socket
+import ssl
+import threading
+from urllib.parse import urlsplit
+
+from .transfer import STREAM_CHUNK_SIZE
+
+DEFAULT_POOL_CONNECTIONS = 4             # Number of per-host connection pools to cache
+DEFAULT_POOL_MAXSIZE = 10                # Max number of keep-alive connections per host
+
+
+# Creates a requests.Session with a keep-alive connection pool for both http and https.
+def create_session(pool_connections=DEFAULT_POOL_CONNECTIONS, pool_maxsize=DEFAULT_POOL_MAXSIZE, pool_block=False):
+    import requests                     # Imported on first use, to keep 'import signinghub_api' fast
+    from requests.adapters import HTTPAdapter
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize, pool_block=pool_block)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+# Returns the default transport: a RequestsTransport if requests is installed, and an HTTPClientTransport otherwise.
+def default_transport(pool_connections=DEFAULT_POOL_CONNECTIONS, pool_maxsize=DEFAULT_POOL_MAXSIZE):
+    try:
+        return RequestsTransport(pool_connections=pool_connections, pool_maxsize=pool_maxsize)
+    except ImportError:
+        return HTTPClientTransport(pool_maxsize=pool_maxsize)
+
+
+# A transport sends the HTTP requests of a SigningHubAPI instance. It offers:
+# - request(method, url, headers, body, timeout, stream): Sends one request and returns a response with
+#   status_code, headers, content, text, iter_content(chunk_size) and close(), like a requests.Response.
+#   body is None, bytes, an UploadStream or an iterator of bytes chunks. timeout is (connect, read) or a number.
+#   With stream=True, the response body is only read by iter_content().
+# - transient_errors: The exception classes of connection errors and timeouts, which may be retried
+# - close(): Releases the pooled connections
+#
+# The RequestsTransport sends requests over a keep-alive requests.Session.
+# - session: Optional requests.Session to use. Created (and closed by close()) otherwise.
+class RequestsTransport(object):
+
+    def __init__(self, session=None, pool_connections=DEFAULT_POOL_CONNECTIONS, pool_maxsize=DEFAULT_POOL_MAXSIZE):
+        import requests
+        self.transient_errors = (requests.ConnectionError, requests.Timeout)
+        self._owns_session = session is None
+        self.session = session if session is not None else create_session(pool_connections, pool_maxsize)
+
+
+    def request(self, method, url, headers, body=None, timeout=None, stream=False):
+        return self.session.request(method, url, headers=headers, data=body, timeout=timeout, stream=stream)
+
+
+    # Closes the session, if it was created by this transport
+    def close(self):
+        if self._owns_session:
+            self.session.close()
+
+
+# The HTTPClientTransport sends requests with the standard library's http.client only, for processes that
+# should start fast and not import requests, such as serverless functions and pre-forked workers.
+# - pool_maxsize: Max number of idle keep-alive connections kept per host
+# - ssl_context:  Optional ssl.SSLContext for https. Defaults to ssl.create_default_context() (verifies certificates).
+#
+# Connections are kept alive and reused by all threads. A request that fails on a reused connection before
+# a response is received (the server may have closed the idle connection) is sent once more on a new connection.
+class HTTPClientTransport(object):
+
+    transient_errors = (ConnectionError, TimeoutError, socket.timeout, socket.gaierror, ssl.SSLError,
+                        http.client.HTTPException)
+
+    def __init__(self, pool_maxsize=DEFAULT_POOL_MAXSIZE, ssl_context=None):
+        self.pool_maxsize = pool_maxsize
+        self.ssl_context = ssl_context
+        self._idle = {}                     # (scheme, host, port) -> list of idle connections
+        self._lock = threading.Lock()
+
+
+    def request(self, method, url, headers, body=None, timeout=None, stream=False):
+        parts = urlsplit(url)
+        key = (parts.scheme, parts.hostname, parts.port or (443 if parts.scheme == 'https' else 80))
+        path = (parts.path or '/') + ('?' + parts.query if parts.query else '')
+        headers = dict(headers)
+        if hasattr(body, 'rewindable') and body.rewindable:
+            headers['Content-Length'] = str(len(body))
+        connect_timeout, read_timeout = timeout if isinstance(timeout, (tuple, list)) else (timeout, timeout)
+
+        while True:
+            connection, reused = self._connection(key)
+            try:
+                if connection.sock is None:
+                    connection.timeout = connect_timeout
+                    connection.connect()
+                connection.sock.settimeout(read_timeout)
+                connection.request(method, path, body, headers)
+                response = connection.getresponse()
+            except ConnectionError:
+                connection.close()
+                if reused and _can_resend(body):
+                    if hasattr(body, 'rewind'):
+                        body.rewind()
+                    continue
+                raise
+            except BaseException:
+                connection.close()
+                raise
+            response = HTTPClientResponse(self, key, connection, response)
+            if not stream:
+                response.content            # Reads the body, which releases the connection
+            return response
+
+
+    # Closes all idle connections. Connections in use are closed when their response is done.
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, {}
+        for connections in idle.values():
+            for connection in connections:
+                connection.close()
+
+
+    # Returns (connection, True) for an idle connection, or (new connection, False)
+    def _connection(self, key):
+        with self._lock:
+            connections = self._idle.get(key)
+            if connections:
+                return connections.pop(), True
+        scheme, host, port = key
+        if scheme == 'https':
+            if self.ssl_context is None:
+                self.ssl_context = ssl.create_default_context()
+            return http.client.HTTPSConnection(host, port, context=self.ssl_context), False
+        return http.client.HTTPConnection(host, port), False
+
+
+    # Returns a connection to the pool, once its response has been read completely
+    def _release(self, key, connection):
+        with self._lock:
+            connections = self._idle.setdefault(key, [])
+            if len(connections) < self.pool_maxsize:
+                connections.append(connection)
+                return
+        connection.close()
+
+
+def _can_resend(body):
+    return body is None or isinstance(body, (bytes, bytearray)) or getattr(body, 'rewindable', False)
+
+
+# The response of an HTTPClientTransport request, with the parts of the requests.Response interface
+# that SigningHubAPI uses.
+class HTTPClientResponse(object):
+
+    def __init__(self, transport, key, connection, response):
+        self.status_code = response.status
+        self.headers = response.headers     # Case-insensitive get(), like requests
+        self._transport = transport
+        self._key = key
+        self._connection = connection
+        self._response = response
+        self._content = None
+
+
+    @property
+    def content(self):
+        if self._content is None:
+            try:
+                self._content = self._response.read()
+            except BaseException:
+                self.close()
+                raise
+            self._done()
+        return self._content
+
+    @property
+    def text(self):
+        return self.content.decode('utf-8', 'replace')
+
+
+    def iter_content(self, chunk_size=STREAM_CHUNK_SIZE):
+        if self._content is not None:
+            yield self._content
+            return
+        try:
+            while True:
+                chunk = self._response.read(chunk_size)
+                if not chunk:
+                    break
+                yield chunk
+        except BaseException:
+            self.close()
+            raise
+        self._content = b''
+        self._done()
+
+
+    # Discards the connection if the response body was not read completely
+    def close(self):
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+
+    # Returns the connection to the pool, or closes it if the server does not keep it alive
+    def _done(self):
+        connection, self._connection = self._connection, None
+        if connection is None:
+            return
+        if self._response.will_close:
+            connection.close()
+        else:
+            self._transport._release(self._key, connection)